@@ -0,0 +1 @@
+"Benchmarks for pywpas, run with: python -m benchmarks.<name>"
@@ -0,0 +1,202 @@
+"""
+Interface performance against the fake wpa_supplicant.
+
+Measures command round trip latency, commands per second (one at a time and
+pipelined), scan result throughput end to end, memory per parsed result,
+fan-out over several slow interfaces, roaming decisions, warm starts from
+the history cache and cached status reads.
+"""
+
+import os
+import time
+import tempfile
+import tracemalloc
+
+from pywpas import Control
+from pywpas.models import deserialize_scanned, iter_scanned
+from pywpas.roaming import Roamer
+from pywpas.history import HistoryCache
+from pywpas.cache import ReplyCache
+
+from .fake import FakeSupplicant
+
+from .bench_models import scan_results
+
+
+ROUNDS = 2000
+BSS_COUNTS = (100, 1000, 3000)
+
+
+def percentile(values, pct):
+    "Value below which pct percent of values fall."
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench_latency(interface):
+    "PING round trip times."
+    times = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        interface.ping()
+        times.append(time.perf_counter() - started)
+    print(f'{"round trip":<24} p50 {percentile(times, 50) * 1e6:>8.1f}us '
+          f'p99 {percentile(times, 99) * 1e6:>8.1f}us')
+
+
+def bench_throughput(interface):
+    "Commands per second, one at a time and pipelined."
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        interface._send_and_recv(b'PING')
+    single = ROUNDS / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for _ in range(ROUNDS // 50):
+        interface._pipeline([b'PING'] * 50)
+    pipelined = ROUNDS / (time.perf_counter() - started)
+    print(f'{"commands/s":<24} single {single:>10,.0f} '
+          f'pipelined {pipelined:>10,.0f}')
+
+
+def bench_scan_results():
+    "SCAN_RESULTS fetch, parse and merge rate."
+    for count in BSS_COUNTS:
+        with FakeSupplicant(bss_count=count) as fake:
+            control = Control(sock_path=fake.sock_path)
+            try:
+                interface = control.interface('wlan0')
+                best = None
+                for _ in range(5):
+                    interface.remove_results()
+                    started = time.perf_counter()
+                    interface.scan_results()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+            finally:
+                control.close()
+        print(f'{"scan_results":<24} {count:>6} rows '
+              f'{count / best:>12,.0f} rows/s')
+
+
+def bench_memory():
+    "Memory held per parsed scan result, and peak memory when streaming."
+    size = 10000
+    data = scan_results(size)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    networks = deserialize_scanned(data)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{"memory per result":<24} {(after - before) / size:>8.0f} bytes '
+          f'({len(networks)} results)')
+    del networks
+    for name, func in (
+            ('list, filtered', lambda: [
+                n for n in deserialize_scanned(data) if n.signal_level > -40]),
+            ('stream, filtered',
+             lambda: list(iter_scanned(data, min_signal=-40)))):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{"peak " + name:<24} {(peak - before) / 1024:>8.0f} KiB')
+
+
+def bench_fanout():
+    "status_all() over several interfaces with slow replies."
+    count, latency = 8, 0.02
+    with FakeSupplicant(interfaces=count, latency=latency) as fake:
+        control = Control(sock_path=fake.sock_path)
+        try:
+            control.map('ping')
+            started = time.perf_counter()
+            control.map('ping')
+            elapsed = time.perf_counter() - started
+        finally:
+            control.close()
+    print(f'{"map ping":<24} {count} interfaces, {latency * 1000:.0f}ms each: '
+          f'{elapsed * 1000:.1f}ms')
+
+
+def bench_roaming():
+    "Roamer.decide() with many BSSes of the current SSID."
+    count = 500
+    with FakeSupplicant(bss_count=count, ssid_count=1) as fake:
+        control = Control(sock_path=fake.sock_path)
+        try:
+            interface = control.interface('wlan0')
+            interface.scan_results()
+            roamer = Roamer(interface)
+            roamer.observe(interface.scan_index.values())
+            weakest = min(interface.scan_index.values(),
+                          key=lambda n: n.signal_level)
+            # pylint: disable=protected-access
+            roamer._bssid, roamer._ssid = weakest.bssid, weakest.ssid
+            started = time.perf_counter()
+            for _ in range(100):
+                roamer.decide()
+            elapsed = (time.perf_counter() - started) / 100
+        finally:
+            control.close()
+    print(f'{"roaming decide":<24} {count} candidates {elapsed * 1e6:>8.1f}us')
+
+
+def bench_history():
+    "Interface construction with a history cache, against a first scan."
+    count = BSS_COUNTS[-1]
+    with FakeSupplicant(bss_count=count) as fake, \
+            tempfile.TemporaryDirectory() as path:
+        control = Control(sock_path=fake.sock_path)
+        try:
+            cache = HistoryCache(os.path.join(path, 'wlan0.history'))
+            interface = control.interface('wlan0', history=cache)
+            started = time.perf_counter()
+            interface.scan_results()
+            cold = time.perf_counter() - started
+            interface.close()
+            started = time.perf_counter()
+            interface = control.interface('wlan0', history=cache)
+            warm = time.perf_counter() - started
+            size = os.path.getsize(cache.path)
+        finally:
+            control.close()
+    print(f'{"history warm start":<24} {count:>6} rows '
+          f'{warm * 1000:>8.1f}ms (scan results {cold * 1000:.1f}ms, '
+          f'{size / count:.0f} bytes/row)')
+
+
+def bench_cache(interface):
+    "status() calls per second, with and without the reply cache."
+    rates = []
+    for cache in (None, ReplyCache()):
+        interface.cache = cache
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            interface.status()
+        rates.append(ROUNDS / (time.perf_counter() - started))
+    interface.cache = None
+    print(f'{"status/s":<24} uncached {rates[0]:>10,.0f} '
+          f'cached {rates[1]:>10,.0f}')
+
+
+def main():
+    "Run all benchmarks."
+    with FakeSupplicant() as fake:
+        control = Control(sock_path=fake.sock_path)
+        try:
+            interface = control.interface('wlan0')
+            bench_latency(interface)
+            bench_throughput(interface)
+            bench_cache(interface)
+        finally:
+            control.close()
+    bench_scan_results()
+    bench_memory()
+    bench_fanout()
+    bench_roaming()
+    bench_history()
+
+
+if __name__ == '__main__':
+    main()
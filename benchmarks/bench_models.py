@@ -0,0 +1,90 @@
+"""
+Scan result parsing throughput.
+
+Compares the header-cached parser against the original per-row dataclass
+deserializer on 100, 1,000 and 10,000 row replies. Exits with an error if
+the parser is less than MIN_SPEEDUP times as fast for any size.
+"""
+
+import sys
+import timeit
+
+from dataclasses import dataclass
+
+from pywpas.models import deserialize_scanned
+from pywpas.utils import safe_decode
+
+
+HEADER = b'bssid / frequency / signal level / flags / ssid'
+SIZES = (100, 1000, 10000)
+MIN_SPEEDUP = 2.0
+
+
+@dataclass
+class _LegacyScanned:
+    bssid: str = None
+    frequency: int = None
+    signal_level: int = None
+    flags: str = None
+    ssid: str = None
+
+
+def _legacy_deserialize(header, network):
+    "The original per-row implementation, for comparison."
+    kwargs = {}
+    fields = safe_decode(header).split(' / ')
+    fields = map(lambda x: x.strip().replace(' ', '_'), fields)
+    values = safe_decode(network).split('\t')
+    for i, name in enumerate(fields):
+        try:
+            kwargs[name] = values[i].strip()
+        except IndexError:
+            kwargs[name] = None
+    kwargs['frequency'] = int(kwargs['frequency'])
+    kwargs['signal_level'] = int(kwargs['signal_level'])
+    if not kwargs['ssid']:
+        kwargs['ssid'] = None
+    return _LegacyScanned(**kwargs)
+
+
+def scan_results(rows: int) -> bytes:
+    "Build a SCAN_RESULTS reply with given number of rows."
+    lines = [HEADER]
+    for i in range(rows):
+        lines.append(
+            b'02:00:00:%02x:%02x:%02x\t%i\t%i\t[WPA2-PSK-CCMP][ESS]\tNetwork%i' % (
+                (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff,
+                (2412, 5180, 5745)[i % 3], -30 - i % 60, i))
+    return b'\n'.join(lines)
+
+
+def best_of(func, number):
+    "Best time per call in seconds."
+    return min(timeit.repeat(func, number=number, repeat=7)) / number
+
+
+def main():
+    "Print a table of rows/second for each implementation."
+    slow = []
+    print(f'{"rows":>8} {"legacy rows/s":>15} {"parser rows/s":>15} '
+          f'{"speedup":>8}')
+    for size in SIZES:
+        data = scan_results(size)
+        number = max(1, 10000 // size)
+
+        def _legacy(data=data):
+            lines = data.split(b'\n')
+            return [_legacy_deserialize(lines[0], l) for l in lines[1:]]
+
+        legacy = best_of(_legacy, number)
+        parser = best_of(lambda data=data: deserialize_scanned(data), number)
+        print(f'{size:>8} {size / legacy:>15,.0f} {size / parser:>15,.0f} '
+              f'{legacy / parser:>7.1f}x')
+        if legacy / parser < MIN_SPEEDUP:
+            slow.append(size)
+    if slow:
+        sys.exit(f'Parser less than {MIN_SPEEDUP}x as fast at {slow} rows')
+
+
+if __name__ == '__main__':
+    main()
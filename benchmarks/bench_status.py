@@ -0,0 +1,101 @@
+"""
+STATUS parsing cost.
+
+Compares the lazy InterfaceStatus against the original dataclass
+deserializer, for the common poll (read wpa_state) and reading every field.
+Only the poll is cheaper (about 2x), exits with an error if it falls under
+the speedup it is listed with. Reading every field costs about the same
+either way, it is reported but not checked.
+"""
+
+import sys
+import timeit
+
+from dataclasses import dataclass
+
+from pywpas.models import InterfaceStatus
+from pywpas.utils import safe_decode
+
+
+STATUS = b'bssid=08:02:8e:9c:9d:15\n' \
+         b'freq=2452\n' \
+         b'ssid=NachoWIFI\n' \
+         b'id=0\n' \
+         b'mode=station\n' \
+         b'pairwise_cipher=CCMP\n' \
+         b'group_cipher=CCMP\n' \
+         b'key_mgmt=WPA2-PSK\n' \
+         b'wpa_state=COMPLETED\n' \
+         b'ip_address=192.168.1.102\n' \
+         b'p2p_device_address=f8:59:71:93:d1:14\n' \
+         b'address=f8:59:71:93:d1:13\n' \
+         b'uuid=2ef7f1d9-83d9-5b92-9e5b-91b60c83ecf0'
+NUMBER = 20000
+
+
+@dataclass
+class _LegacyStatus:  # pylint: disable=too-many-instance-attributes
+    bssid: str
+    frequency: int
+    ssid: str
+    id: str  # pylint: disable=invalid-name
+    mode: str
+    wpa_state: str
+    pairwise_cipher: str
+    group_cipher: str
+    key_mgmt: str
+    ip_address: str
+    p2p_device_address: str
+    address: str
+    uuid: str
+
+
+def _legacy_deserialize(data):
+    "The original implementation, for comparison."
+    kwargs = {}
+    for line in data.split(b'\n'):
+        key, val = line.split(b'=')
+        kwargs[safe_decode(key)] = safe_decode(val)
+    kwargs['frequency'] = int(kwargs.pop('freq'))
+    return _LegacyStatus(**kwargs)
+
+
+def best_of(func):
+    "Best time per call in microseconds."
+    return min(timeit.repeat(func, number=NUMBER, repeat=7)) / NUMBER * 1e6
+
+
+def main():
+    "Print time per status for each implementation."
+    fields = ('bssid', 'frequency', 'ssid', 'id', 'mode', 'wpa_state',
+              'pairwise_cipher', 'group_cipher', 'key_mgmt', 'ip_address',
+              'p2p_device_address', 'address', 'uuid')
+
+    def _read_all(status):
+        for name in fields:
+            getattr(status, name)
+
+    # Name, legacy and lazy implementations, and the minimum speedup (None
+    # to only report it).
+    cases = (
+        ('wpa_state only',
+         lambda: _legacy_deserialize(STATUS).wpa_state,
+         lambda: InterfaceStatus(STATUS).wpa_state, 1.5),
+        ('all fields',
+         lambda: _read_all(_legacy_deserialize(STATUS)),
+         lambda: _read_all(InterfaceStatus(STATUS)), None),
+    )
+    print(f'{"access":<16} {"legacy us":>10} {"lazy us":>10} {"speedup":>8}')
+    slow = []
+    for name, legacy, lazy, minimum in cases:
+        legacy, lazy = best_of(legacy), best_of(lazy)
+        print(f'{name:<16} {legacy:>10.2f} {lazy:>10.2f} '
+              f'{legacy / lazy:>7.1f}x')
+        if minimum is not None and legacy / lazy < minimum:
+            slow.append(f'{name} (under {minimum}x)')
+    if slow:
+        sys.exit(f'Slower than expected: {", ".join(slow)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+A fake wpa_supplicant for tests and benchmarks.
+
+Serves any number of interfaces from one thread, each with a generated BSS
+table and its own network list. Replies can be delayed or dropped to
+simulate a slow or lossy supplicant, and events are sent to attached
+monitors like the real thing.
+"""
+
+import os
+import heapq
+import random
+import select
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from os.path import join as pathjoin
+
+
+REPLY_SIZE = 4096
+SCAN_HEADER = b'bssid / frequency / signal level / flags / ssid'
+NETWORKS_HEADER = b'network id / ssid / bssid / flags'
+FREQUENCIES = (2412, 2437, 2462, 5180, 5240, 5745, 5805)
+FLAGS = b'[WPA2-PSK-CCMP][ESS]'
+
+
+class FakeBSS:
+    "A BSS in the fake's table."
+    def __init__(self, i: int, ssids: int):
+        self.id = i
+        self.bssid = b'02:00:00:%02x:%02x:%02x' % (
+            (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+        self.freq = FREQUENCIES[i % len(FREQUENCIES)]
+        self.level = -30 - i % 60
+        self.ssid = b'Network%i' % (i % ssids)
+
+    def scan_row(self) -> bytes:
+        "Row of SCAN_RESULTS."
+        return b'%s\t%i\t%i\t%s\t%s' % (
+            self.bssid, self.freq, self.level, FLAGS, self.ssid)
+
+    def details(self, mask: int) -> bytes:
+        "Reply to BSS, with the fields selected by mask."
+        fields = (
+            (1 << 0, b'id=%i' % self.id),
+            (1 << 1, b'bssid=' + self.bssid),
+            (1 << 2, b'freq=%i' % self.freq),
+            (1 << 3, b'beacon_int=100'),
+            (1 << 4, b'capabilities=0x0431'),
+            (1 << 5, b'qual=0'),
+            (1 << 6, b'noise=-92'),
+            (1 << 7, b'level=%i' % self.level),
+            (1 << 8, b'tsf=0000001234567890'),
+            (1 << 9, b'age=2'),
+            (1 << 10, b'ie=0009' + self.ssid.hex().encode()),
+            (1 << 11, b'flags=' + FLAGS),
+            (1 << 12, b'ssid=' + self.ssid),
+            (1 << 19, b'snr=%i' % (self.level + 92)),
+            (1 << 20, b'est_throughput=65000'),
+        )
+        return b''.join(line + b'\n' for bit, line in fields if mask & bit)
+
+
+class FakeInterface:
+    "State of one fake interface."
+    def __init__(self, supplicant: 'FakeSupplicant', name: str):
+        self.supplicant = supplicant
+        self.name = name
+        self.path = pathjoin(supplicant.sock_path, name)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.monitors = set()
+        self.networks = {}
+        self.next_id = 0
+        self.current = None
+        self.tx = self.rx = 0
+
+    def status(self) -> bytes:
+        "Reply to STATUS."
+        lines = [b'address=02:00:00:ff:00:%02x' % (
+            sum(self.name.encode()) & 0xff)]
+        if self.current is None:
+            lines.append(b'wpa_state=DISCONNECTED')
+        else:
+            bss = self.supplicant.bss[0]
+            lines.extend([
+                b'bssid=' + bss.bssid,
+                b'freq=%i' % bss.freq,
+                b'ssid=' + self.networks[self.current].get(
+                    b'ssid', b'""').strip(b'"'),
+                b'id=%i' % self.current,
+                b'mode=station',
+                b'key_mgmt=WPA2-PSK',
+                b'wpa_state=COMPLETED',
+            ])
+        return b'\n'.join(lines)
+
+    def list_networks(self, last_id: int=-1) -> bytes:
+        "Reply to LIST_NETWORKS, cut short like wpa_supplicant's."
+        reply = NETWORKS_HEADER
+        for i in sorted(self.networks):
+            if i <= last_id:
+                continue
+            row = b'\n%i\t%s\tany\t%s' % (
+                i, self.networks[i].get(b'ssid', b'').strip(b'"'),
+                b'[CURRENT]' if i == self.current else b'')
+            if len(reply) + len(row) >= REPLY_SIZE:
+                break
+            reply += row
+        return reply
+
+    def bss_range(self, start: int, mask: int) -> bytes:
+        "Reply to BSS RANGE=, as many entries as fit a reply."
+        table = self.supplicant.bss
+        reply = b''
+        for bss in table[start:]:
+            entry = bss.details(mask)
+            if mask & (1 << 17):
+                entry += b'####\n' if bss is table[-1] else b'====\n'
+            if len(reply) + len(entry) >= REPLY_SIZE:
+                break
+            reply += entry
+        return reply
+
+    def handle(self, cmd: bytes) -> bytes:
+        "Reply to a command, and queue any events it causes."
+        name, _, args = cmd.partition(b' ')
+        supplicant = self.supplicant
+        if name == b'PING':
+            return b'PONG'
+        if name == b'ATTACH':
+            return b'OK'
+        if name == b'STATUS':
+            return self.status()
+        if name == b'SCAN':
+            # scan_time is that of a full scan, it shrinks with channels.
+            scan_time = supplicant.scan_time
+            for param in args.split():
+                if param.startswith(b'freq='):
+                    scan_time *= min(1.0, len(param[5:].split(b',')) /
+                                     len(FREQUENCIES))
+            supplicant.emit(b'<3>CTRL-EVENT-SCAN-STARTED ', self.name)
+            supplicant.emit(b'<3>CTRL-EVENT-SCAN-RESULTS ', self.name,
+                            scan_time)
+            return b'OK'
+        if name == b'SCAN_RESULTS':
+            return supplicant.scan_results
+        if name == b'BSS':
+            params = dict(p.split(b'=', 1) for p in args.split() if b'=' in p)
+            mask = int(params.get(b'MASK', b'0xffffffff'), 16)
+            if b'RANGE' in params:
+                return self.bss_range(int(params[b'RANGE'].rstrip(b'-')),
+                                      mask)
+            for bss in supplicant.bss:
+                if bss.bssid == args.split()[0]:
+                    return bss.details(mask)
+            return b'FAIL'
+        if name == b'LIST_NETWORKS':
+            _, _, last_id = args.partition(b'LAST_ID=')
+            return self.list_networks(int(last_id) if last_id else -1)
+        if name == b'ADD_NETWORK':
+            i, self.next_id = self.next_id, self.next_id + 1
+            self.networks[i] = {}
+            return b'%i' % i
+        if name in (b'SET_NETWORK', b'GET_NETWORK', b'REMOVE_NETWORK',
+                    b'SELECT_NETWORK'):
+            return self.network_command(name, args)
+        if name == b'DISCONNECT':
+            self.current = None
+            return b'OK'
+        if name == b'SIGNAL_POLL':
+            if self.current is None:
+                return b'FAIL'
+            return b'RSSI=-45\nLINKSPEED=300\nNOISE=9999\nFREQUENCY=5180'
+        if name == b'PKTCNT_POLL':
+            self.tx += 100
+            self.rx += 150
+            return b'TXGOOD=%i\nTXBAD=0\nRXGOOD=%i' % (self.tx, self.rx)
+        if name in (b'DETACH', b'SAVE_CONFIG', b'STOP_AP', b'ROAM',
+                    b'RECONNECT', b'REASSOCIATE'):
+            return b'OK'
+        return b'UNKNOWN COMMAND'
+
+    def network_command(self, name: bytes, args: bytes) -> bytes:
+        "Reply to the *_NETWORK commands that refer to an id."
+        parts = args.split(b' ', 2)
+        if parts[0] == b'all' and name == b'REMOVE_NETWORK':
+            self.networks.clear()
+            self.current = None
+            return b'OK'
+        try:
+            i = int(parts[0])
+        except ValueError:
+            return b'FAIL'
+        if i not in self.networks:
+            return b'FAIL'
+        if name == b'SET_NETWORK' and len(parts) == 3:
+            self.networks[i][parts[1]] = parts[2]
+            return b'OK'
+        if name == b'GET_NETWORK' and len(parts) == 2:
+            return self.networks[i].get(parts[1], b'FAIL')
+        if name == b'REMOVE_NETWORK':
+            del self.networks[i]
+            if self.current == i:
+                self.current = None
+            return b'OK'
+        if name == b'SELECT_NETWORK':
+            self.current = i
+            bssid = self.supplicant.bss[0].bssid
+            self.supplicant.emit(
+                b'<3>CTRL-EVENT-CONNECTED - Connection to %s completed '
+                b'[id=%i id_str=]' % (bssid, i), self.name,
+                self.supplicant.scan_time)
+            return b'OK'
+        return b'FAIL'
+
+
+class FakeSupplicant:
+    """
+    A fake wpa_supplicant serving several interfaces.
+
+    interfaces control sockets are created in sock_path (a new temporary
+    directory by default), the scan table holds bss_count BSSes spread
+    over ssid_count SSIDs. Each reply is delayed by latency seconds and
+    dropped with probability loss. Commands received are kept in commands,
+    replies can be overridden per command in replies (None to not answer).
+    """
+    def __init__(self, interfaces: int=1, bss_count: int=20,
+                 ssid_count: int=None, latency: float=0.0, loss: float=0.0,
+                 scan_time: float=0.0, sock_path: str=None, seed: int=0):
+        self._tempdir = sock_path is None
+        self.sock_path = sock_path or tempfile.mkdtemp()
+        self.latency = latency
+        self.loss = loss
+        self.scan_time = scan_time
+        self.replies = {}
+        self.commands = []
+        self.bss = [FakeBSS(i, ssid_count or bss_count)
+                    for i in range(bss_count)]
+        self.scan_results = b'\n'.join(
+            [SCAN_HEADER] + [bss.scan_row() for bss in self.bss])
+        self.interfaces = {}
+        for i in range(interfaces):
+            iface = FakeInterface(self, f'wlan{i}')
+            self.interfaces[iface.name] = iface
+        self._by_sock = {i.sock: i for i in self.interfaces.values()}
+        self._random = random.Random(seed)
+        self._queue = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._running = True
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def names(self):
+        "Interface names."
+        return list(self.interfaces)
+
+    def _later(self, delay, iface, address, data):
+        "Queue a datagram to send after delay seconds."
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._queue, (time.monotonic() + delay, self._seq,
+                                         iface, address, data))
+
+    def emit(self, event: bytes, name: str=None, delay: float=0.0) -> None:
+        "Send an event to monitors of given interface (or all of them)."
+        for iface in self.interfaces.values():
+            if name is None or iface.name == name:
+                for address in list(iface.monitors):
+                    self._later(delay, iface, address, event)
+
+    def _flush(self):
+        "Send queued datagrams that are due, returns time to the next."
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return 0.1
+                if self._queue[0][0] > now:
+                    return self._queue[0][0] - now
+                _, _, iface, address, data = heapq.heappop(self._queue)
+            try:
+                iface.sock.sendto(data, address)
+            except OSError:
+                # Client went away.
+                iface.monitors.discard(address)
+
+    def _receive(self, iface):
+        cmd, address = iface.sock.recvfrom(REPLY_SIZE)
+        self.commands.append((iface.name, cmd))
+        if cmd == b'ATTACH':
+            iface.monitors.add(address)
+        elif cmd == b'DETACH':
+            iface.monitors.discard(address)
+        if cmd in self.replies:
+            reply = self.replies[cmd]
+        else:
+            reply = iface.handle(cmd)
+        if reply is None or (self.loss and self._random.random() < self.loss):
+            return
+        if self.latency:
+            self._later(self.latency, iface, address, reply)
+            return
+        try:
+            iface.sock.sendto(reply, address)
+        except OSError:
+            pass
+
+    def _run(self):
+        socks = list(self._by_sock)
+        while self._running:
+            timeout = min(self._flush(), 0.1)
+            for sock in select.select(socks, [], [], timeout)[0]:
+                self._receive(self._by_sock[sock])
+
+    def stop(self) -> None:
+        "Stop serving and remove the sockets."
+        self._running = False
+        self._t.join()
+        for iface in self.interfaces.values():
+            iface.sock.close()
+            try:
+                os.remove(iface.path)
+            except FileNotFoundError:
+                pass
+        if self._tempdir:
+            shutil.rmtree(self.sock_path, ignore_errors=True)
@@ -1,6 +1,12 @@
 "All components of the public interface"
 
 from .control import Control
+from .aio import AsyncControl
 from .models import Profile
+from .metrics import Metrics
+from .exceptions import WpasError, TruncatedReplyError, CommandFailedError
 
-__all__ = ['Control', 'Profile']
+__all__ = [
+    'Control', 'AsyncControl', 'Profile', 'Metrics', 'WpasError',
+    'TruncatedReplyError', 'CommandFailedError',
+]
@@ -0,0 +1,393 @@
+"Asyncio communication with wpa_supplicant."
+# pylint: disable=too-many-instance-attributes
+
+import os
+import socket
+import asyncio
+import logging
+
+from collections import deque
+from typing import Iterable, List, Union
+from os.path import join as pathjoin, dirname
+
+from .control import DEFAULT_SOCK_PATH
+from .channel import RECV_TIMEOUT, DISCONNECTED_ERRORS, check_reply
+from .utils import (
+    tempnam, is_sock, safe_encode, safe_decode, find_sockets, scan_command,
+    client_prefix, remove_client_socket, Backoff,
+)
+from .scan import ScanIndex
+from .models import (
+    InterfaceStatus, Profile, Scanned, deserialize_scanned,
+    deserialize_profiles, PROFILE_FIELDS,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class _ControlProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol matching replies to requests.
+
+    wpa_supplicant answers commands in the order received, so each reply
+    resolves the oldest outstanding request. Requests given up on (timed
+    out) keep their place, their late reply is discarded. An error can't be
+    matched to the request that caused it, so every request fails and the
+    transport is closed, to be replaced.
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._waiters = deque()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        LOGGER.debug('received(%s) << %s', self._name, data)
+        if data.startswith(b'<'):
+            # Unsolicited message, not a reply.
+            return
+        if not self._waiters:
+            LOGGER.warning('Discarding unexpected reply on %s', self._name)
+            return
+        waiter = self._waiters.popleft()
+        # A cancelled waiter (timed out) still consumes its late reply.
+        if not waiter.done():
+            waiter.set_result(data)
+
+    def _fail(self, exc):
+        "Fail every request waiting for a reply."
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+    def error_received(self, exc):
+        LOGGER.debug('error(%s): %s', self._name, exc)
+        self._fail(exc)
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        self._fail(exc or ConnectionError())
+
+    @property
+    def closed(self) -> bool:
+        "True once the transport is closed (or closing)."
+        return self.transport is None or self.transport.is_closing()
+
+    @property
+    def outstanding(self) -> int:
+        "Number of requests waiting for their reply."
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    @property
+    def stale(self) -> int:
+        "Number of replies owed to requests given up on."
+        return len(self._waiters) - self.outstanding
+
+    def request(self, cmd: bytes) -> asyncio.Future:
+        "Send command, returns future resolved with the reply."
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        LOGGER.debug('sending(%s) >> %s', self._name, cmd)
+        self.transport.sendto(cmd)
+        return waiter
+
+
+class AsyncInterface:
+    """
+    Handle a unix:// datagram connection for a given interface using asyncio.
+
+    Commands may be issued concurrently, replies are matched to requests
+    without blocking the event loop. Reconnects if wpa_supplicant restarts,
+    like Channel.
+    """
+    def __init__(self, control: 'AsyncControl', name: str,
+                 recv_timeout: float=RECV_TIMEOUT):
+        self._control = control
+        self._name = name
+        self._recv_timeout = recv_timeout
+        self._protocol = None
+        self._lock = None
+        self._server_path = pathjoin(self._control._sock_path, self.name)
+        assert is_sock(self._server_path), 'Not a valid interface'
+        self._client_path = None
+        self._backoff = Backoff()
+        self._scanned = ScanIndex()
+        self._profiles = {}
+
+    def __del__(self):
+        self.close()
+
+    async def __aenter__(self):
+        await self._ensure_connection()
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    @property
+    def name(self):
+        "This interface's name."
+        return self._name
+
+    @property
+    def control(self) -> 'AsyncControl':
+        "The parent object which gives access to additional interfaces."
+        return self._control
+
+    @property
+    def profiles(self):
+        "Networks in wpa_supplicant.conf"
+        return list(self._profiles.values())
+
+    @property
+    def scanned(self):
+        "Networks found via scan()."
+        return self._scanned.values()
+
+    @property
+    def scan_index(self) -> ScanIndex:
+        "Networks found via scan(), indexed by BSSID, SSID and band."
+        return self._scanned
+
+    def close(self) -> None:
+        """
+        Close the transport and remove the client socket.
+        """
+        if self._protocol is None:
+            return
+        transport, self._protocol = self._protocol.transport, None
+        try:
+            transport.close()
+        except RuntimeError:
+            # Event loop closed already, the socket goes with the transport.
+            LOGGER.debug('Could not close transport of %s', self.name)
+        remove_client_socket(self._client_path)
+        self._client_path = None
+
+    async def _ensure_connection(self):
+        """
+        Open a datagram endpoint if not already established.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._protocol is not None:
+                if not self._protocol.closed:
+                    return
+                # Closed after an error, replace it.
+                self.close()
+            remaining = self._backoff.remaining()
+            if remaining:
+                raise ConnectionRefusedError(
+                    f'{self.name} unavailable, next attempt in '
+                    f'{remaining:.1f}s')
+            client_path = tempnam(dirname(self._server_path), client_prefix())
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            try:
+                sock.bind(client_path)
+                sock.connect(self._server_path)
+            except OSError:
+                sock.close()
+                if os.path.exists(client_path):
+                    os.remove(client_path)
+                LOGGER.info('Connecting to %s failed, retrying in %.1fs',
+                            self.name, self._backoff.failed())
+                raise
+            self._backoff.reset()
+            loop = asyncio.get_event_loop()
+            _, self._protocol = await loop.create_datagram_endpoint(
+                lambda: _ControlProtocol(self.name), sock=sock)
+            self._client_path = client_path
+
+    async def _send_and_recv(self, cmd: Union[str, bytes]) -> List[bytes]:
+        """
+        Send data to then read data from wpa_supplicant.
+
+        Returns an array of strings (one per line).
+        """
+        cmd = safe_encode(cmd)
+        try:
+            resp = await self._request(cmd)
+        except DISCONNECTED_ERRORS:
+            LOGGER.info('Lost connection to %s, reconnecting', self.name)
+            self.close()
+            resp = await self._request(cmd)
+        return resp.strip().split(b'\n')
+
+    async def _request(self, cmd: bytes) -> bytes:
+        await self._ensure_connection()
+        protocol = self._protocol
+        if protocol.stale and not protocol.outstanding:
+            # Give late replies already received a chance to be matched:
+            # one loop iteration polls the socket, the next runs callbacks.
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            if protocol is self._protocol and protocol.stale and \
+               not protocol.outstanding:
+                # They may never come (wpa_supplicant drops replies it can't
+                # send), replace the socket rather than mismatch replies.
+                LOGGER.debug('reopening(%s), %i replies lost', self.name,
+                             protocol.stale)
+                self.close()
+                await self._ensure_connection()
+        waiter = self._protocol.request(cmd)
+        try:
+            return await asyncio.wait_for(waiter, self._recv_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError() from None
+
+    async def _command(self, cmd: Union[str, bytes]) -> None:
+        "Send a command expecting an OK reply."
+        check_reply(cmd, b'\n'.join(await self._send_and_recv(cmd)))
+
+    async def ping(self) -> None:
+        "Connection test."
+        LOGGER.info('Pinging wpa_supplicant')
+        resp = await self._send_and_recv(b'PING')
+        assert resp == [b'PONG'], 'Did not receive proper reply'
+
+    async def status(self) -> InterfaceStatus:
+        "Get interface status."
+        LOGGER.info('Retrieving interface status')
+        return InterfaceStatus.deserialize(await self._send_and_recv('STATUS'))
+
+    async def scan(self, freqs: Iterable[int]=None,
+                   ssids: Iterable[str]=None, passive: bool=False,
+                   only_new: bool=False) -> None:
+        "Start scanning, see Interface.scan()."
+        LOGGER.info('Initiating scan')
+        await self._command(scan_command(freqs, ssids, passive, only_new))
+
+    async def scan_results(self) -> List[Scanned]:
+        "Return scan results."
+        LOGGER.info('Retrieving scan results')
+        networks = deserialize_scanned(
+            await self._send_and_recv(b'SCAN_RESULTS'))
+        for network in self._scanned.merge(networks):
+            LOGGER.info('Found network: %s', network)
+        return self.scanned
+
+    def remove_results(self):
+        "Remove scan results."
+        self._scanned.clear()
+
+    async def add_network(self, profile: Profile) -> None:
+        "Add network profile."
+        LOGGER.info('Adding network: %s', profile.ssid)
+        profile.id = int((await self._send_and_recv(b'ADD_NETWORK'))[0])
+        LOGGER.debug('Assigned id: %i', profile.id)
+        await asyncio.gather(*[
+            self._command(f'SET_NETWORK {profile.id} {field} {value}')
+            for field, value in profile.serialize().items()
+        ])
+        self._profiles[profile.id] = profile
+
+    async def list_networks(self, details: bool=False) -> List[Profile]:
+        """
+        List network profiles.
+
+        With details, key_mgmt, proto and ciphers are also loaded.
+        """
+        LOGGER.info('Listing networks')
+        profiles = deserialize_profiles(
+            await self._send_and_recv(b'LIST_NETWORKS'))
+        self._profiles = {profile.id: profile for profile in profiles}
+        if details:
+            fields = list(PROFILE_FIELDS)
+            replies = iter(await asyncio.gather(*[
+                self._send_and_recv(f'GET_NETWORK {profile.id} {field}')
+                for profile in profiles for field in fields
+            ]))
+            for profile in profiles:
+                for field in fields:
+                    value = b'\n'.join(next(replies))
+                    if value.startswith(b'FAIL'):
+                        value = None
+                    setattr(profile, PROFILE_FIELDS[field],
+                            safe_decode(value))
+        return profiles
+
+    async def remove_network(self, profile: Profile) -> None:
+        "Remove given network profile."
+        LOGGER.info('Removing network profile: %s', profile.ssid)
+        await self._command(f'REMOVE_NETWORK {profile.id}')
+        self._profiles.pop(profile.id, None)
+
+    async def remove_networks(self) -> None:
+        "Delete all network profiles."
+        LOGGER.info('Removing all network profiles')
+        await self._command(b'REMOVE_NETWORK all')
+        self._profiles.clear()
+
+    async def connect(self, profile: Profile) -> None:
+        "connect interface to given network."
+        if profile.id is None:
+            await self.add_network(profile)
+        LOGGER.info('Connecting to network: %s', profile.ssid)
+        await self._command(f'SELECT_NETWORK {profile.id}')
+
+    async def disconnect(self) -> None:
+        "Disconnect interface."
+        LOGGER.info('Disconnecting')
+        await self._command(b'DISCONNECT')
+
+    async def save_config(self) -> None:
+        "Save running config to file."
+        LOGGER.info('Saving configuration')
+        await self._command(b'SAVE_CONFIG')
+
+    async def stop_ap(self) -> None:
+        "Stop access point."
+        LOGGER.info('Stopping access point')
+        await self._command(b'STOP_AP')
+
+
+class AsyncControl:
+    """
+    Control wpa_supplicant from an asyncio event loop.
+
+    A single loop multiplexes the sockets of every interface.
+    """
+    def __init__(self, sock_path: str=DEFAULT_SOCK_PATH):
+        self._sock_path = sock_path
+        self._interfaces = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        "Close all interfaces"
+        LOGGER.info('Closing interfaces')
+        if self._interfaces is None:
+            return
+        for iface in self._interfaces:
+            iface.close()
+        self._interfaces = None
+
+    def interface(self, name: str, **kwargs) -> AsyncInterface:
+        "Get specific interface"
+        LOGGER.info('Connecting to interface %s', name)
+        return AsyncInterface(self, name, **kwargs)
+
+    def interface_names(self) -> List[str]:
+        "List of interface names"
+        return [interface.name for interface in self.interfaces]
+
+    @property
+    def interfaces(self) -> List[AsyncInterface]:
+        "List of interfaces"
+        if self._interfaces is None:
+            self._interfaces = [
+                AsyncInterface(self, name)
+                for name in find_sockets(self._sock_path)
+            ]
+        return self._interfaces
@@ -0,0 +1,148 @@
+"Cache of replies to read-only commands."
+
+import time
+import threading
+import logging
+
+from typing import Dict, Union
+
+from .models import (
+    Event, EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_TERMINATING,
+    EVENT_SSID_TEMP_DISABLED, EVENT_ASSOC_REJECT, EVENT_AUTH_REJECT,
+    EVENT_STATE_CHANGE, EVENT_SSID_REENABLED, EVENT_NETWORK_ADDED,
+    EVENT_NETWORK_REMOVED,
+)
+from .utils import safe_encode
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# Seconds replies are cached for, by command name.
+CACHE_TTLS = {
+    'STATUS': 1.0,
+    'LIST_NETWORKS': 10.0,
+    'GET_NETWORK': 30.0,
+}
+# Commands invalidating cached replies of given commands. Commands not
+# listed (e.g. SET_NETWORK) might change anything, so clear the cache.
+COMMAND_INVALIDATES = {
+    'PING': (),
+    'SCAN_RESULTS': (),
+    'BSS': (),
+    'SIGNAL_POLL': (),
+    'PKTCNT_POLL': (),
+    'MIB': (),
+    'GET': (),
+    'GET_CAPABILITY': (),
+    'SAVE_CONFIG': (),
+    'ATTACH': (),
+    'DETACH': (),
+    'SCAN': ('STATUS',),
+    'ABORT_SCAN': ('STATUS',),
+    'DISCONNECT': ('STATUS',),
+    'RECONNECT': ('STATUS',),
+    'REASSOCIATE': ('STATUS',),
+    'ROAM': ('STATUS',),
+}
+# Events invalidating cached replies of given commands, None for all.
+EVENT_INVALIDATES = {
+    EVENT_CONNECTED: ('STATUS',),
+    EVENT_DISCONNECTED: ('STATUS',),
+    EVENT_STATE_CHANGE: ('STATUS',),
+    EVENT_ASSOC_REJECT: ('STATUS',),
+    EVENT_AUTH_REJECT: ('STATUS',),
+    EVENT_SSID_TEMP_DISABLED: ('STATUS', 'LIST_NETWORKS'),
+    EVENT_SSID_REENABLED: ('STATUS', 'LIST_NETWORKS'),
+    EVENT_NETWORK_ADDED: None,
+    EVENT_NETWORK_REMOVED: None,
+    EVENT_TERMINATING: None,
+}
+
+
+def _name(cmd: bytes) -> str:
+    return cmd.split(b' ', 1)[0].decode('ascii', 'replace')
+
+
+class ReplyCache:
+    """
+    Replies to idempotent commands, kept for a few seconds.
+
+    Commands are cached for their TTL in ttls (by name, e.g. STATUS), others
+    are never cached. Sending any other command invalidates what it may
+    change (see COMMAND_INVALIDATES), as do events passed to on_event(). A
+    reply received after an invalidation that happened while it was in
+    flight is not cached, so it can't bring back older state.
+    """
+    def __init__(self, ttls: Dict[str, float]=None):
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.hits = self.misses = 0
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self) -> int:
+        "Incremented by each invalidation, pass it on to record()."
+        return self._generation
+
+    def get(self, cmd: Union[str, bytes]) -> bytes:
+        "Cached reply to cmd, or None."
+        cmd = safe_encode(cmd)
+        entry = self._entries.get(cmd)
+        if entry is not None and time.monotonic() < entry[1]:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def record(self, cmd: Union[str, bytes], reply: bytes,
+               generation: int) -> None:
+        """
+        Note a command sent, along with its reply (None if lost).
+
+        generation is the one read before sending the command.
+        """
+        cmd = safe_encode(cmd)
+        name = _name(cmd)
+        ttl = self.ttls.get(name)
+        if ttl is None:
+            if name in COMMAND_INVALIDATES:
+                self.invalidate(*COMMAND_INVALIDATES[name])
+            else:
+                self.clear()
+            return
+        if reply is None or reply.startswith(b'FAIL'):
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._entries[cmd] = (reply, time.monotonic() + ttl)
+
+    def invalidate(self, *names: str) -> None:
+        "Forget replies to commands of given names."
+        if not names:
+            return
+        with self._lock:
+            self._generation += 1
+            for cmd in [c for c in self._entries if _name(c) in names]:
+                del self._entries[cmd]
+
+    def clear(self) -> None:
+        "Forget all replies."
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def on_event(self, event: Event) -> None:
+        "Monitor callback, invalidates replies the event makes stale."
+        if event.name not in EVENT_INVALIDATES:
+            return
+        names = EVENT_INVALIDATES[event.name]
+        LOGGER.debug('%s invalidates %s', event.name, names or 'all')
+        if names is None:
+            self.clear()
+        else:
+            self.invalidate(*names)
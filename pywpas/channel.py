@@ -0,0 +1,420 @@
+"Request/response channel over a wpa_supplicant control socket."
+# pylint: disable=too-many-instance-attributes
+
+import os
+import time
+import queue
+import socket
+import threading
+import logging
+
+from select import select
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Union, Iterable, Iterator
+from os.path import dirname
+
+from .exceptions import CommandFailedError
+from .metrics import OUTCOME_OK, OUTCOME_FAIL, OUTCOME_TIMEOUT
+from .utils import (
+    tempnam, safe_encode, safe_decode, client_prefix, remove_client_socket,
+    Backoff, RecvBuffer,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+SEND_TIMEOUT = 5.0
+RECV_TIMEOUT = 5.0
+POOL_SIZE = 4
+# Errors sending to a wpa_supplicant that went away (or restarted).
+DISCONNECTED_ERRORS = (
+    ConnectionRefusedError, ConnectionResetError, FileNotFoundError,
+)
+
+
+class Channel:
+    """
+    A client socket bound and connected to an interface's control socket.
+
+    wpa_supplicant answers every command, in the order received. The channel
+    counts replies still owed for requests that were given up on (timeouts)
+    and discards them, so every reply is matched to the command that caused
+    it. Several commands can be pipelined before their replies are read.
+
+    Requests are serialized by a lock, so a channel may be shared between
+    threads. See ChannelPool to avoid them queueing behind one another.
+
+    If wpa_supplicant restarts the channel reconnects on the next request.
+    Failed reconnection attempts are spaced out with an increasing delay,
+    requests in between fail right away.
+
+    Set metrics to a Metrics instance to time requests. When None (the
+    default) nothing is measured.
+    """
+    def __init__(self, server_path: str, recv_timeout: float=RECV_TIMEOUT,
+                 name: str=None):
+        self._server_path = server_path
+        self._recv_timeout = recv_timeout
+        self._name = name or os.path.basename(server_path)
+        self._connection = None
+        self._client_path = None
+        self._buffer = RecvBuffer()
+        self._outstanding = 0
+        self._stale = 0
+        self._lock = threading.RLock()
+        self._backoff = Backoff()
+        self.metrics = None
+        # (command, send time) of measured requests awaiting a reply.
+        self._sent = deque()
+
+    @property
+    def connected(self) -> bool:
+        "True if the client socket is open."
+        return self._connection is not None
+
+    @property
+    def outstanding(self) -> int:
+        "Number of requests sent whose reply has not been read."
+        return self._outstanding
+
+    def fileno(self) -> int:
+        "File descriptor of the client socket, for use with select()."
+        return self._connection.fileno()
+
+    def open(self) -> None:
+        """
+        Open a connection if not already established.
+        """
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._connection is not None:
+            return
+        self._client_path = tempnam(dirname(self._server_path),
+                                    client_prefix())
+        self._connection = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._connection.bind(self._client_path)
+            self._connection.connect(self._server_path)
+        except OSError:
+            self._close()
+            raise
+        self._outstanding = self._stale = 0
+        self._sent.clear()
+
+    def _reconnect(self):
+        "(Re)open the connection, unless the last attempt failed recently."
+        remaining = self._backoff.remaining()
+        if remaining:
+            raise ConnectionRefusedError(
+                f'{self._name} unavailable, next attempt in {remaining:.1f}s')
+        self._close()
+        try:
+            self._open()
+        except OSError:
+            LOGGER.info('Connecting to %s failed, retrying in %.1fs',
+                        self._name, self._backoff.failed())
+            raise
+        self._backoff.reset()
+
+    def close(self) -> None:
+        """
+        Close the socket and remove the client socket file.
+        """
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._connection is None:
+            return
+        self._connection.close()
+        self._connection = None
+        remove_client_socket(self._client_path)
+        self._client_path = None
+
+    def read(self, timeout: float) -> Union[bytes, None]:
+        """
+        Read the next datagram, whatever it is.
+
+        Returns None if nothing arrives within timeout.
+        """
+        if self._connection not in select([self._connection], [], [],
+                                          timeout)[0]:
+            return None
+        return self._buffer.recv(self._connection)
+
+    def post(self, cmd: Union[str, bytes]) -> None:
+        """
+        Send a command whose reply will be read with read().
+
+        For connections reading all datagrams themselves (monitors), which
+        must set up a new connection (ATTACH) themselves: raises
+        ConnectionError rather than opening one.
+        """
+        with self._lock:
+            if self._connection is None:
+                raise ConnectionError(f'{self._name} not connected')
+            self._connection.send(safe_encode(cmd))
+
+    def drain(self) -> None:
+        """
+        Discard datagrams already waiting on the socket.
+
+        Only called with no requests outstanding, so anything waiting is a
+        late reply to an abandoned request (or an unsolicited message).
+        """
+        while True:
+            data = self.read(0)
+            if data is None:
+                break
+            LOGGER.debug('discarding(%s) << %s', self._name, data)
+            if self._stale and not data.startswith(b'<'):
+                self._stale -= 1
+
+    def send(self, cmd: Union[str, bytes]) -> None:
+        """
+        Send a command to wpa_supplicant.
+
+        Accepts a string or bytes. The reply must be read with recv(). If
+        replies to abandoned commands are still owed once those waiting are
+        drained, they may never come (wpa_supplicant drops replies it can't
+        send), so the socket is replaced rather than waiting on them.
+        """
+        with self._lock:
+            if self._connection is None:
+                self._reconnect()
+            if not self._outstanding:
+                self.drain()
+                if self._stale:
+                    LOGGER.debug('reopening(%s), %i replies lost',
+                                 self._name, self._stale)
+                    self._reconnect()
+            cmd = safe_encode(cmd)
+            LOGGER.debug('sending(%s) >> %s', self._name, cmd)
+            try:
+                self._connection.send(cmd)
+            except DISCONNECTED_ERRORS:
+                if self._outstanding:
+                    # Their replies are gone with the old socket.
+                    raise
+                LOGGER.info('Lost connection to %s, reconnecting',
+                            self._name)
+                self._reconnect()
+                self._connection.send(cmd)
+            self._outstanding += 1
+            if self.metrics is not None:
+                self._sent.append((cmd, time.perf_counter()))
+
+    def _measure(self, data):
+        "Record the outcome of the oldest measured request."
+        if len(self._sent) <= self._outstanding:
+            # The request was sent before metrics were enabled.
+            return
+        cmd, started = self._sent.popleft()
+        metrics = self.metrics
+        if metrics is None:
+            return
+        if data is None:
+            outcome = OUTCOME_TIMEOUT
+        elif data.startswith(b'FAIL'):
+            outcome = OUTCOME_FAIL
+        else:
+            outcome = OUTCOME_OK
+        metrics.observe(safe_decode(cmd.split(b' ', 1)[0]),
+                        time.perf_counter() - started, len(cmd),
+                        len(data) if data else 0, outcome)
+
+    def recv(self, timeout: float=None) -> bytes:
+        """
+        Read the reply to the oldest outstanding command.
+
+        Late replies to abandoned commands and unsolicited messages are
+        skipped. Raises TimeoutError if no reply arrives in time, the reply
+        is then considered stale and will be discarded when it arrives.
+        """
+        with self._lock:
+            return self._recv(self._recv_timeout if timeout is None
+                              else timeout)
+
+    def _recv(self, timeout):
+        assert self._outstanding, 'No outstanding requests'
+        while True:
+            data = self.read(timeout)
+            if data is None:
+                self._outstanding -= 1
+                self._stale += 1
+                if self._sent:
+                    self._measure(None)
+                raise TimeoutError()
+            if data.startswith(b'<'):
+                continue
+            if self._stale:
+                LOGGER.debug('discarding(%s) << %s', self._name, data)
+                self._stale -= 1
+                continue
+            self._outstanding -= 1
+            if self._sent:
+                self._measure(data)
+            data = data.strip()
+            LOGGER.debug('received(%s) << %s', self._name, data)
+            return data
+
+    def request(self, cmd: Union[str, bytes], timeout: float=None) -> bytes:
+        "Send a command and return its reply."
+        with self._lock:
+            self.send(cmd)
+            return self.recv(timeout)
+
+    def pipeline(self, cmds: Iterable[Union[str, bytes]],
+                 timeout: float=None) -> List[bytes]:
+        """
+        Send several commands, then collect their replies in order.
+
+        Saves waiting for each reply before sending the next command.
+        """
+        cmds = list(cmds)
+        with self._lock:
+            for cmd in cmds:
+                self.send(cmd)
+            replies = []
+            try:
+                for _ in cmds:
+                    replies.append(self.recv(timeout))
+            except TimeoutError:
+                # Replies to the remaining commands are stale too.
+                self._stale += self._outstanding
+                self._outstanding = 0
+                while self._sent:
+                    self._measure(None)
+                raise
+        return replies
+
+    def command(self, cmd: Union[str, bytes], timeout: float=None) -> None:
+        "Send a command expecting an OK reply."
+        check_reply(cmd, self.request(cmd, timeout))
+
+    def commands(self, cmds: Iterable[Union[str, bytes]],
+                 timeout: float=None) -> None:
+        "Pipeline several commands each expecting an OK reply."
+        cmds = list(cmds)
+        for cmd, reply in zip(cmds, self.pipeline(cmds, timeout)):
+            check_reply(cmd, reply)
+
+
+class ChannelPool:
+    """
+    A small pool of channels to one interface.
+
+    Each request checks out a channel of its own, so concurrent callers
+    (status pollers, scanners, config writers) don't wait on each other's
+    replies. At most size client sockets are bound, further callers wait
+    for one to be returned. Channels checked out use the pool's metrics.
+    With a ReplyCache assigned to cache, cached replies are returned
+    without a round trip.
+    """
+    def __init__(self, server_path: str, size: int=POOL_SIZE,
+                 recv_timeout: float=RECV_TIMEOUT, name: str=None):
+        self._server_path = server_path
+        self._recv_timeout = recv_timeout
+        self._name = name
+        self._idle = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(size)
+        self.metrics = None
+        self.cache = None
+
+    @contextmanager
+    def channel(self) -> Iterator[Channel]:
+        "Check out a channel for exclusive use."
+        self._available.acquire()
+        try:
+            try:
+                channel = self._idle.get_nowait()
+            except queue.Empty:
+                channel = Channel(self._server_path, self._recv_timeout,
+                                  self._name)
+            channel.metrics = self.metrics
+            try:
+                yield channel
+            finally:
+                self._idle.put(channel)
+        finally:
+            self._available.release()
+
+    def close(self) -> None:
+        """
+        Close idle channels.
+
+        Channels are reopened on demand, so the pool remains usable.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def request(self, cmd: Union[str, bytes], timeout: float=None) -> bytes:
+        "Send a command on a pooled channel and return its reply."
+        cache = self.cache
+        if cache is None:
+            with self.channel() as channel:
+                return channel.request(cmd, timeout)
+        reply = cache.get(cmd)
+        if reply is not None:
+            return reply
+        generation = cache.generation
+        try:
+            with self.channel() as channel:
+                reply = channel.request(cmd, timeout)
+        finally:
+            cache.record(cmd, reply, generation)
+        return reply
+
+    def pipeline(self, cmds: Iterable[Union[str, bytes]],
+                 timeout: float=None) -> List[bytes]:
+        """
+        Pipeline commands on a pooled channel and return their replies.
+
+        Only commands without a cached reply are sent.
+        """
+        cache = self.cache
+        if cache is None:
+            with self.channel() as channel:
+                return channel.pipeline(cmds, timeout)
+        cmds = list(cmds)
+        replies = [cache.get(cmd) for cmd in cmds]
+        missing = [i for i, reply in enumerate(replies) if reply is None]
+        if not missing:
+            return replies
+        generation = cache.generation
+        try:
+            with self.channel() as channel:
+                received = channel.pipeline(
+                    [cmds[i] for i in missing], timeout)
+        except BaseException:
+            for i in missing:
+                cache.record(cmds[i], None, generation)
+            raise
+        for i, reply in zip(missing, received):
+            cache.record(cmds[i], reply, generation)
+            replies[i] = reply
+        return replies
+
+    def command(self, cmd: Union[str, bytes], timeout: float=None) -> None:
+        "Send a command expecting an OK reply on a pooled channel."
+        check_reply(cmd, self.request(cmd, timeout))
+
+    def commands(self, cmds: Iterable[Union[str, bytes]],
+                 timeout: float=None) -> None:
+        "Pipeline commands each expecting an OK reply on a pooled channel."
+        cmds = list(cmds)
+        for cmd, reply in zip(cmds, self.pipeline(cmds, timeout)):
+            check_reply(cmd, reply)
+
+
+def check_reply(cmd: Union[str, bytes], reply: bytes) -> None:
+    "Raise CommandFailedError unless reply is OK."
+    if reply != b'OK':
+        raise CommandFailedError(cmd, reply)
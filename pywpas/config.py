@@ -0,0 +1,118 @@
+"Network blocks of wpa_supplicant.conf files."
+
+import logging
+
+from typing import IO, Iterable, Iterator, Tuple, Union
+
+from .models import Profile, PROFILE_FIELDS
+from .utils import is_hex_psk
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+BLOCK_START = 'network={'
+BLOCK_END = '}'
+
+
+def _unquote(value: str) -> str:
+    "Value of a quoted string, or None if value is not quoted."
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return None
+
+
+def _ssid(value: str, lineno: int) -> str:
+    "ssid field, quoted or hex encoded."
+    ssid = _unquote(value)
+    if ssid is not None:
+        return ssid
+    try:
+        return bytes.fromhex(value).decode('utf-8')
+    except ValueError as e:
+        raise ValueError(f'Line {lineno}: invalid ssid {value}') from e
+
+
+def parse_network(fields: Iterable[Tuple[str, str]],
+                  lineno: int=0) -> Profile:
+    "Profile of (field, value) pairs of a network block."
+    profile = Profile()
+    for name, value in fields:
+        if name == 'ssid':
+            profile.ssid = _ssid(value, lineno)
+        elif name == 'psk':
+            psk = _unquote(value)
+            if psk is None and not is_hex_psk(value):
+                raise ValueError(f'Line {lineno}: invalid psk')
+            profile.psk = value if psk is None else psk
+        elif name == 'bssid':
+            profile.bssid = value
+        elif name in PROFILE_FIELDS:
+            setattr(profile, PROFILE_FIELDS[name], value)
+        else:
+            profile.extra[name] = value
+    return profile
+
+
+def iter_config(lines: Iterable[str]) -> Iterator[Profile]:
+    """
+    Yield a Profile per network block of a wpa_supplicant.conf.
+
+    Lines are read as they come, so files of any size can be streamed.
+    Global settings and comments are skipped. Raises ValueError on
+    malformed blocks.
+    """
+    fields, start = None, 0
+    lineno = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if fields is None:
+            if line == BLOCK_START:
+                fields, start = [], lineno
+            continue
+        if line == BLOCK_END:
+            yield parse_network(fields, start)
+            fields = None
+            continue
+        name, sep, value = line.partition('=')
+        if not sep or not name:
+            raise ValueError(f'Line {lineno}: expected field=value')
+        fields.append((name.strip(), value.strip()))
+    if fields is not None:
+        raise ValueError(f'Line {lineno}: network block at line {start} '
+                         'not closed')
+
+
+def read_config(path: str) -> Iterator[Profile]:
+    "Yield a Profile per network block of given file."
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_config(f)
+
+
+def format_network(profile: Profile) -> str:
+    "Network block of a profile."
+    lines = [BLOCK_START]
+    lines.extend(f'\t{name}={value}'
+                 for name, value in profile.serialize().items())
+    lines.append(BLOCK_END)
+    return '\n'.join(lines) + '\n'
+
+
+def write_config(profiles: Iterable[Profile], dest: Union[str, IO]) -> int:
+    """
+    Write network blocks of profiles to a file name or object.
+
+    Returns the number of blocks written.
+    """
+    if isinstance(dest, str):
+        with open(dest, 'w', encoding='utf-8') as f:
+            return write_config(profiles, f)
+    count = 0
+    for profile in profiles:
+        if count:
+            dest.write('\n')
+        dest.write(format_network(profile))
+        count += 1
+    return count
@@ -1,12 +1,20 @@
 "Control interface for wpa_supplicant"
+# pylint: disable=too-many-instance-attributes
 
 import os
+import threading
 import logging
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Union, Callable
+from os.path import join as pathjoin
 
 from .interface import Interface
-from .utils import find_sockets
+from .channel import ChannelPool, POOL_SIZE
+from .models import InterfaceStatus
+from .discovery import SocketWatcher, POLL_INTERVAL
+from .history import HistoryCache
+from .utils import find_sockets, sweep_sockets
 
 
 LOGGER = logging.getLogger(__name__)
@@ -18,10 +26,27 @@ DEFAULT_SOCK_PATH = os.environ.get('WPA_SOCK', '/var/run/wpa_supplicant')
 class Control:
     """
     Control wpa_supplicant.
+
+    Interfaces are discovered by listing sock_path once. Call watch() to
+    keep them up to date as interfaces come and go (hot-plugged radios).
+    With sweep, client sockets left in sock_path by processes that died are
+    removed first. With history_dir, each interface keeps its scan history
+    and profiles in a HistoryCache there (<name>.history), for warm starts.
     """
-    def __init__(self, sock_path: str=DEFAULT_SOCK_PATH):
+    def __init__(self, sock_path: str=DEFAULT_SOCK_PATH,
+                 pool_size: int=POOL_SIZE, sweep: bool=True,
+                 history_dir: str=None):
         self._sock_path = sock_path
+        self._history_dir = history_dir
+        if sweep:
+            sweep_sockets(sock_path)
+        self._pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
         self._interfaces = None
+        self._watcher = None
+        self._on_add = []
+        self._on_remove = []
 
     def __del__(self):
         self.close()
@@ -29,17 +54,45 @@ class Control:
     def close(self) -> None:
         "Close all interfaces"
         LOGGER.info('Closing interfaces')
-        if self._interfaces is None:
+        self.unwatch()
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            interfaces, self._interfaces = self._interfaces, None
+        if interfaces is None:
             LOGGER.debug('No interfaces')
             return
-        for iface in self._interfaces:
+        for iface in interfaces.values():
             iface.close()
-        self._interfaces = None
+
+    def pool(self, name: str) -> ChannelPool:
+        "Pool of client sockets shared by all users of an interface."
+        with self._lock:
+            if name not in self._pools:
+                self._pools[name] = ChannelPool(
+                    pathjoin(self._sock_path, name), self._pool_size,
+                    name=name)
+            return self._pools[name]
+
+    def _create(self, name: str, **kwargs) -> Interface:
+        "New Interface, with its history cache if enabled."
+        if self._history_dir is not None and 'history' not in kwargs:
+            kwargs['history'] = HistoryCache(
+                pathjoin(self._history_dir, f'{name}.history'))
+        return Interface(self, name, **kwargs)
 
     def interface(self, name: str, **kwargs) -> Interface:
-        "Get specific interface"
+        """
+        Get specific interface
+
+        A known interface is returned as is, unless options are given.
+        """
+        if not kwargs:
+            interface = (self._interfaces or {}).get(name)
+            if interface is not None:
+                return interface
         LOGGER.info('Connecting to interface %s', name)
-        return Interface(self, name, **kwargs)
+        return self._create(name, **kwargs)
 
     def interface_names(self):
         "List of interface names"
@@ -52,8 +105,124 @@ class Control:
     def interfaces(self) -> List[Interface]:
         "List of interfaces"
         LOGGER.info('Listing interfaces')
-        if self._interfaces is None:
-            self._interfaces = []
-            for name in find_sockets(self._sock_path):
-                self._interfaces.append(Interface(self, name))
-        return self._interfaces
+        interfaces = self._interfaces
+        if interfaces is None:
+            interfaces = {
+                name: self._create(name)
+                for name in find_sockets(self._sock_path)
+            }
+            with self._lock:
+                if self._interfaces is None:
+                    self._interfaces = interfaces
+                interfaces = self._interfaces
+        return list(interfaces.values())
+
+    def watch(self, on_add: Callable[[Interface], None]=None,
+              on_remove: Callable[[Interface], None]=None,
+              interval: float=POLL_INTERVAL) -> None:
+        """
+        Keep interfaces up to date as their sockets come and go.
+
+        sock_path is watched with inotify, or polled every interval seconds
+        where inotify is not available. Callbacks are called (from the
+        watcher thread) with each interface added or removed from then on.
+        Removed interfaces are closed.
+        """
+        if on_add is not None:
+            self._on_add.append(on_add)
+        if on_remove is not None:
+            self._on_remove.append(on_remove)
+        if self._watcher is not None:
+            return
+        # Interfaces present now are known, not added.
+        self.interfaces  # pylint: disable=pointless-statement
+        self._watcher = SocketWatcher(
+            self._sock_path, self._added, self._removed, interval)
+        self._watcher.start()
+
+    def unwatch(self) -> None:
+        "Stop watching for interfaces, callbacks are forgotten."
+        if self._watcher is None:
+            return
+        self._watcher.stop()
+        self._watcher = None
+        self._on_add.clear()
+        self._on_remove.clear()
+
+    def _added(self, name):
+        """
+        Watcher callback for a new socket.
+
+        If the interface can't be set up the error is raised and the name
+        is not added, the watcher reports it again.
+        """
+        with self._lock:
+            if name in (self._interfaces or {}):
+                return
+        interface = self._create(name)
+        with self._lock:
+            if self._interfaces is None:
+                self._interfaces = {}
+            known = self._interfaces.setdefault(name, interface)
+        if known is not interface:
+            # Listed by another thread meanwhile.
+            interface.close()
+            return
+        for callback in self._on_add:
+            callback(interface)
+
+    def _removed(self, name):
+        "Watcher callback for a socket gone."
+        with self._lock:
+            interface = (self._interfaces or {}).pop(name, None)
+            pool = self._pools.pop(name, None)
+        if pool is not None:
+            pool.close()
+        if interface is None:
+            return
+        interface.close()
+        for callback in self._on_remove:
+            callback(interface)
+
+    def map(self, op: Union[str, callable], *args, timeout: float=None,
+            **kwargs) -> Dict[str, Any]:
+        """
+        Run an operation on every interface at once.
+
+        op is an Interface method name (e.g. 'scan') or a callable taking
+        the interface as first argument. Operations run concurrently, so the
+        wall time is that of the slowest interface. Returns results by
+        interface name. Interfaces that failed, or did not finish within
+        timeout seconds, map to the exception instead (TimeoutError).
+        """
+        interfaces = self.interfaces
+        if not interfaces:
+            return {}
+        if isinstance(op, str):
+            op = getattr(Interface, op)
+        LOGGER.info('Running %s on %i interfaces', op, len(interfaces))
+        executor = ThreadPoolExecutor(max_workers=len(interfaces))
+        try:
+            futures = {
+                iface.name: executor.submit(op, iface, *args, **kwargs)
+                for iface in interfaces
+            }
+            wait(futures.values(), timeout=timeout)
+        finally:
+            # Don't wait for stragglers, their results are discarded.
+            executor.shutdown(wait=False)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = TimeoutError()
+            elif future.exception() is not None:
+                results[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results
+
+    def status_all(self, timeout: float=None
+                   ) -> Dict[str, Union[InterfaceStatus, Exception]]:
+        "Status of every interface, see map()."
+        return self.map('status', timeout=timeout)
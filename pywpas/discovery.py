@@ -0,0 +1,216 @@
+"Watch a control socket directory for interfaces coming and going."
+# pylint: disable=too-many-instance-attributes
+
+import os
+import stat
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+from select import select
+from typing import Callable, Set
+from os.path import join as pathjoin
+
+from .utils import find_sockets, SOCKET_PREFIX, Worker
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+POLL_INTERVAL = 1.0
+# Wait this long for more events before acting on a batch.
+SETTLE_TIME = 0.02
+
+# From <sys/inotify.h>.
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+IN_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+IN_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    "libc if it provides inotify, otherwise None."
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1  # pylint: disable=pointless-statement
+        libc.inotify_add_watch  # pylint: disable=pointless-statement
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class SocketWatcher(Worker):
+    """
+    Report sockets added to or removed from a directory.
+
+    Uses inotify (through ctypes) where available, so the directory is only
+    listed again when the kernel reports a change there. Elsewhere, or if
+    inotify can't be set up, the directory is polled every interval
+    seconds. While the directory does not exist (it is removed when
+    wpa_supplicant stops) it is polled too, until it can be watched again.
+    Callbacks receive the socket name and run on the watcher thread. Client
+    sockets (see SOCKET_PREFIX) are ignored.
+    """
+    def __init__(self, path: str, on_add: Callable[[str], None],
+                 on_remove: Callable[[str], None],
+                 interval: float=POLL_INTERVAL, use_inotify: bool=True):
+        self._path = path
+        self._on_add = on_add
+        self._on_remove = on_remove
+        self._interval = interval
+        self._use_inotify = use_inotify
+        self._names = set()
+        self._libc = None
+        self._fd = None
+        # Watch descriptor of the directory, None while not watched.
+        self._wd = None
+        super().__init__()
+
+    @property
+    def names(self) -> Set[str]:
+        "Sockets currently present."
+        return set(self._names)
+
+    @property
+    def inotify(self) -> bool:
+        "True if changes are reported by inotify rather than polling."
+        return self._wd is not None
+
+    def _setup_inotify(self):
+        libc = _load_inotify() if self._use_inotify else None
+        if libc is None:
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            LOGGER.warning('inotify_init1 failed: %s',
+                           os.strerror(ctypes.get_errno()))
+            return
+        self._libc, self._fd = libc, fd
+        if not self._watch():
+            LOGGER.warning('inotify_add_watch(%s) failed: %s', self._path,
+                           os.strerror(ctypes.get_errno()))
+
+    def _watch(self) -> bool:
+        "Add the inotify watch of the directory, returns True on success."
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self._path),
+                                          IN_MASK)
+        if wd < 0:
+            return False
+        self._wd = wd
+        return True
+
+    def sync(self) -> None:
+        "List the directory and report differences since the last time."
+        try:
+            names = set(find_sockets(self._path))
+        except FileNotFoundError:
+            names = set()
+        for name in sorted(self._names - names):
+            self._removed(name)
+        for name in sorted(names - self._names):
+            self._added(name)
+
+    def _added(self, name):
+        if name in self._names or name.startswith(SOCKET_PREFIX):
+            return
+        try:
+            if not stat.S_ISSOCK(os.stat(pathjoin(self._path, name)).st_mode):
+                return
+        except FileNotFoundError:
+            return
+        LOGGER.info('Interface added: %s', name)
+        self._names.add(name)
+        try:
+            self._on_add(name)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Error in add callback for %s', name)
+            # Not added, try again on the next change (or poll).
+            self._names.discard(name)
+
+    def _removed(self, name):
+        if name not in self._names:
+            return
+        LOGGER.info('Interface removed: %s', name)
+        self._names.discard(name)
+        try:
+            self._on_remove(name)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Error in remove callback for %s', name)
+
+    def _read_inotify(self):
+        """
+        Handle queued inotify events.
+
+        Events are collected until SETTLE_TIME passes without more, then
+        each name involved is checked once. A socket is created as a file
+        by some (mkstemp, then bind) so only its final state counts.
+        """
+        touched = set()
+        while select([self._fd], [], [], SETTLE_TIME)[0]:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = IN_EVENT.unpack_from(data, offset)
+                offset += IN_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    # Lost track, start over from a listing.
+                    touched = None
+                elif wd != self._wd:
+                    # Left over from a watch since removed.
+                    LOGGER.debug('Ignoring event of watch %i', wd)
+                elif mask & (IN_DELETE_SELF | IN_IGNORED):
+                    # The directory is gone, poll until it comes back.
+                    LOGGER.info('%s removed, polling', self._path)
+                    self._wd = None
+                    touched = None
+                elif touched is not None:
+                    touched.add(os.fsdecode(
+                        data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+        if touched is None:
+            self.sync()
+            return
+        for name in sorted(touched):
+            if os.path.exists(pathjoin(self._path, name)):
+                self._added(name)
+            else:
+                self._removed(name)
+
+    def _run(self):
+        "Watcher thread entry point."
+        while not self._stopped.is_set():
+            if self._wd is None:
+                self._stopped.wait(self._interval)
+                # Watch first, so nothing is missed before the listing.
+                if self._fd is not None and self._watch():
+                    LOGGER.info('Watching %s again', self._path)
+                self.sync()
+            elif select([self._fd], [], [], self._interval)[0]:
+                self._read_inotify()
+
+    def start(self) -> None:
+        "Start watching in the background."
+        if self.running:
+            return
+        self._setup_inotify()
+        # Events from now on are queued, so nothing is missed in between.
+        self.sync()
+        super().start()
+
+    def stop(self) -> None:
+        "Stop watching."
+        super().stop()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = self._wd = None
@@ -0,0 +1,17 @@
+"Exceptions raised by pywpas."
+
+
+class WpasError(Exception):
+    "Base class for errors talking to wpa_supplicant."
+
+
+class TruncatedReplyError(WpasError):
+    "A reply did not fit the receive buffer and was cut short."
+
+
+class CommandFailedError(WpasError):
+    "wpa_supplicant did not accept a command (FAIL or other reply)."
+    def __init__(self, cmd, reply):
+        super().__init__(f'{cmd!r} failed: {reply!r}')
+        self.cmd = cmd
+        self.reply = reply
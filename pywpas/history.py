@@ -0,0 +1,243 @@
+"On-disk cache of scan history and profiles, for warm starts."
+
+import os
+import time
+import struct
+import logging
+
+from typing import Iterable, List, Tuple
+
+from .models import Scanned, Profile
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+HISTORY_TTL = 3600.0
+SAVE_INTERVAL = 10.0
+
+MAGIC = b'PWPH'
+VERSION = 2
+# magic, version, saved at, BSS count, profile count
+HEADER = struct.Struct('<4sHdII')
+# bssid, frequency, signal level, last seen
+BSS_RECORD = struct.Struct('<6sHhd')
+# id, extra field count
+PROFILE_RECORD = struct.Struct('<iH')
+# Profile attributes stored as strings, in order.
+PROFILE_STRINGS = ('ssid', 'key_mgmt', 'proto', 'ciphers', 'bssid', 'flags')
+# Extra fields holding secrets, never written (like psk).
+SECRET_FIELDS = frozenset((
+    'password', 'sae_password', 'wep_key0', 'wep_key1', 'wep_key2',
+    'wep_key3', 'private_key_passwd', 'private_key2_passwd', 'pin',
+))
+STRING_LENGTH = struct.Struct('<H')
+# Length of a None string.
+NONE_LENGTH = 0xffff
+_HEX = [f'{b:02x}' for b in range(256)]
+
+
+def _pack_str(parts: List[bytes], value: str) -> None:
+    if value is None:
+        parts.append(STRING_LENGTH.pack(NONE_LENGTH))
+        return
+    value = value.encode('utf-8')
+    if len(value) >= NONE_LENGTH:
+        raise ValueError('String too long')
+    parts.append(STRING_LENGTH.pack(len(value)))
+    parts.append(value)
+
+
+def _unpack_str(data: bytes, offset: int) -> Tuple[str, int]:
+    length, = STRING_LENGTH.unpack_from(data, offset)
+    offset += STRING_LENGTH.size
+    if length == NONE_LENGTH:
+        return None, offset
+    if offset + length > len(data):
+        raise ValueError('Truncated string')
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _pack_bss(network: Scanned, seen: float) -> bytes:
+    "Record of a BSS, raises ValueError if it can't be stored."
+    try:
+        mac = bytes.fromhex(network.bssid.replace(':', ''))
+        if len(mac) != 6:
+            raise ValueError('Not a MAC address')
+        parts = [BSS_RECORD.pack(mac, network.frequency,
+                                 network.signal_level, seen)]
+    except (AttributeError, struct.error) as e:
+        raise ValueError(e) from e
+    _pack_str(parts, network.flags)
+    _pack_str(parts, network.ssid)
+    return b''.join(parts)
+
+
+def _pack_profile(parts: List[bytes], profile: Profile) -> None:
+    extra = [(name, value) for name, value in profile.extra.items()
+             if name not in SECRET_FIELDS]
+    parts.append(PROFILE_RECORD.pack(
+        -1 if profile.id is None else profile.id, len(extra)))
+    for name in PROFILE_STRINGS:
+        _pack_str(parts, getattr(profile, name))
+    for name, value in extra:
+        _pack_str(parts, name)
+        _pack_str(parts, value)
+
+
+def _unpack_bss(data: bytes, offset: int
+                ) -> Tuple[Tuple[Scanned, float], int]:
+    "(BSS, last seen) packed by serialize(), and the offset past it."
+    mac, frequency, level, seen = BSS_RECORD.unpack_from(data, offset)
+    offset += BSS_RECORD.size
+    flags, offset = _unpack_str(data, offset)
+    ssid, offset = _unpack_str(data, offset)
+    bssid = ':'.join([_HEX[b] for b in mac])
+    return (Scanned(bssid, frequency, level, flags, ssid), seen), offset
+
+
+def _unpack_profile(data: bytes, offset: int) -> Tuple[Profile, int]:
+    "Profile packed by serialize(), and the offset past it."
+    profile_id, extra_count = PROFILE_RECORD.unpack_from(data, offset)
+    offset += PROFILE_RECORD.size
+    profile = Profile(id=None if profile_id < 0 else profile_id)
+    for name in PROFILE_STRINGS:
+        value, offset = _unpack_str(data, offset)
+        setattr(profile, name, value)
+    for _ in range(extra_count):
+        name, offset = _unpack_str(data, offset)
+        profile.extra[name], offset = _unpack_str(data, offset)
+    return profile, offset
+
+
+def serialize(bss: Iterable[Tuple[Scanned, float]],
+              profiles: Iterable[Profile], now: float=None) -> bytes:
+    """
+    Pack BSSes (with the time they were last seen) and profiles.
+
+    Profiles are stored without their psk or other secrets (see
+    SECRET_FIELDS), their extra fields included. BSSes that can't be stored
+    (no valid BSSID...) are left out. Raises ValueError if a profile can't
+    be stored.
+    """
+    records = []
+    for network, seen in bss:
+        try:
+            records.append(_pack_bss(network, seen))
+        except ValueError as e:
+            LOGGER.debug('Not caching BSS %s: %s', network.bssid, e)
+    profiles = list(profiles)
+    parts = [HEADER.pack(MAGIC, VERSION, time.time() if now is None else now,
+                         len(records), len(profiles))]
+    parts.extend(records)
+    for profile in profiles:
+        _pack_profile(parts, profile)
+    return b''.join(parts)
+
+
+def deserialize(data: bytes, ttl: float=HISTORY_TTL, now: float=None
+                ) -> Tuple[List[Tuple[Scanned, float]], List[Profile]]:
+    """
+    Unpack what serialize() packed.
+
+    BSSes not seen for ttl seconds are dropped, as are profiles if the
+    whole cache is older than that. Raises ValueError if data is invalid.
+    """
+    now = time.time() if now is None else now
+    try:
+        magic, version, saved, bss_count, profile_count = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a history cache, or another version')
+        offset = HEADER.size
+        bss = []
+        for _ in range(bss_count):
+            entry, offset = _unpack_bss(data, offset)
+            if now - entry[1] <= ttl:
+                bss.append(entry)
+        profiles = []
+        for _ in range(profile_count):
+            profile, offset = _unpack_profile(data, offset)
+            profiles.append(profile)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f'Corrupt history cache: {e}') from e
+    if now - saved > ttl:
+        profiles = []
+    return bss, profiles
+
+
+class HistoryCache:
+    """
+    Scan history and profiles of an interface, kept in a file.
+
+    The file is a compact binary snapshot (see serialize()), read once
+    when loading and replaced atomically when saving. update() saves at
+    most every interval seconds, so it can be called after each scan.
+    Entries older than ttl are dropped when loading.
+    """
+    def __init__(self, path: str, ttl: float=HISTORY_TTL,
+                 interval: float=SAVE_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.interval = interval
+        self._saved = None
+        self._dirty = False
+
+    def load(self, now: float=None
+             ) -> Tuple[List[Tuple[Scanned, float]], List[Profile]]:
+        "(BSS, last seen) pairs and profiles cached, empty if none."
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], []
+        try:
+            bss, profiles = deserialize(data, self.ttl, now)
+        except ValueError as e:
+            LOGGER.warning('Ignoring %s: %s', self.path, e)
+            return [], []
+        LOGGER.info('Loaded %i BSSes and %i profiles from %s', len(bss),
+                    len(profiles), self.path)
+        return bss, profiles
+
+    def save(self, bss: Iterable[Tuple[Scanned, float]],
+             profiles: Iterable[Profile]) -> None:
+        "Replace the cache file."
+        data = serialize(bss, profiles)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+        self._saved = time.monotonic()
+        self._dirty = False
+
+    def update(self, bss: Iterable[Tuple[Scanned, float]],
+               profiles: Iterable[Profile], force: bool=False) -> bool:
+        """
+        Save if the last save is older than interval (or force).
+
+        Returns True if saved, otherwise the changes are only noted and
+        saved by the next update() or flush().
+        """
+        if not force and self._saved is not None and \
+           time.monotonic() - self._saved < self.interval:
+            self._dirty = True
+            return False
+        try:
+            self.save(bss, profiles)
+        except (OSError, ValueError) as e:
+            LOGGER.warning('Could not save %s: %s', self.path, e)
+            return False
+        return True
+
+    def flush(self, bss: Iterable[Tuple[Scanned, float]],
+              profiles: Iterable[Profile]) -> bool:
+        "Save changes noted by update(), if any."
+        if not self._dirty:
+            return False
+        return self.update(bss, profiles, force=True)
+
+    @property
+    def dirty(self) -> bool:
+        "True if changes were noted but not saved yet."
+        return self._dirty
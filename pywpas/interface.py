@@ -1,29 +1,244 @@
 "Communication with wpa_supplicant interface."
-# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-instance-attributes,too-many-public-methods,too-many-lines
 
-import os
 import time
+import queue
 import threading
-import socket
 import logging
 
-from select import select
-from typing import List, Union
-from os.path import join as pathjoin, dirname
+from itertools import islice
+from collections import deque
+from typing import IO, Dict, List, Union, Iterable, Iterator
+from os.path import join as pathjoin
 
-from .utils import tempnam, is_sock, safe_encode, SOCKET_PREFIX
+from .utils import is_sock, is_hex_psk, safe_decode, scan_command
+from .channel import Channel, SEND_TIMEOUT, RECV_TIMEOUT
+from .exceptions import WpasError, CommandFailedError
+from .scan import ScanIndex
+from .history import HistoryCache
+from .cache import ReplyCache
+from .config import iter_config, write_config
+from .psk import derive_psks
+from .metrics import Metrics
 from .models import (
-    InterfaceStatus, Profile, deserialize_scanned,
+    InterfaceStatus, Profile, Event, BSS, Scanned, deserialize_scanned,
+    iter_scanned,
+    ConnectResult, SyncResult, deserialize_profiles, iter_bss, bss_mask, BSS_MASK_DELIM,
+    EVENT_SCAN_RESULTS, EVENT_CONNECTED, EVENT_TERMINATING,
+    EVENT_SSID_TEMP_DISABLED,
+    EVENT_ASSOC_REJECT, EVENT_AUTH_REJECT, MSG_AUTHENTICATING,
+    MSG_ASSOCIATING, MSG_ASSOCIATED, MSG_KEY_NEGOTIATED, PROFILE_FIELDS,
+    normalize_field,
 )
 
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.NullHandler())
 
-SEND_TIMEOUT = 5.0
-RECV_TIMEOUT = 5.0
 SCAN_TIMEOUT = 30.0
-RECV_BUFFER_SIZE = 4096
+CONNECT_TIMEOUT = 30.0
+# Check a quiet monitor is still attached this often (seconds).
+KEEPALIVE_INTERVAL = 10.0
+# Give a terminating wpa_supplicant time to exit before attaching again.
+REATTACH_DELAY = 1.0
+# wpa_supplicant builds most replies in a buffer of this size, a network list
+# that comes close to filling it may have been cut short.
+REPLY_SIZE = 4096
+LIST_NETWORKS_MARGIN = 256
+# Commands in flight at once. Datagram queues are short (net.unix.
+# max_dgram_qlen, 512 by default) and wpa_supplicant drops replies that
+# don't fit, so longer pipelines are sent in chunks.
+PIPELINE_DEPTH = 128
+# Networks added per ADD_NETWORK/SET_NETWORK round by import_networks().
+IMPORT_BATCH = 16
+# Fields read back by export_networks(), besides ssid, bssid and psk.
+EXPORT_FIELDS = (
+    'scan_ssid', 'priority', 'key_mgmt', 'proto', 'pairwise', 'group',
+    'auth_alg', 'ieee80211w', 'eap', 'identity', 'anonymous_identity',
+    'ca_cert', 'phase1', 'phase2', 'id_str', 'disabled',
+)
+# BSS fields requested unless told otherwise.
+BSS_DEFAULT_FIELDS = (
+    'id', 'bssid', 'freq', 'beacon_int', 'noise', 'level', 'snr', 'age',
+    'flags', 'ssid', 'est_throughput',
+)
+
+
+class Monitor:
+    """
+    Receive unsolicited messages from wpa_supplicant.
+
+    Opens a second connection to the interface, sends ATTACH and dispatches
+    each event to subscribers from a background thread. If wpa_supplicant
+    terminates, or doesn't answer within recv_timeout a PING sent when
+    nothing was received for KEEPALIVE_INTERVAL, the monitor reconnects and
+    sends ATTACH again.
+
+    Commands can be posted on the same connection, their replies are then
+    delivered in order with the events around them.
+    """
+    def __init__(self, interface: 'Interface'):
+        self._interface = interface
+        self._channel = Channel(interface.server_path,
+                                interface.recv_timeout, interface.name)
+        self._subscribers = []
+        # Reply callbacks of posted commands, oldest first.
+        self._replies = deque()
+        # When the keepalive PING is given up on, None if none is pending.
+        self._keepalive = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._t = None
+
+    @property
+    def running(self) -> bool:
+        "True while attached and dispatching events."
+        return self._running
+
+    def subscribe(self, callback: callable, *names: str) -> callable:
+        """
+        Call callback with each event.
+
+        If event names are given only matching events are delivered.
+        """
+        assert callable(callback), 'Callback must be callable'
+        with self._lock:
+            self._subscribers.append((callback, frozenset(names)))
+        return callback
+
+    def unsubscribe(self, callback: callable) -> None:
+        "Stop delivering events to callback."
+        with self._lock:
+            self._subscribers = [
+                s for s in self._subscribers if s[0] != callback
+            ]
+
+    def post(self, cmd: Union[str, bytes], callback: callable=None) -> None:
+        """
+        Send a command on the monitor connection.
+
+        callback is called with the reply, from the monitor thread, after
+        every event received before it. Replies lost to a reconnection are
+        never delivered. Raises ConnectionError while not attached (e.g.
+        wpa_supplicant is restarting).
+        """
+        with self._lock:
+            self._replies.append(callback)
+            try:
+                self._channel.post(cmd)
+            except OSError:
+                self._replies.pop()
+                raise
+
+    def _reply(self, data: bytes) -> None:
+        "Deliver a reply to the callback of its command."
+        with self._lock:
+            if not self._replies:
+                return
+            callback = self._replies.popleft()
+        if not callable(callback):
+            return
+        try:
+            callback(data.strip())
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Error in reply callback %s', callback)
+
+    def _pong(self, _reply: bytes) -> None:
+        "Reply callback of the keepalive PING."
+        self._keepalive = None
+
+    def _dispatch(self, event: Event) -> None:
+        "Deliver event to interested subscribers."
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, names in subscribers:
+            if names and event.name not in names:
+                continue
+            try:
+                callback(event)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Error in event callback %s', callback)
+
+    def _attach(self) -> bool:
+        "Reconnect and ATTACH, returns True if attached."
+        self._channel.close()
+        with self._lock:
+            self._replies.clear()
+        self._keepalive = None
+        try:
+            self._channel.command(b'ATTACH')
+        except (OSError, WpasError) as e:
+            LOGGER.debug('Attaching to %s failed: %s', self._interface.name,
+                         e)
+            self._channel.close()
+            return False
+        LOGGER.info('Attached to %s again', self._interface.name)
+        return True
+
+    def _run(self):
+        "Monitor thread entry point."
+        last_seen = reattach_at = time.monotonic()
+        while self._running:
+            if not self._channel.connected:
+                # The channel spaces out attempts, don't spin meanwhile.
+                if time.monotonic() < reattach_at or not self._attach():
+                    time.sleep(0.1)
+                    continue
+                last_seen = time.monotonic()
+            data = self._channel.read(0.1)
+            if data is None:
+                now = time.monotonic()
+                if self._keepalive is not None:
+                    if now > self._keepalive:
+                        LOGGER.info('%s stopped answering',
+                                    self._interface.name)
+                        self._channel.close()
+                elif now - last_seen > KEEPALIVE_INTERVAL:
+                    self._keepalive = now + self._interface.recv_timeout
+                    try:
+                        self.post(b'PING', self._pong)
+                    except OSError:
+                        LOGGER.info('Lost connection to %s',
+                                    self._interface.name)
+                        self._channel.close()
+                continue
+            last_seen = time.monotonic()
+            LOGGER.debug('event(%s) << %s', self._interface.name, data)
+            if not data.startswith(b'<'):
+                self._reply(data)
+                continue
+            event = Event.deserialize(data)
+            self._dispatch(event)
+            if event.name == EVENT_TERMINATING:
+                LOGGER.info('%s terminating', self._interface.name)
+                self._channel.close()
+                reattach_at = time.monotonic() + REATTACH_DELAY
+
+    def start(self) -> None:
+        "Attach to wpa_supplicant and start dispatching events."
+        if self._running:
+            return
+        try:
+            self._channel.command(b'ATTACH')
+        except (TimeoutError, CommandFailedError):
+            self._channel.close()
+            raise
+        self._running = True
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+
+    def stop(self) -> None:
+        "Detach from wpa_supplicant."
+        if self._t is None:
+            return
+        self._running = False
+        self._t.join()
+        self._t = None
+        try:
+            self._channel.post(b'DETACH')
+        except OSError:
+            LOGGER.debug('Could not detach from %s', self._interface.name)
+        self._channel.close()
 
 
 class _BackgroundScan:
@@ -31,22 +246,41 @@ class _BackgroundScan:
     High-level scan.
 
     Scans in background thread and calls callable with each new network.
+    Results are fetched each time wpa_supplicant reports they are ready,
+    even if the scan was refused (the radio is busy scanning already).
     """
     def __init__(self, interface: 'Interface'):
         self._interface = interface
         self._running = False
+        self._events = queue.Queue()
         self._t = None
 
     def _scan(self, callback, timeout):
         "Background scan thread entry point."
         networks, started = set(), time.time()
-        self._interface.scan()
-        while self._running and time.time() - started < timeout:
-            time.sleep(1.0)
-            for network in self._interface.scan_results():
-                if network.ssid not in networks:
-                    networks.add(network.ssid)
-                    callback(network)
+        monitor = self._interface.monitor
+        monitor.subscribe(self._events.put, EVENT_SCAN_RESULTS)
+        try:
+            try:
+                self._interface.scan()
+            except CommandFailedError as e:
+                # FAIL-BUSY: a scan is under way, its results will do.
+                LOGGER.info('Scan not started: %s', e)
+            while self._running:
+                remaining = timeout - (time.time() - started)
+                if remaining <= 0:
+                    break
+                try:
+                    if self._events.get(timeout=remaining) is None:
+                        break
+                except queue.Empty:
+                    break
+                for network in self._interface.scan_results():
+                    if network.ssid not in networks:
+                        networks.add(network.ssid)
+                        callback(network)
+        finally:
+            monitor.unsubscribe(self._events.put)
 
     def start(self, callback: callable, timeout: float=SCAN_TIMEOUT):
         "Start background scan."
@@ -61,10 +295,111 @@ class _BackgroundScan:
         if self._t is None:
             return
         self._running = False
+        self._events.put(None)
         self._t.join()
         self._t = None
 
 
+class _ConnectWaiter:
+    """
+    Follows connection progress events until connected or rejected.
+
+    Notes when each phase begins to time scan (until the first attempt),
+    auth (SME drivers only), assoc and the 4-way handshake. Events received
+    before SELECT_NETWORK is acknowledged (see acknowledged()) are ignored,
+    as are CONNECTED and SSID-TEMP-DISABLED events of other networks.
+    """
+    # Message prefix and the mark it sets.
+    MARKS = (
+        (MSG_AUTHENTICATING, 'auth'),
+        (MSG_ASSOCIATING, 'assoc'),
+        (MSG_ASSOCIATED, 'associated'),
+        (MSG_KEY_NEGOTIATED, 'completed'),
+        (EVENT_CONNECTED, 'completed'),
+    )
+    FAILURES = (EVENT_SSID_TEMP_DISABLED, EVENT_ASSOC_REJECT,
+                EVENT_AUTH_REJECT)
+
+    # Events naming the network they concern.
+    IDENTIFIED = (EVENT_CONNECTED, EVENT_SSID_TEMP_DISABLED)
+
+    def __init__(self, network_id: int):
+        self._id = str(network_id)
+        self._events = queue.Queue()
+        self._marks = {'start': time.monotonic()}
+
+    def __call__(self, event: Event) -> None:
+        "Monitor callback."
+        self._events.put((time.monotonic(), event))
+
+    def acknowledged(self, reply: bytes) -> None:
+        "Reply callback of SELECT_NETWORK, posted on the monitor."
+        self._events.put((time.monotonic(), reply))
+
+    def _ours(self, event: Event) -> bool:
+        "False for events of another network."
+        return event.name not in self.IDENTIFIED or \
+            event.params.get('id', self._id) == self._id
+
+    def _mark(self, name, when):
+        self._marks.setdefault(name, when)
+
+    def _span(self, start: str, end: str) -> float:
+        if start not in self._marks or end not in self._marks:
+            return None
+        return self._marks[end] - self._marks[start]
+
+    def _result(self, success, bssid, reason, when) -> ConnectResult:
+        marks = self._marks
+        first = marks.get('auth', marks.get('assoc'))
+        return ConnectResult(
+            success=success, bssid=bssid, reason=reason,
+            scan=first - marks['start'] if first is not None else None,
+            auth=self._span('auth', 'assoc'),
+            assoc=self._span('assoc', 'associated'),
+            handshake=self._span('associated', 'completed'),
+            total=when - marks['start'])
+
+    def wait(self, timeout: float) -> ConnectResult:
+        "Wait for connection, rejection or timeout."
+        deadline = self._marks['start'] + timeout
+        acknowledged = False
+        while True:
+            try:
+                when, event = self._events.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return self._result(False, None, 'TIMEOUT', time.monotonic())
+            if isinstance(event, bytes):
+                if event != b'OK':
+                    raise CommandFailedError(
+                        f'SELECT_NETWORK {self._id}', event)
+                acknowledged = True
+                continue
+            if not acknowledged or not self._ours(event):
+                LOGGER.debug('Ignoring %s', event)
+                continue
+            for prefix, mark in self.MARKS:
+                if event.message.startswith(prefix):
+                    self._mark(mark, when)
+            if event.name == EVENT_CONNECTED:
+                return self._result(True, event.bssid, None, when)
+            if event.name in self.FAILURES:
+                reason = event.params.get(
+                    'reason', event.params.get('status_code'))
+                reason = f'{event.name}: {reason}' if reason else event.name
+                return self._result(False, event.bssid, reason, when)
+
+
+def _network_field(profile: Profile, name: str) -> str:
+    "Value of a network field of a profile read back from wpa_supplicant."
+    if name in PROFILE_FIELDS:
+        return getattr(profile, PROFILE_FIELDS[name])
+    if name == 'bssid':
+        return profile.bssid
+    return profile.extra.get(name)
+
+
 # Supported commands are listed here:
 # https://github.com/digsrc/wpa_supplicant/blob/master/wpa_supplicant/ctrl_iface.c#L8128
 #
@@ -97,20 +432,49 @@ class _BackgroundScan:
 class Interface:
     """
     Handle a unix:// datagram connection for a given interface.
+
+    Safe to use from several threads. Each request checks out a client
+    socket from the pool the parent Control keeps for this interface.
+
+    Given a HistoryCache, scan results and profiles cached by an earlier
+    run are loaded, so decisions can start before the first scan. The cache
+    is then updated as results and profiles are read.
+
+    With derive_psk, passphrases are turned into PSKs here (see
+    psk.derive_psks()) rather than by wpa_supplicant, which would stall
+    doing so for every network added. Many at once are derived by a pool of
+    worker processes, kept until psk.shutdown_pool() is called.
     """
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
     def __init__(self, control: 'Control', name: str,
                  send_timeout: float=SEND_TIMEOUT,
-                 recv_timeout: float=RECV_TIMEOUT):
+                 recv_timeout: float=RECV_TIMEOUT,
+                 history: HistoryCache=None, derive_psk: bool=False):
         self._control = control
         self._name = name
+        self.derive_psk = derive_psk
         self._send_timeout = send_timeout
         self._recv_timeout = recv_timeout
-        self._connection = None
+        self._monitor = None
         self._server_path = pathjoin(self._control._sock_path, self.name)
+        self._pool = None
+        self._history = None
+        # The pool's cache, while this interface's monitor invalidates it.
+        self._invalidated = None
         assert is_sock(self._server_path), 'Not a valid interface'
-        self._client_path = None
-        self._scanned = {}
+        self._pool = control.pool(name)
+        self._scanned = ScanIndex()
         self._profiles = {}
+        # Secrets can't be read back, remember the ones set per network id.
+        self._secrets = {}
+        self._history = history
+        if history is not None:
+            networks, profiles = history.load()
+            self._scanned.restore(networks, max_age=history.ttl)
+            self._profiles = {
+                profile.id: profile for profile in profiles
+                if profile.id is not None
+            }
 
     def __del__(self):
         self.close()
@@ -125,6 +489,60 @@ class Interface:
         "The parent object which gives access to additional interfaces."
         return self._control
 
+    @property
+    def server_path(self) -> str:
+        "Path of wpa_supplicant's control socket for this interface."
+        return self._server_path
+
+    @property
+    def recv_timeout(self) -> float:
+        "Seconds to wait for each reply."
+        return self._recv_timeout
+
+    @property
+    def monitor(self) -> Monitor:
+        "Event monitor for this interface, attached on first use."
+        if self._monitor is None:
+            self._monitor = Monitor(self)
+        self._monitor.start()
+        return self._monitor
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Per-command request metrics, None (the default) when disabled.
+
+        Shared by every user of this interface's control socket, assign a
+        Metrics instance to enable them.
+        """
+        return self._pool.metrics
+
+    @metrics.setter
+    def metrics(self, metrics: Metrics) -> None:
+        self._pool.metrics = metrics
+
+    @property
+    def cache(self) -> ReplyCache:
+        """
+        Cache of read-only replies (STATUS...), None (the default) when
+        disabled.
+
+        Shared like metrics. Assigning a ReplyCache starts the monitor, so
+        events invalidate replies they make stale. Once this interface is
+        closed nothing does, so the cache is then cleared and detached.
+        """
+        return self._pool.cache
+
+    @cache.setter
+    def cache(self, cache: ReplyCache) -> None:
+        old = self._pool.cache
+        if old is not None and self._monitor is not None:
+            self._monitor.unsubscribe(old.on_event)
+        self._pool.cache = cache
+        self._invalidated = cache
+        if cache is not None:
+            self.monitor.subscribe(cache.on_event)
+
     @property
     def profiles(self):
         "Networks in wpa_supplicant.conf"
@@ -133,68 +551,83 @@ class Interface:
     @property
     def scanned(self):
         "Networks found via scan()."
-        return list(self._scanned.values())
+        return self._scanned.values()
+
+    @property
+    def scan_index(self) -> ScanIndex:
+        "Networks found via scan(), indexed by BSSID, SSID and band."
+        return self._scanned
+
+    @property
+    def history(self) -> HistoryCache:
+        "Cache of scan results and profiles, or None."
+        return self._history
+
+    def _remember(self) -> None:
+        "Update the history cache, if any."
+        if self._history is not None:
+            self._history.update(self._scanned.items(),
+                                 list(self._profiles.values()))
 
     def close(self) -> None:
         """
         Close the socket when deallocated.
         """
-        if self._connection is None:
-            return
-        self._connection.close()
-        self._connection = None
-        try:
-            os.remove(self._client_path)
-        except FileNotFoundError:
-            LOGGER.warning('Error deleting client socket at: %s',
-                        self._client_path)
-        self._client_path = None
+        if self._history is not None:
+            self._history.flush(self._scanned.items(),
+                                list(self._profiles.values()))
+        if self._invalidated is not None:
+            if self._pool.cache is self._invalidated:
+                self._pool.cache = None
+            self._invalidated.clear()
+            self._invalidated = None
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor = None
+        if self._pool is not None:
+            self._pool.close()
 
-    def _ensure_connection(self):
+    def _send_and_recv(self, cmd: Union[str, bytes]) -> List[bytes]:
         """
-        Open a connection if not already established.
+        Send data to then read data from wpa_supplicant.
+
+        Returns an array of strings (one per line).
         """
-        if self._connection is not None:
-            return
-        self._client_path = tempnam(dirname(self._server_path), SOCKET_PREFIX)
-        self._connection = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-        self._connection.bind(self._client_path)
-        self._connection.connect(self._server_path)
+        return self._pool.request(cmd, self._recv_timeout).split(b'\n')
 
-    def _send(self, cmd: Union[str, bytes]) -> None:
+    def _command(self, cmd: Union[str, bytes]) -> None:
         """
-        Send data to wpa_supplicant.
+        Send a command expecting an OK reply.
 
-        Accepts a string or bytes.
+        Raises CommandFailedError otherwise.
         """
-        self._ensure_connection()
-        cmd = safe_encode(cmd)
-        LOGGER.debug('sending(%s) >> %s', self.name, cmd)
-        self._connection.send(cmd)
+        self._pool.command(cmd, self._recv_timeout)
 
-    def _recv(self) -> str:
+    def _pipeline(self, cmds: Iterable[Union[str, bytes]]) -> List[bytes]:
         """
-        Read data from wpa_supplicant.
+        Send several commands before collecting their replies in order.
 
-        Returns a string, possibly multiple lines.
+        Returns the replies.
         """
-        if self._connection not in select([self._connection], [], [],
-                                          self._recv_timeout)[0]:
-            raise TimeoutError()
-        data = self._connection.recv(RECV_BUFFER_SIZE)
-        data = data.strip()
-        LOGGER.debug('received(%s) << %s', self.name, data)
-        return data
+        cmds, replies = iter(cmds), []
+        while True:
+            chunk = list(islice(cmds, PIPELINE_DEPTH))
+            if not chunk:
+                return replies
+            replies.extend(self._pool.pipeline(chunk, self._recv_timeout))
 
-    def _send_and_recv(self, cmd: Union[str, bytes]) -> List[str]:
+    def _commands(self, cmds: Iterable[Union[str, bytes]]) -> None:
         """
-        Send data to then read data from wpa_supplicant.
+        Pipeline several commands each expecting an OK reply.
 
-        Returns an array of strings (one per line).
+        Raises CommandFailedError otherwise.
         """
-        self._send(cmd)
-        resp = self._recv()
-        return resp.split(b'\n')
+        cmds = iter(cmds)
+        while True:
+            chunk = list(islice(cmds, PIPELINE_DEPTH))
+            if not chunk:
+                return
+            self._pool.commands(chunk, self._recv_timeout)
 
     def ping(self) -> None:
         "Connection test."
@@ -205,13 +638,55 @@ class Interface:
     def status(self) -> InterfaceStatus:
         "Get interface status."
         LOGGER.info('Retrieving interface status')
-        status = InterfaceStatus.deserialize(self._send_and_recv('STATUS'))
-        return status
+        return InterfaceStatus(
+            self._pool.request(b'STATUS', self._recv_timeout))
+
+    def signal_poll(self, timeout: float=None) -> List[bytes]:
+        """
+        Raw SIGNAL_POLL and PKTCNT_POLL replies, pipelined.
+
+        See telemetry.SignalHistory.record() to parse them.
+        """
+        return self._pool.pipeline(
+            [b'SIGNAL_POLL', b'PKTCNT_POLL'],
+            self._recv_timeout if timeout is None else timeout)
 
-    def scan(self) -> None:
-        "Start scanning."
+    def scan(self, freqs: Iterable[int]=None, ssids: Iterable[str]=None,
+             passive: bool=False, only_new: bool=False) -> None:
+        """
+        Start scanning.
+
+        Scans every channel unless freqs (MHz) are given, see
+        utils.scan_command() for the other options.
+        """
         LOGGER.info('Initiating scan')
-        self._send(b'SCAN')
+        self._command(scan_command(freqs, ssids, passive, only_new))
+
+    def scan_frequencies(self, ssids: Iterable[str]=None) -> List[int]:
+        """
+        Frequencies given SSIDs were seen on, from the scan index.
+
+        SSIDs default to those of known profiles.
+        """
+        if ssids is None:
+            ssids = [p.ssid for p in self._profiles.values() if p.ssid]
+        return sorted({
+            network.frequency
+            for ssid in ssids for network in self._scanned.by_ssid(ssid)
+        })
+
+    def scan_known(self, ssids: Iterable[str]=None) -> None:
+        """
+        Scan for known networks only.
+
+        Probes for each SSID (default: those of known profiles) on the
+        channels they were last seen on, a fraction of a full scan. Scans
+        every channel for them if none are known yet.
+        """
+        if ssids is None:
+            ssids = [p.ssid for p in self._profiles.values() if p.ssid]
+        ssids = list(ssids)
+        self.scan(self.scan_frequencies(ssids), ssids)
 
     def background_scan(self, callback: callable,
                         timeout: float=SCAN_TIMEOUT) -> None:
@@ -225,70 +700,403 @@ class Interface:
         "Return scan results."
         LOGGER.info('Retrieving scan results')
         networks = deserialize_scanned(self._send_and_recv(b'SCAN_RESULTS'))
-        for network in networks:
+        for network in self._scanned.merge(networks):
             LOGGER.info('Found network: %s', network)
-            self._scanned[network.ssid] = network
+        self._remember()
         return self.scanned
 
+    def iter_scan_results(self, min_signal: int=None,
+                          bands: Iterable[str]=None,
+                          ssids: Iterable[str]=None) -> Iterator[Scanned]:
+        """
+        Yield scan results as they are parsed.
+
+        Only the reply is held in memory, records are made one at a time
+        and only for rows passing the filters (see models.ScanParser.iter).
+        The scan index is left alone.
+        """
+        LOGGER.info('Streaming scan results')
+        return iter_scanned(
+            self._pool.request(b'SCAN_RESULTS', self._recv_timeout),
+            min_signal, bands, ssids)
+
+    def iter_bss(self, fields: Iterable[str]=BSS_DEFAULT_FIELDS
+                 ) -> Iterator[BSS]:
+        """
+        Iterate over every BSS known to wpa_supplicant.
+
+        Entries are fetched with BSS RANGE=, a reply at a time. Each reply
+        holds as many entries as wpa_supplicant fits in its reply buffer,
+        the next page starts after the last id received. Only the given
+        fields (see models.BSS_FIELDS) are requested with MASK=, so keep
+        large ones (ie, beacon_ie) out unless needed.
+        """
+        LOGGER.info('Retrieving BSS entries')
+        mask = bss_mask(fields) | bss_mask(['id']) | BSS_MASK_DELIM
+        start = 0
+        while True:
+            reply = self._pool.request(f'BSS RANGE={start}- MASK=0x{mask:x}',
+                                       self._recv_timeout)
+            last = None
+            for bss in iter_bss(reply):
+                last = bss.id
+                yield bss
+            if last is None or reply.endswith(b'####'):
+                return
+            start = last + 1
+
+    def bss(self, bssid: str, fields: Iterable[str]=BSS_DEFAULT_FIELDS
+            ) -> BSS:
+        "Details of given BSS, or None if wpa_supplicant doesn't know it."
+        LOGGER.info('Retrieving BSS %s', bssid)
+        reply = self._pool.request(
+            f'BSS {bssid} MASK=0x{bss_mask(fields):x}', self._recv_timeout)
+        if reply.startswith(b'FAIL'):
+            return None
+        return next(iter_bss(reply), None)
+
     def remove_results(self):
         "Remove scan results."
         self._scanned.clear()
 
+    def _derive_psks(self, changes: List[tuple]) -> Dict[int, str]:
+        """
+        Keys of the passphrases set by (profile, [(field, value)...]) pairs.
+
+        Empty unless derive_psk is set, otherwise keyed by index of the
+        change, all derived at once. Raises ValueError for an invalid SSID
+        or passphrase, so call it before sending anything.
+        """
+        if not self.derive_psk:
+            return {}
+        derive = [
+            i for i, (profile, fields) in enumerate(changes)
+            if profile.ssid and profile.psk is not None and
+            not is_hex_psk(profile.psk) and
+            any(field == 'psk' for field, _ in fields)
+        ]
+        return dict(zip(derive, derive_psks(
+            (changes[i][0].ssid, changes[i][0].psk) for i in derive)))
+
+    @staticmethod
+    def _set_network(changes: List[tuple], psks: Dict[int, str]
+                     ) -> List[str]:
+        """
+        SET_NETWORK commands of (profile, [(field, value)...]) pairs.
+
+        psk values are replaced by the keys of _derive_psks(), if any.
+        """
+        cmds = []
+        for i, (profile, fields) in enumerate(changes):
+            for field, value in fields:
+                if field == 'psk':
+                    value = psks.get(i, value)
+                cmds.append(f'SET_NETWORK {profile.id} {field} {value}')
+        return cmds
+
+    def _add_networks(self, profiles: List[Profile]) -> None:
+        """
+        Add profiles, with one pipeline of ADD_NETWORK then SET_NETWORK.
+
+        Passphrases are checked (and derived) before anything is sent. If
+        configuring fails the networks are removed again.
+        """
+        changes = [(profile, list(profile.serialize().items()))
+                   for profile in profiles]
+        psks = self._derive_psks(changes)
+        replies = self._pipeline([b'ADD_NETWORK'] * len(profiles))
+        for profile, reply in zip(profiles, replies):
+            profile.id = int(reply)
+            LOGGER.debug('Assigned id: %i', profile.id)
+        try:
+            self._commands(self._set_network(changes, psks))
+        except Exception:
+            # Don't leave half configured networks behind.
+            self._commands(f'REMOVE_NETWORK {profile.id}'
+                           for profile in profiles)
+            for profile in profiles:
+                profile.id = None
+            raise
+        for profile in profiles:
+            self._profiles[profile.id] = profile
+            self._secrets[profile.id] = profile.psk
+
     def add_network(self, profile: Profile) -> None:
         "Add network profile."
         LOGGER.info('Adding network: %s', profile.ssid)
-        profile.id = int(self._send_and_recv(b'ADD_NETWORK')[0])
-        LOGGER.debug('Assigned id: %i', profile.id)
-        self._send(f'SET_NETWORK {profile.id} ssid {profile.ssid}')
-        self._send(f'SET_NETWORK {profile.id} key_mgmt {profile.key_mgmt}')
-        self._send(f'SET_NETWORK {profile.id} proto {profile.proto}')
-        self._send(f'SET_NETWORK {profile.id} psk {profile.psk}')
-        self._profiles[profile.id] = profile
-
-    def list_networks(self) -> List[Profile]:
-        "List network profiles."
+        self._add_networks([profile])
+        self._remember()
+
+    def import_networks(self, source: Union[str, Iterable[str]],
+                        batch: int=IMPORT_BATCH, save: bool=True) -> int:
+        """
+        Add the networks of a wpa_supplicant.conf file.
+
+        source is a file name or lines (e.g. an open file), read as networks
+        are added, batch networks at a time. If a batch fails its networks
+        are removed, earlier batches remain. Saves the config once, if
+        anything was added and save is set. Returns the number added.
+        """
+        if isinstance(source, str):
+            with open(source, 'r', encoding='utf-8') as f:
+                return self.import_networks(f, batch, save)
+        profiles, count = iter_config(source), 0
+        while True:
+            chunk = list(islice(profiles, batch))
+            if not chunk:
+                break
+            self._add_networks(chunk)
+            count += len(chunk)
+            LOGGER.debug('Imported %i networks', count)
+        LOGGER.info('Imported %i networks', count)
+        self._remember()
+        if count and save:
+            self.save_config()
+        return count
+
+    def export_networks(self, dest: Union[str, IO],
+                        fields: Iterable[str]=EXPORT_FIELDS) -> int:
+        """
+        Write networks as a wpa_supplicant.conf file (network blocks only).
+
+        dest is a file name or an open file. Given fields are read back with
+        GET_NETWORK a page of networks at a time. A psk can't be read back,
+        only those set by this interface are written. Returns the number of
+        networks written.
+        """
+        fields = list(fields)
+
+        def profiles():
+            networks = self.iter_networks()
+            while True:
+                chunk = list(islice(networks, IMPORT_BATCH))
+                if not chunk:
+                    return
+                self.load_networks(chunk, fields)
+                for profile in chunk:
+                    if profile.psk is None:
+                        profile.psk = self._secrets.get(profile.id)
+                yield from chunk
+
+        count = write_config(profiles(), dest)
+        LOGGER.info('Exported %i networks', count)
+        return count
+
+    def iter_networks(self) -> Iterator[Profile]:
+        """
+        Iterate over network profiles.
+
+        The network table is read with LIST_NETWORKS, a page at a time
+        (LAST_ID=) when it does not fit a single reply. Only id, ssid, bssid
+        and flags are filled in, see load_networks().
+        """
         LOGGER.info('Listing networks')
-        profile_ids = map(int, self._send_and_recv(b'LIST_NETWORKS'))
-        LOGGER.debug('Received network ids: %s', profile_ids)
-        for profile_id in profile_ids:
-            kwargs = {}
-            kwargs['ssid'] = self._send_and_recv(f'GET_NETWORK {profile_id} ssid')[0]
-            kwargs['key_mgmt'] = self._send_and_recv(f'GET_NETWORK {profile_id} key_mgmt')[0]
-            kwargs['proto'] = self._send_and_recv(f'GET_NETWORK {profile_id} proto')[0]
-            kwargs['ciphers'] = self._send_and_recv(f'GET_NETWORK {profile_id} pairwise')[0]
-            self._profiles[profile_id] = Profile(**kwargs)
-        return self.profiles
+        cmd = b'LIST_NETWORKS'
+        while True:
+            reply = self._pool.request(cmd, self._recv_timeout)
+            profiles = deserialize_profiles(reply.split(b'\n'))
+            LOGGER.debug('Received %i networks', len(profiles))
+            for profile in profiles:
+                self._profiles[profile.id] = profile
+                yield profile
+            if not profiles or \
+               len(reply) < REPLY_SIZE - LIST_NETWORKS_MARGIN:
+                return
+            cmd = f'LIST_NETWORKS LAST_ID={profiles[-1].id}'
+
+    def load_networks(self, profiles: Iterable[Profile],
+                      fields: Iterable[str]=tuple(PROFILE_FIELDS)) -> None:
+        """
+        Fill in additional fields of given profiles.
+
+        One GET_NETWORK per profile and field, pipelined. Fields
+        wpa_supplicant won't return are left as None. Fields Profile has no
+        attribute for go to extra.
+        """
+        profiles, fields = list(profiles), list(fields)
+        replies = iter(self._pipeline([
+            f'GET_NETWORK {profile.id} {field}'
+            for profile in profiles for field in fields
+        ]))
+        for profile in profiles:
+            for field in fields:
+                value = next(replies)
+                if value.startswith(b'FAIL'):
+                    value = None
+                if field in PROFILE_FIELDS:
+                    setattr(profile, PROFILE_FIELDS[field],
+                            safe_decode(value))
+                elif value is not None:
+                    profile.extra[field] = safe_decode(value)
+
+    def list_networks(self, details: bool=False) -> List[Profile]:
+        """
+        List network profiles.
+
+        With details, key_mgmt, proto and ciphers are also loaded.
+        """
+        profiles = list(self.iter_networks())
+        self._profiles = {profile.id: profile for profile in profiles}
+        if details:
+            self.load_networks(profiles)
+        self._remember()
+        return profiles
 
     def remove_network(self, profile: Profile) -> None:
         "Remove given network profile."
         LOGGER.info('Removing network profile: %s', profile.ssid)
-        self._send(f'REMOVE_NETWORK {profile.id}')
+        self._command(f'REMOVE_NETWORK {profile.id}')
         self._profiles.pop(profile.id, None)
+        self._secrets.pop(profile.id, None)
+        self._remember()
 
     def remove_networks(self) -> None:
         "Delete all network profiles."
         LOGGER.info('Removing all network profiles')
-        self._send(b'REMOVE_NETWORK all')
+        self._command(b'REMOVE_NETWORK all')
         self._profiles.clear()
+        self._secrets.clear()
+        self._remember()
+
+    def _sync_changes(self, desired: List[Profile],
+                      current: Dict[str, Profile]) -> List[tuple]:
+        """
+        SET_NETWORK changes turning current networks into desired ones.
+
+        Fields are compared in normal form (see models.normalize_field()).
+        Desired profiles are given the id of the network of their SSID.
+        """
+        changes = []
+        for profile in desired:
+            existing = current[profile.ssid]
+            profile.id = existing.id
+            fields = profile.serialize()
+            changed = [
+                (field, value) for field, value in fields.items()
+                if field not in ('ssid', 'psk') and
+                normalize_field(field, value) != normalize_field(
+                    field, _network_field(existing, field))
+            ]
+            if 'psk' in fields and \
+               profile.psk != self._secrets.get(profile.id):
+                changed.append(('psk', fields['psk']))
+            if changed:
+                changes.append((profile, changed))
+        return changes
+
+    def sync_profiles(self, desired: Iterable[Profile],
+                      save: bool=True) -> SyncResult:
+        """
+        Make wpa_supplicant's networks match desired profiles.
 
-    def connect(self, profile: Profile):
-        "connect interface to given network."
+        Current networks are read once and matched to desired profiles by
+        SSID. Only the commands needed are sent, pipelined: ADD_NETWORK for
+        new SSIDs, SET_NETWORK for changed fields (bssid and extra ones
+        included) and REMOVE_NETWORK for SSIDs no longer desired, so
+        unchanged networks (and the current association) are left alone.
+        A psk can't be read back, it is sent unless this interface set the
+        same one before. Networks are added first, if that fails they are
+        removed again and nothing else is changed. Saves the config once, if
+        anything changed and save is set.
+        """
+        desired = list(desired)
+        LOGGER.info('Syncing %i network profiles', len(desired))
+        result = SyncResult()
+        current = {}
+        for profile in self.list_networks():
+            if profile.ssid in current:
+                # Duplicate SSID, only the first one is kept.
+                result.removed.append(profile)
+            else:
+                current[profile.ssid] = profile
+        matched = [p for p in desired if p.ssid in current]
+        result.added = [p for p in desired if p.ssid not in current]
+        fields = list(PROFILE_FIELDS)
+        for profile in matched:
+            fields.extend(f for f in profile.extra if f not in fields)
+        self.load_networks([current[p.ssid] for p in matched], fields)
+        changes = self._sync_changes(matched, current)
+        result.updated = [profile for profile, _ in changes]
+        for profile in matched:
+            del current[profile.ssid]
+        result.removed.extend(current.values())
+        # Before anything is added, an invalid passphrase changes nothing.
+        psks = self._derive_psks(changes)
+        if result.added:
+            self._add_networks(result.added)
+        cmds = self._set_network(changes, psks)
+        cmds.extend(f'REMOVE_NETWORK {profile.id}'
+                    for profile in result.removed)
+        if cmds:
+            self._commands(cmds)
+        for profile in result.removed:
+            self._profiles.pop(profile.id, None)
+            self._secrets.pop(profile.id, None)
+        for profile in result.updated:
+            self._profiles[profile.id] = profile
+            self._secrets[profile.id] = profile.psk
+        self._remember()
+        LOGGER.info('Synced network profiles: %s', result)
+        if result and save:
+            self.save_config()
+        return result
+
+    def connect(self, profile: Profile, wait: bool=False,
+                timeout: float=CONNECT_TIMEOUT) -> ConnectResult:
+        """
+        connect interface to given network.
+
+        With wait, follow progress events until connected (or rejected, or
+        timeout) and return a ConnectResult timing each phase.
+        """
         if profile.id is None:
             self.add_network(profile)
         LOGGER.info('Connecting to network: %s', profile.ssid)
-        self._send_and_recv(f'SELECT_NETWORK {profile.id}')
+        if not wait:
+            self._command(f'SELECT_NETWORK {profile.id}')
+            return None
+        waiter = _ConnectWaiter(profile.id)
+        monitor = self.monitor
+        monitor.subscribe(waiter)
+        try:
+            # Sent on the monitor connection, so the reply tells events
+            # that came before it apart.
+            monitor.post(f'SELECT_NETWORK {profile.id}', waiter.acknowledged)
+            if self.cache is not None:
+                self.cache.clear()
+            result = waiter.wait(timeout)
+        finally:
+            monitor.unsubscribe(waiter)
+        LOGGER.info('Connection result: %s', result)
+        return result
 
     def disconnect(self) -> None:
         "Disconnect interface."
         LOGGER.info('Disconnecting')
-        self._send(b'DISCONNECT')
+        self._command(b'DISCONNECT')
+
+    def roam(self, bssid: str) -> None:
+        "Roam to another BSS of the current network."
+        LOGGER.info('Roaming to %s', bssid)
+        self._command(f'ROAM {bssid}')
+
+    def set_bssid(self, network_id: int, bssid: str,
+                  reassociate: bool=False) -> None:
+        """
+        Prefer a BSS for given network, optionally reassociating to it.
+        """
+        LOGGER.info('Setting BSSID of network %i to %s', network_id, bssid)
+        cmds = [f'BSSID {network_id} {bssid}']
+        if reassociate:
+            cmds.append(b'REASSOCIATE')
+        self._commands(cmds)
 
     def save_config(self):
         "Save running config to file."
         LOGGER.info('Saving configuration')
-        self._send(b'SAVE_CONFIG')
+        self._command(b'SAVE_CONFIG')
 
     def stop_ap(self):
         "Stop access point."
         LOGGER.info('Stopping access point')
-        self._send(b'STOP_AP')
+        self._command(b'STOP_AP')
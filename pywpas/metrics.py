@@ -0,0 +1,154 @@
+"Per-command metrics of control socket requests."
+
+import threading
+import logging
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# Upper bounds (seconds) of latency buckets, the last one is unbounded.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0,
+)
+OUTCOME_OK = 'ok'
+OUTCOME_FAIL = 'fail'
+OUTCOME_TIMEOUT = 'timeout'
+
+# Called with command, seconds, bytes sent, bytes received and outcome.
+Hook = Callable[[str, float, int, int, str], None]
+
+
+class Histogram:
+    """
+    Counts of values in fixed buckets.
+
+    Observing a value is a bisect and an increment, nothing is allocated.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Iterable[float]=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        "Count a value."
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        "(upper bound, count of values <= bound) pairs, as Prometheus uses."
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q: float) -> float:
+        "Upper bound of the bucket holding the q quantile, or None."
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class CommandStats:
+    "Counters of one command."
+    __slots__ = ('count', 'failures', 'timeouts', 'bytes_sent',
+                 'bytes_received', 'latency')
+
+    def __init__(self, buckets: Iterable[float]=LATENCY_BUCKETS):
+        self.count = self.failures = self.timeouts = 0
+        self.bytes_sent = self.bytes_received = 0
+        self.latency = Histogram(buckets)
+
+    def observe(self, elapsed: float, sent: int, received: int,
+                outcome: str) -> None:
+        "Count a request."
+        self.count += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        if outcome == OUTCOME_FAIL:
+            self.failures += 1
+        elif outcome == OUTCOME_TIMEOUT:
+            self.timeouts += 1
+        self.latency.observe(elapsed)
+
+    def as_dict(self) -> Dict:
+        "Counters and latency summary."
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_sum': self.latency.sum,
+            'latency_p50': self.latency.quantile(0.5),
+            'latency_p99': self.latency.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Collects per-command counters and latency histograms.
+
+    Commands are keyed by their name (first word, e.g. STATUS). Timed out
+    requests count towards timeouts and their latency is the time waited.
+    Hooks are called with every observation, to export them elsewhere
+    (StatsD, Prometheus...); they run on the requesting thread so should
+    be quick.
+    """
+    def __init__(self, buckets: Iterable[float]=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._commands = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        "Call hook with each observation."
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        "Stop calling hook."
+        self._hooks.remove(hook)
+
+    def observe(self, command: str, elapsed: float, sent: int, received: int,
+                outcome: str) -> None:
+        "Record a request."
+        with self._lock:
+            stats = self._commands.get(command)
+            if stats is None:
+                stats = self._commands[command] = CommandStats(self._buckets)
+            stats.observe(elapsed, sent, received, outcome)
+        for hook in self._hooks:
+            try:
+                hook(command, elapsed, sent, received, outcome)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Error in metrics hook')
+
+    def command(self, command: str) -> CommandStats:
+        "Stats of given command, or None if never sent."
+        return self._commands.get(command)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        "Counters of every command, by name."
+        with self._lock:
+            return {
+                name: stats.as_dict()
+                for name, stats in self._commands.items()
+            }
+
+    def reset(self) -> None:
+        "Forget all counters."
+        with self._lock:
+            self._commands.clear()
@@ -1,41 +1,206 @@
 "Representation of wpa_supplicant constructs."
 # pylint: disable=too-many-instance-attributes
 
-from dataclasses import dataclass
-from typing import List
+import re
 
-from .utils import safe_decode
+from enum import Enum
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import List, Dict, Union, Iterable, Iterator
+
+from .utils import (
+    safe_decode, safe_encode, quote, is_hex_psk, frequency_band,
+)
+
+
+EVENT_SCAN_STARTED = 'CTRL-EVENT-SCAN-STARTED'
+EVENT_SCAN_RESULTS = 'CTRL-EVENT-SCAN-RESULTS'
+EVENT_SCAN_FAILED = 'CTRL-EVENT-SCAN-FAILED'
+EVENT_CONNECTED = 'CTRL-EVENT-CONNECTED'
+EVENT_DISCONNECTED = 'CTRL-EVENT-DISCONNECTED'
+EVENT_TERMINATING = 'CTRL-EVENT-TERMINATING'
+EVENT_SSID_TEMP_DISABLED = 'CTRL-EVENT-SSID-TEMP-DISABLED'
+EVENT_ASSOC_REJECT = 'CTRL-EVENT-ASSOC-REJECT'
+EVENT_AUTH_REJECT = 'CTRL-EVENT-AUTH-REJECT'
+EVENT_NETWORK_NOT_FOUND = 'CTRL-EVENT-NETWORK-NOT-FOUND'
+EVENT_STATE_CHANGE = 'CTRL-EVENT-STATE-CHANGE'
+EVENT_SSID_REENABLED = 'CTRL-EVENT-SSID-REENABLED'
+EVENT_NETWORK_ADDED = 'CTRL-EVENT-NETWORK-ADDED'
+EVENT_NETWORK_REMOVED = 'CTRL-EVENT-NETWORK-REMOVED'
+# Progress messages that are not CTRL-EVENT-*, matched by prefix.
+MSG_AUTHENTICATING = 'SME: Trying to authenticate with'
+MSG_ASSOCIATING = 'Trying to associate with'
+MSG_ASSOCIATED = 'Associated with'
+MSG_KEY_NEGOTIATED = 'WPA: Key negotiation completed'
+
+# GET_NETWORK/SET_NETWORK fields wpa_supplicant will read back, and the
+# Profile attributes they map to.
+PROFILE_FIELDS = {
+    'key_mgmt': 'key_mgmt',
+    'proto': 'proto',
+    'pairwise': 'ciphers',
+}
+# Network fields holding a space separated set, and aliases of values.
+SET_FIELDS = ('key_mgmt', 'proto', 'pairwise', 'group', 'auth_alg', 'eap')
+FIELD_ALIASES = {
+    'proto': {'WPA2': 'RSN'},
+}
+
+EVENT_PARAM = re.compile(r'([\w-]+)=(\'[^\']*\'|"[^"]*"|\S*)')
+EVENT_BSSID = re.compile(r'(?:[0-9a-f]{2}:){5}[0-9a-f]{2}')
+
+
+class WpaState(str, Enum):
+    "wpa_state values of STATUS, compare equal to their string."
+    DISCONNECTED = 'DISCONNECTED'
+    INTERFACE_DISABLED = 'INTERFACE_DISABLED'
+    INACTIVE = 'INACTIVE'
+    SCANNING = 'SCANNING'
+    AUTHENTICATING = 'AUTHENTICATING'
+    ASSOCIATING = 'ASSOCIATING'
+    ASSOCIATED = 'ASSOCIATED'
+    FOUR_WAY_HANDSHAKE = '4WAY_HANDSHAKE'
+    GROUP_HANDSHAKE = 'GROUP_HANDSHAKE'
+    COMPLETED = 'COMPLETED'
+    UNKNOWN = 'UNKNOWN'
+
+    def __str__(self):
+        return self.value
+
+
+WPA_STATES = {state.value.encode('ascii'): state for state in WpaState}
+
+
+def normalize_field(name: str, value: str) -> str:
+    """
+    Canonical form of a network field value, for comparison.
+
+    Sets (key_mgmt, pairwise...) are sorted and aliases (proto WPA2 is RSN)
+    resolved, a BSSID is lower cased.
+    """
+    if value is None:
+        return None
+    if name in SET_FIELDS:
+        aliases = FIELD_ALIASES.get(name, {})
+        return ' '.join(sorted({
+            aliases.get(v, v) for v in value.upper().split()
+        }))
+    if name == 'bssid':
+        return value.lower()
+    return value
+
+
+def _wpa_state(val: bytes) -> Union[WpaState, str]:
+    "WpaState, or the string for states this version doesn't know."
+    return WPA_STATES.get(val) or val.decode('ascii')
+
+
+# STATUS fields, with a converter from bytes. Missing ones are None.
+STATUS_FIELDS = {
+    b'bssid': bytes.decode,
+    b'freq': int,
+    b'ssid': bytes.decode,
+    b'id': int,
+    b'mode': bytes.decode,
+    b'wpa_state': _wpa_state,
+    b'pairwise_cipher': bytes.decode,
+    b'group_cipher': bytes.decode,
+    b'key_mgmt': bytes.decode,
+    b'ip_address': bytes.decode,
+    b'p2p_device_address': bytes.decode,
+    b'address': bytes.decode,
+    b'uuid': bytes.decode,
+    b'wifi_generation': int,
+    b'sae_group': int,
+}
+
+
+def _status_field(key: bytes) -> property:
+    "Property reading key, None if missing."
+    convert = STATUS_FIELDS[key]
+
+    def getter(self):
+        value = self.raw.get(key)
+        return None if value is None else convert(value)
+    return property(getter, doc=f'{key.decode()} field of STATUS.')
 
 
-@dataclass
 class InterfaceStatus:
-    "Represents a wifi interface status."
-    bssibd: str
-    frequency: int
-    ssid: str
-    id: str  # pylint: disable=invalid-name
-    mode: str
-    wpa_state: str
-    pairwise_cipher: str
-    group_cipher: str
-    key_mgmt: str
-    ip_address: str
-    p2p_device_address: str
-    address: str
-    uuid: str
+    """
+    Represents a wifi interface status.
+
+    Keeps the STATUS reply as is. It is split into raw values by key (raw)
+    when a field is first read, values are decoded and converted (see
+    STATUS_FIELDS) as they are read. Known fields missing from the reply are
+    None, other keys wpa_supplicant sends are available as strings.
+    """
+    # raw is only set once the reply is split, see __getattr__.
+    __slots__ = ('_data', 'raw')
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def __getattr__(self, name):
+        if name == 'raw':
+            return self._split()
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = self.get(name, self)
+        if value is self:
+            raise AttributeError(name)
+        return value
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._data == other._data
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'InterfaceStatus({self._data!r})'
 
     def __str__(self):
         return f'wpa_state={self.wpa_state}'
 
+    def _split(self) -> Dict[bytes, bytes]:
+        "Set raw to the values of the reply by key."
+        raw = self.raw = {}  # pylint: disable=attribute-defined-outside-init
+        for line in self._data.split(b'\n'):
+            # Values may contain =, keys never do.
+            key, sep, val = line.partition(b'=')
+            if sep:
+                raw[key] = val
+        return raw
+
+    def get(self, key: str, default=None):
+        "Value of a STATUS key, or default."
+        key = safe_encode(key)
+        value = self.raw.get(key)
+        if value is None:
+            return default
+        return STATUS_FIELDS.get(key, bytes.decode)(value)
+
+    def keys(self) -> List[str]:
+        "Keys present in the reply."
+        return [safe_decode(key) for key in self.raw]
+
+    def as_dict(self) -> Dict[str, object]:
+        "All fields, converted."
+        return {key: self.get(key) for key in self.keys()}
+
     @staticmethod
-    def deserialize(data):
-        "Deserialize wpa_supplicant form of interface status to object."
-        kwargs = {}
-        for line in data:
-            key, val = line.split(b'=')
-            kwargs[safe_decode(key)] = safe_decode(val)
-        kwargs['frequency'] = int(kwargs.pop('freq'))
-        return InterfaceStatus(**kwargs)
+    def deserialize(data: Union[bytes, List[bytes]]) -> 'InterfaceStatus':
+        "Wrap a STATUS reply, as bytes or a list of lines."
+        if not isinstance(data, bytes):
+            data = b'\n'.join(data)
+        return InterfaceStatus(data)
+
+
+for _key in STATUS_FIELDS:
+    setattr(InterfaceStatus, _key.decode(), _status_field(_key))
+InterfaceStatus.frequency = InterfaceStatus.freq
+del _key
 
 
 @dataclass
@@ -47,20 +212,76 @@ class Profile:
     proto: str = None
     ciphers: str = None
     psk: str = None
+    bssid: str = None
+    flags: str = None
+    # Other network fields (priority, eap...), as written in the config.
+    extra: Dict[str, str] = field(default_factory=dict)
 
     def __str__(self):
         return f'id={self.id}, ssid={self.ssid}, key_mgmt={self.key_mgmt}, ' \
                f'proto={self.proto}, ciphers={self.ciphers}, psk={self.psk}'
 
+    @staticmethod
+    def deserialize(network):
+        "Deserialize a row of wpa_supplicant's network list into object."
+        values = safe_decode(network).split('\t')
+        values += [None] * (4 - len(values))
+        return Profile(id=int(values[0]), ssid=values[1] or None,
+                       bssid=values[2], flags=values[3])
+
+    def serialize(self) -> Dict[str, str]:
+        """
+        Serialize object into wpa_supplicant form of network fields.
+
+        Returns SET_NETWORK values by field name, unset fields are left out.
+        Strings are quoted, a 64 hex digit psk is passed as a raw key. Extra
+        fields follow as they are.
+        """
+        fields = {}
+        if self.ssid is not None:
+            fields['ssid'] = quote(self.ssid)
+        if self.bssid is not None and self.bssid != 'any':
+            fields['bssid'] = self.bssid
+        for name, attr in PROFILE_FIELDS.items():
+            if getattr(self, attr) is not None:
+                fields[name] = getattr(self, attr)
+        if self.psk is not None:
+            fields['psk'] = self.psk if is_hex_psk(self.psk) \
+                else quote(self.psk)
+        fields.update(self.extra)
+        return fields
+
 
-@dataclass
 class Scanned:
-    "Represents a wifi network in wpa_supplicant config file."
-    bssid: str = None
-    frequency: int = None
-    signal_level: int = None
-    flags: str = None
-    ssid: str = None
+    """
+    Represents a wifi network found by scanning.
+
+    A plain __slots__ record, scan results are parsed often and in bulk.
+    """
+    __slots__ = ('bssid', 'frequency', 'signal_level', 'flags', 'ssid')
+
+    def __init__(self, bssid: str=None, frequency: int=None,
+                 signal_level: int=None, flags: str=None, ssid: str=None):
+        self.bssid = bssid
+        self.frequency = frequency
+        self.signal_level = signal_level
+        self.flags = flags
+        self.ssid = ssid
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.bssid == other.bssid and \
+            self.frequency == other.frequency and \
+            self.signal_level == other.signal_level and \
+            self.flags == other.flags and self.ssid == other.ssid
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Scanned(bssid={self.bssid!r}, frequency={self.frequency!r}, ' \
+               f'signal_level={self.signal_level!r}, flags={self.flags!r}, ' \
+               f'ssid={self.ssid!r})'
 
     def __str__(self):
         return f'bssid={self.bssid}, frequency={self.frequency}, ' \
@@ -70,28 +291,332 @@ class Scanned:
     @staticmethod
     def deserialize(header, network):
         "Deserialize wpa_supplicant form of network into object."
-        kwargs = {}
-        fields = safe_decode(header).split(' / ')
-        fields = map(lambda x: x.strip().replace(' ', '_'), fields)
-        values = safe_decode(network).split('\t')
-        for i, field in enumerate(fields):
-            try:
-                kwargs[field] = values[i].strip()
-            except IndexError:
-                kwargs[field] = None
-        kwargs['frequency'] = int(kwargs['frequency'])
-        if not kwargs['ssid']:
-            kwargs['ssid'] = None
-        return Scanned(**kwargs)
+        return scan_parser(safe_encode(header)).parse_row(safe_encode(network))
 
     def as_profile(self, psk=None) -> Profile:
         "Convert to profile for connecting."
         return Profile(ssid=self.ssid, psk=psk)
 
 
-def deserialize_scanned(lines: str) -> List[Scanned]:
-    "Convert wpa_supplicant form of network list into objects."
-    header = lines[0]
+class ScanParser:
+    """
+    Parser for SCAN_RESULTS replies.
+
+    The header is decoded once into a map of column positions, each row is
+    then split once and converted straight into a Scanned record. Use
+    scan_parser() to get a cached instance for a header.
+    """
+    __slots__ = ('_columns', '_required')
+
+    def __init__(self, header: bytes):
+        names = [
+            name.strip().replace(' ', '_')
+            for name in safe_decode(header).split(' / ')
+        ]
+        self._columns = tuple(
+            names.index(name) if name in names else None
+            for name in Scanned.__slots__
+        )
+        # Rows may omit trailing empty columns (hidden SSID), rows missing
+        # anything before that are cut short and skipped. Without any known
+        # column (empty or FAIL reply) there is nothing to parse.
+        known = [c for c in self._columns[:3] if c is not None]
+        self._required = max(known) + 1 if known else None
+
+    def parse_row(self, row: bytes) -> Scanned:
+        "Parse a single row, returns None if it is incomplete."
+        values = row.split(b'\t')
+        if self._required is None or len(values) < self._required:
+            return None
+        return self._record(values)
+
+    def _record(self, values: List[bytes]) -> Scanned:
+        "Record of a complete row's values."
+        bssid, frequency, signal_level, flags, ssid = [
+            values[c] if c is not None and c < len(values) else None
+            for c in self._columns
+        ]
+        return Scanned(
+            bssid.decode('ascii') if bssid is not None else None,
+            int(frequency) if frequency is not None else None,
+            int(signal_level) if signal_level is not None else None,
+            flags.decode('ascii') if flags is not None else None,
+            ssid.decode('utf-8', 'replace') if ssid else None,
+        )
+
+    def iter(self, data: bytes, start: int=0, min_signal: int=None,
+             bands: Iterable[str]=None, ssids: Iterable[str]=None
+             ) -> Iterator[Scanned]:
+        """
+        Yield records of the rows in data, from offset start on.
+
+        Rows are found one at a time in the buffer, so no list of lines or
+        records is built. Rows weaker than min_signal, outside bands (see
+        utils.BANDS) or whose SSID is not in ssids (hidden ones are '') are
+        skipped before a record is made.
+        """
+        _, c_freq, c_level, _, c_ssid = self._columns
+        required = self._required
+        if required is None:
+            return
+        if bands is not None:
+            bands = frozenset(bands)
+        if ssids is not None:
+            ssids = frozenset(safe_encode(ssid or '') for ssid in ssids)
+        if c_level is None:
+            min_signal = None
+        if c_freq is None:
+            bands = None
+        end = len(data)
+        while start < end:
+            stop = data.find(b'\n', start)
+            if stop == -1:
+                stop = end
+            values = data[start:stop].split(b'\t')
+            start = stop + 1
+            width = len(values)
+            if width < required:
+                continue
+            if min_signal is not None and int(values[c_level]) < min_signal:
+                continue
+            if bands is not None and \
+               frequency_band(int(values[c_freq])) not in bands:
+                continue
+            if ssids is not None and (
+                    values[c_ssid] if c_ssid is not None and c_ssid < width
+                    else b'') not in ssids:
+                continue
+            yield self._record(values)
+
+    def parse(self, rows: List[bytes]) -> List[Scanned]:
+        "Parse rows into records, skipping incomplete ones."
+        if self._required is None:
+            return []
+        # The usual column order gets an unrolled loop.
+        if self._columns != (0, 1, 2, 3, 4):
+            networks = [self.parse_row(row) for row in rows]
+            return [network for network in networks if network is not None]
+        networks = []
+        append = networks.append
+        for row in rows:
+            values = row.split(b'\t')
+            width = len(values)
+            if width < 3:
+                continue
+            append(Scanned(
+                values[0].decode('ascii'), int(values[1]), int(values[2]),
+                values[3].decode('ascii') if width > 3 else None,
+                values[4].decode('utf-8', 'replace')
+                if width > 4 and values[4] else None,
+            ))
+        return networks
+
+
+@lru_cache(maxsize=8)
+def scan_parser(header: bytes) -> ScanParser:
+    "Parser for given SCAN_RESULTS header, cached."
+    return ScanParser(header)
+
+
+def _hex_bytes(val: bytes) -> bytes:
+    return bytes.fromhex(val.decode('ascii'))
+
+
+# Fields of the BSS command, their MASK= bit (WPA_BSS_MASK_* in wpa_ctrl.h)
+# and how to convert their values.
+BSS_FIELDS = {
+    'id': (1 << 0, int),
+    'bssid': (1 << 1, lambda v: v.decode('ascii')),
+    'freq': (1 << 2, int),
+    'beacon_int': (1 << 3, int),
+    'capabilities': (1 << 4, lambda v: int(v, 16)),
+    'qual': (1 << 5, int),
+    'noise': (1 << 6, int),
+    'level': (1 << 7, int),
+    'tsf': (1 << 8, int),
+    'age': (1 << 9, int),
+    'ie': (1 << 10, _hex_bytes),
+    'flags': (1 << 11, lambda v: v.decode('ascii')),
+    'ssid': (1 << 12, lambda v: v.decode('utf-8', 'replace') or None),
+    'snr': (1 << 19, int),
+    'est_throughput': (1 << 20, int),
+    'update_idx': (1 << 22, int),
+    'beacon_ie': (1 << 23, _hex_bytes),
+}
+BSS_MASK_DELIM = 1 << 17
+BSS_CONVERTERS = {
+    name.encode('ascii'): convert for name, (_, convert) in BSS_FIELDS.items()
+}
+
+
+def bss_mask(fields) -> int:
+    "MASK= value requesting given BSS fields."
+    mask = 0
+    for name in fields:
+        mask |= BSS_FIELDS[name][0]
+    return mask
+
+
+class BSS:
+    """
+    Represents a BSS known to wpa_supplicant, as returned by BSS.
+
+    Only requested fields are set, the rest are None.
+    """
+    __slots__ = tuple(BSS_FIELDS)
+
+    def __init__(self, **kwargs):
+        # One attribute per BSS_FIELDS entry, spelled out for linters.
+        get = kwargs.get
+        self.id = get('id')  # pylint: disable=invalid-name
+        self.bssid = get('bssid')
+        self.freq = get('freq')
+        self.beacon_int = get('beacon_int')
+        self.capabilities = get('capabilities')
+        self.qual = get('qual')
+        self.noise = get('noise')
+        self.level = get('level')
+        self.tsf = get('tsf')
+        self.age = get('age')
+        self.ie = get('ie')  # pylint: disable=invalid-name
+        self.flags = get('flags')
+        self.ssid = get('ssid')
+        self.snr = get('snr')
+        self.est_throughput = get('est_throughput')
+        self.update_idx = get('update_idx')
+        self.beacon_ie = get('beacon_ie')
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.__slots__
+            if getattr(self, name) is not None)
+        return f'BSS({fields})'
+
+    def __str__(self):
+        return f'id={self.id}, bssid={self.bssid}, freq={self.freq}, ' \
+               f'level={self.level}, ssid={self.ssid}'
+
+
+def iter_bss(data: bytes) -> Iterator[BSS]:
+    """
+    Convert wpa_supplicant form of BSS entries into objects.
+
+    Entries are yielded one at a time as the reply is parsed. Entries are
+    separated by ==== lines (MASK= delimiter bit), wpa_supplicant ends the
+    last entry it knows of with #### instead.
+    """
+    bss = BSS()
+    empty = True
+    for line in data.split(b'\n'):
+        if line in (b'====', b'####'):
+            if not empty:
+                yield bss
+            bss, empty = BSS(), True
+            continue
+        key, sep, val = line.partition(b'=')
+        convert = BSS_CONVERTERS.get(key)
+        if not sep or convert is None:
+            continue
+        setattr(bss, key.decode('ascii'), convert(val))
+        empty = False
+    if not empty:
+        yield bss
+
+
+def deserialize_profiles(lines: List[bytes]) -> List[Profile]:
+    "Convert wpa_supplicant form of network list (LIST_NETWORKS) into objects."
     return [
-        Scanned.deserialize(header, l) for l in lines[1:]
+        Profile.deserialize(l) for l in lines[1:] if l
     ]
+
+
+def iter_scanned(data: bytes, min_signal: int=None,
+                 bands: Iterable[str]=None, ssids: Iterable[str]=None
+                 ) -> Iterator[Scanned]:
+    "Yield records of a SCAN_RESULTS reply as parsed, see ScanParser.iter()."
+    stop = data.find(b'\n')
+    if stop == -1:
+        return iter(())
+    return scan_parser(data[:stop]).iter(data, stop + 1, min_signal, bands,
+                                         ssids)
+
+
+def deserialize_scanned(lines: Union[bytes, List[bytes]]) -> List[Scanned]:
+    """
+    Convert wpa_supplicant form of network list into objects.
+
+    Accepts the raw reply or its lines.
+    """
+    if isinstance(lines, bytes):
+        lines = lines.split(b'\n')
+    return scan_parser(lines[0]).parse(lines[1:])
+
+
+@dataclass
+class Event:
+    "Represents an unsolicited message from wpa_supplicant."
+    level: int = None
+    name: str = None
+    message: str = None
+    bssid: str = None
+    params: Dict[str, str] = field(default_factory=dict)
+
+    def __str__(self):
+        return f'<{self.level}>{self.message}'
+
+    @staticmethod
+    def deserialize(data):
+        "Deserialize wpa_supplicant form of unsolicited message into object."
+        message, level = safe_decode(data).strip(), None
+        if message.startswith('<'):
+            level, _, message = message[1:].partition('>')
+            level = int(level)
+        params = {
+            key: val.strip('\'"') for key, val in EVENT_PARAM.findall(message)
+        }
+        bssid = params.get('bssid')
+        if bssid is None:
+            match = EVENT_BSSID.search(message)
+            bssid = match.group(0) if match else None
+        return Event(level=level, name=message.split(' ', 1)[0],
+                     message=message, bssid=bssid, params=params)
+
+
+@dataclass
+class ConnectResult:
+    "Outcome of a connection attempt, with seconds spent in each phase."
+    success: bool = False
+    bssid: str = None
+    reason: str = None
+    scan: float = None
+    auth: float = None
+    assoc: float = None
+    handshake: float = None
+    total: float = None
+
+    def __str__(self):
+        return f'success={self.success}, bssid={self.bssid}, ' \
+               f'reason={self.reason}, total={self.total}'
+
+
+@dataclass
+class SyncResult:
+    "Network profiles changed by syncing."
+    added: List[Profile] = field(default_factory=list)
+    updated: List[Profile] = field(default_factory=list)
+    removed: List[Profile] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def __str__(self):
+        return f'added={len(self.added)}, updated={len(self.updated)}, ' \
+               f'removed={len(self.removed)}'
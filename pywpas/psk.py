@@ -0,0 +1,136 @@
+"Client side derivation of WPA pre-shared keys."
+
+import os
+import sys
+import hashlib
+import threading
+import logging
+import multiprocessing
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
+
+from .utils import is_hex_psk
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+PBKDF2_ITERATIONS = 4096
+PSK_LENGTH = 32
+# Derived keys remembered, by (ssid, passphrase).
+PSK_CACHE_SIZE = 256
+# Fewer keys than this are derived in process, a pool isn't worth it.
+POOL_MIN = 4
+# Workers are spawned, forking a process running threads (monitors,
+# watchers) could copy locks held by them. Python 3.6 can only fork.
+POOL_OPTIONS = {'mp_context': multiprocessing.get_context('spawn')} \
+    if sys.version_info >= (3, 7) else {}
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_EXECUTOR = None
+
+
+def _pbkdf2(ssid: str, passphrase: str) -> str:
+    "PBKDF2-SHA1 of passphrase salted with ssid, as 64 hex digits."
+    return hashlib.pbkdf2_hmac(
+        'sha1', passphrase.encode('utf-8'), ssid.encode('utf-8'),
+        PBKDF2_ITERATIONS, PSK_LENGTH).hex()
+
+
+def _check(ssid: str, passphrase: str) -> None:
+    if not ssid or len(ssid.encode('utf-8')) > 32:
+        raise ValueError(f'Invalid SSID: {ssid!r}')
+    if not 8 <= len(passphrase) <= 63:
+        raise ValueError('Passphrase must be 8 to 63 characters')
+
+
+def _cached(key: Tuple[str, str]) -> str:
+    with _lock:
+        psk = _cache.get(key)
+        if psk is not None:
+            _cache.move_to_end(key)
+        return psk
+
+
+def _remember(key: Tuple[str, str], psk: str) -> None:
+    with _lock:
+        _cache[key] = psk
+        _cache.move_to_end(key)
+        while len(_cache) > PSK_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def derive_psk(ssid: str, passphrase: str) -> str:
+    """
+    The 256-bit PSK wpa_supplicant would derive from a passphrase.
+
+    Returned as 64 hex digits, which SET_NETWORK psk takes as is. A
+    passphrase that already is a hex PSK is returned unchanged.
+    """
+    if is_hex_psk(passphrase):
+        return passphrase
+    key = (ssid, passphrase)
+    psk = _cached(key)
+    if psk is None:
+        _check(ssid, passphrase)
+        psk = _pbkdf2(ssid, passphrase)
+        _remember(key, psk)
+    return psk
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    "Process pool shared by derive_psks() calls, started on first use."
+    global _EXECUTOR  # pylint: disable=global-statement
+    with _lock:
+        if _EXECUTOR is None:
+            _EXECUTOR = ProcessPoolExecutor(max_workers=workers,
+                                            **POOL_OPTIONS)
+        return _EXECUTOR
+
+
+def shutdown_pool() -> None:
+    "Stop the worker processes of derive_psks(), if started."
+    global _EXECUTOR  # pylint: disable=global-statement
+    with _lock:
+        executor, _EXECUTOR = _EXECUTOR, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def derive_psks(pairs: Iterable[Tuple[str, str]],
+                workers: int=None) -> List[str]:
+    """
+    derive_psk() of many (ssid, passphrase) pairs.
+
+    Keys not cached are derived in a pool of workers processes (one per
+    CPU by default), when there are at least POOL_MIN of them and more than
+    one worker. The pool is kept for later calls, see shutdown_pool().
+    """
+    pairs = list(pairs)
+    psks = [None] * len(pairs)
+    missing = {}
+    for i, (ssid, passphrase) in enumerate(pairs):
+        if is_hex_psk(passphrase):
+            psks[i] = passphrase
+            continue
+        psks[i] = _cached((ssid, passphrase))
+        if psks[i] is None:
+            _check(ssid, passphrase)
+            missing.setdefault((ssid, passphrase), []).append(i)
+    workers = workers or os.cpu_count() or 1
+    if len(missing) < POOL_MIN or workers < 2:
+        derived = [_pbkdf2(*key) for key in missing]
+    else:
+        LOGGER.debug('Deriving %i keys in %i processes', len(missing),
+                     workers)
+        derived = _pool(workers).map(
+            _pbkdf2, *zip(*missing), chunksize=max(
+                1, len(missing) // (workers * 4)))
+    for (key, indexes), psk in zip(missing.items(), derived):
+        _remember(key, psk)
+        for i in indexes:
+            psks[i] = psk
+    return psks
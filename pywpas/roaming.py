@@ -0,0 +1,237 @@
+"Roaming between BSSes of the current network."
+# pylint: disable=too-many-instance-attributes
+
+import time
+import queue
+import threading
+import logging
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+from .exceptions import WpasError, CommandFailedError
+from .models import Event, Scanned, EVENT_SCAN_RESULTS, EVENT_CONNECTED
+from .telemetry import SignalHistory
+from .utils import frequency_band, Worker, BAND_5GHZ, BAND_6GHZ
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# BSSID clearing a network's preferred BSS.
+ANY_BSSID = '00:00:00:00:00:00'
+
+
+@dataclass
+class RoamPolicy:
+    "Thresholds of roaming decisions."
+    # Only look for a better BSS while the current signal is below (dBm).
+    trigger: int = -70
+    # A candidate must be this much better than the current BSS (dB).
+    hysteresis: int = 8
+    # Candidates weaker than this are never considered (dBm).
+    min_signal: int = -80
+    # Candidates not seen in scan results for this long are ignored (s).
+    max_age: float = 30.0
+    # Wait at least this long between roams (s).
+    min_interval: float = 15.0
+    # Don't roam back to a BSS left less than this long ago (s).
+    backoff: float = 60.0
+    # Weight of the newest level in the smoothed level of a BSS.
+    smoothing: float = 0.5
+    # Added to the level of BSSes in these bands (dB).
+    band_bonus: Dict[str, int] = field(
+        default_factory=lambda: {BAND_5GHZ: 3, BAND_6GHZ: 5})
+
+
+class Roamer(Worker):
+    """
+    Move to a better BSS of the current SSID.
+
+    Candidates come from the interface's ScanIndex, scored by their
+    smoothed signal level plus a band bonus. The current BSS is scored from
+    signal telemetry when a SignalHistory is given (the mean of its last
+    samples), otherwise from its scan results. Roaming happens when the
+    current signal is below the trigger and the best candidate beats the
+    current BSS by the hysteresis margin, no more than once per
+    min_interval and not back to a BSS recently left.
+
+    decide() only uses data in memory. start() runs check() on a thread of
+    its own after each scan results event, then issues ROAM. Where ROAM
+    fails the network is pinned to the new BSS with BSSID and REASSOCIATE,
+    the pin is cleared again once connected so wpa_supplicant can pick any
+    BSS later on.
+    """
+    def __init__(self, interface: 'Interface', policy: RoamPolicy=None,
+                 history: SignalHistory=None):
+        self._interface = interface
+        self.policy = policy or RoamPolicy()
+        self._history = history
+        self._smoothed = {}
+        self._left = {}
+        self._last_roam = None
+        self._bssid = None
+        self._ssid = None
+        self._network_id = None
+        # Network pinned to a BSS by a fallback roam, until connected.
+        self._pinned = None
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        super().__init__()
+
+    @property
+    def current(self) -> Optional[str]:
+        "BSSID currently associated with, as last known."
+        return self._bssid
+
+    def refresh(self) -> None:
+        "Learn the current association from STATUS."
+        status = self._interface.status()
+        self._bssid, self._ssid = status.bssid, status.ssid
+        self._network_id = status.id
+
+    def observe(self, networks: Iterable[Scanned]) -> None:
+        "Update smoothed levels from scan results."
+        alpha = self.policy.smoothing
+        smoothed = self._smoothed
+        for network in networks:
+            level = smoothed.get(network.bssid)
+            smoothed[network.bssid] = network.signal_level if level is None \
+                else level + alpha * (network.signal_level - level)
+
+    def _score(self, network: Scanned) -> float:
+        level = self._smoothed.get(network.bssid, network.signal_level)
+        return level + self.policy.band_bonus.get(
+            frequency_band(network.frequency), 0)
+
+    def _current_level(self) -> Optional[float]:
+        "Signal of the current BSS, from telemetry if available."
+        if self._history is not None and len(self._history.rssi):
+            rssi = self._history.rssi
+            recent = [rssi[i] for i in range(max(-len(rssi), -3), 0)]
+            return sum(recent) / len(recent)
+        level = self._smoothed.get(self._bssid)
+        if level is None:
+            network = self._interface.scan_index.get(self._bssid)
+            level = network.signal_level if network else None
+        return level
+
+    def decide(self, now: float=None) -> Optional[Scanned]:
+        "The BSS to roam to, or None to stay."
+        policy = self.policy
+        now = time.time() if now is None else now
+        if self._bssid is None or self._ssid is None:
+            return None
+        if self._last_roam is not None and \
+           now - self._last_roam < policy.min_interval:
+            return None
+        level = self._current_level()
+        if level is None or level >= policy.trigger:
+            return None
+        index = self._interface.scan_index
+        current = index.get(self._bssid)
+        current_score = level + (
+            policy.band_bonus.get(frequency_band(current.frequency), 0)
+            if current is not None else 0)
+        best, best_score = None, current_score + policy.hysteresis
+        for network in index.by_ssid(self._ssid):
+            if network.bssid == self._bssid or \
+               network.signal_level < policy.min_signal:
+                continue
+            seen = index.last_seen(network.bssid)
+            if seen is None or now - seen > policy.max_age:
+                continue
+            left = self._left.get(network.bssid)
+            if left is not None and now - left < policy.backoff:
+                continue
+            score = self._score(network)
+            if score >= best_score:
+                best, best_score = network, score
+        return best
+
+    def roam(self, network: Scanned, now: float=None) -> None:
+        "Move to given BSS."
+        now = time.time() if now is None else now
+        LOGGER.info('Roaming from %s (%s) to %s (%i dBm)', self._bssid,
+                    self._ssid, network.bssid, network.signal_level)
+        try:
+            self._interface.roam(network.bssid)
+        except CommandFailedError:
+            if self._network_id is None:
+                raise
+            # Driver can't roam, make the supplicant reassociate instead.
+            self._interface.set_bssid(self._network_id, network.bssid,
+                                      reassociate=True)
+            self._pinned = self._network_id
+        if self._bssid is not None:
+            self._left[self._bssid] = now
+        self._last_roam = now
+        self._bssid = network.bssid
+
+    def check(self, now: float=None) -> Optional[Scanned]:
+        "Fetch scan results, then roam if worth it. Returns the new BSS."
+        with self._lock:
+            self._interface.scan_results()
+            self.observe(self._interface.scan_index.values())
+            network = self.decide(now)
+            if network is not None:
+                self.roam(network, now)
+            return network
+
+    def unpin(self) -> None:
+        "Clear the BSS a fallback roam pinned the network to, if any."
+        with self._lock:
+            pinned, self._pinned = self._pinned, None
+            if pinned is not None:
+                self._interface.set_bssid(pinned, ANY_BSSID)
+
+    def _on_event(self, event: Event) -> None:
+        "Monitor callback, handled on the roamer thread."
+        self._events.put(event.name)
+
+    def _handle(self, names) -> None:
+        "React to events of given names."
+        try:
+            if EVENT_CONNECTED in names:
+                self.unpin()
+                with self._lock:
+                    self.refresh()
+            if EVENT_SCAN_RESULTS in names:
+                self.check()
+        except (OSError, WpasError) as e:
+            LOGGER.warning('Roaming check failed: %s', e)
+
+    def _run(self):
+        "Roamer thread entry point."
+        while not self._stopped.is_set():
+            try:
+                names = {self._events.get(timeout=0.1)}
+            except queue.Empty:
+                continue
+            # Events queued meanwhile are handled at once, one check will do.
+            while True:
+                try:
+                    names.add(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            self._handle(names)
+
+    def start(self) -> None:
+        "Check on each scan results event."
+        if self.running:
+            return
+        self.refresh()
+        super().start()
+        self._interface.monitor.subscribe(
+            self._on_event, EVENT_SCAN_RESULTS, EVENT_CONNECTED)
+
+    def stop(self) -> None:
+        "Stop roaming, clearing a BSS pin left behind."
+        if not self.running:
+            return
+        self._interface.monitor.unsubscribe(self._on_event)
+        super().stop()
+        try:
+            self.unpin()
+        except (OSError, WpasError) as e:
+            LOGGER.warning('Clearing BSSID failed: %s', e)
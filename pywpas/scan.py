@@ -0,0 +1,197 @@
+"Index of scan results."
+# pylint: disable=too-many-instance-attributes
+
+import time
+import threading
+import logging
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .models import Scanned
+from .utils import frequency_band
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# wpa_supplicant's defaults for BSS_EXPIRE_AGE and BSS_EXPIRE_COUNT.
+BSS_EXPIRE_AGE = 180.0
+BSS_EXPIRE_COUNT = 2
+
+
+class ScanIndex:
+    """
+    Scan results keyed by BSSID.
+
+    Secondary indexes by SSID and frequency band are kept up to date as each
+    new result set is merged, along with the strongest BSS per SSID. Entries
+    not seen for max_age seconds, or missing from the last max_count merges,
+    are evicted (like wpa_supplicant's BSS_EXPIRE_AGE and BSS_EXPIRE_COUNT).
+    Either limit can be disabled with None.
+    """
+    def __init__(self, max_age: float=BSS_EXPIRE_AGE,
+                 max_count: int=BSS_EXPIRE_COUNT):
+        self.max_age = max_age
+        self.max_count = max_count
+        self._bss = {}
+        self._seen = {}
+        self._by_ssid = {}
+        self._by_band = {}
+        self._best = {}
+        # max_age of restored entries not merged since, by BSSID.
+        self._restored = {}
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._bss)
+
+    def __contains__(self, bssid):
+        return bssid in self._bss
+
+    def __iter__(self) -> Iterator[Scanned]:
+        return iter(self.values())
+
+    def values(self) -> List[Scanned]:
+        "All indexed results."
+        with self._lock:
+            return list(self._bss.values())
+
+    def get(self, bssid: str) -> Scanned:
+        "Result for given BSSID, or None."
+        return self._bss.get(bssid)
+
+    def best(self, ssid: str) -> Scanned:
+        "Strongest BSS for given SSID, or None."
+        return self._best.get(ssid)
+
+    def by_ssid(self, ssid: str) -> List[Scanned]:
+        "All BSSes for given SSID."
+        with self._lock:
+            return list(self._by_ssid.get(ssid, {}).values())
+
+    def by_band(self, band: str) -> List[Scanned]:
+        "All BSSes in given band, see utils.BANDS."
+        with self._lock:
+            return list(self._by_band.get(band, {}).values())
+
+    def ssids(self) -> List[str]:
+        "SSIDs with at least one BSS."
+        with self._lock:
+            return list(self._by_ssid)
+
+    def last_seen(self, bssid: str) -> float:
+        "Time a BSS was last seen in results, or None."
+        seen = self._seen.get(bssid)
+        return seen[0] if seen else None
+
+    def items(self) -> List[Tuple[Scanned, float]]:
+        "All indexed results with the time they were last seen."
+        with self._lock:
+            return [(network, self._seen[bssid][0])
+                    for bssid, network in self._bss.items()]
+
+    def _add(self, network: Scanned) -> None:
+        self._bss[network.bssid] = network
+        self._by_ssid.setdefault(network.ssid, {})[network.bssid] = network
+        self._by_band.setdefault(
+            frequency_band(network.frequency), {})[network.bssid] = network
+        best = self._best.get(network.ssid)
+        if best is None or network.signal_level > best.signal_level:
+            self._best[network.ssid] = network
+
+    def _remove(self, network: Scanned) -> None:
+        del self._bss[network.bssid]
+        for index, key in ((self._by_ssid, network.ssid),
+                           (self._by_band, frequency_band(network.frequency))):
+            entries = index[key]
+            del entries[network.bssid]
+            if not entries:
+                del index[key]
+        if self._best.get(network.ssid) is network:
+            del self._best[network.ssid]
+            entries = self._by_ssid.get(network.ssid)
+            if entries:
+                self._best[network.ssid] = max(
+                    entries.values(), key=lambda n: n.signal_level)
+
+    def merge(self, networks: Iterable[Scanned], now: float=None
+              ) -> List[Scanned]:
+        """
+        Merge a new result set.
+
+        Only new or changed rows touch the indexes, the rest just have their
+        last seen time refreshed. Returns the new or changed rows.
+        """
+        now = time.time() if now is None else now
+        changed = []
+        with self._lock:
+            self._generation += 1
+            for network in networks:
+                old = self._bss.get(network.bssid)
+                if old != network:
+                    if old is not None:
+                        self._remove(old)
+                    self._add(network)
+                    changed.append(network)
+                self._seen[network.bssid] = (now, self._generation)
+                self._restored.pop(network.bssid, None)
+            self.evict(now)
+        LOGGER.debug('Merged %i changed results', len(changed))
+        return changed
+
+    def restore(self, items: Iterable[Tuple[Scanned, float]],
+                now: float=None, max_age: float=None) -> None:
+        """
+        Add results seen earlier, as returned by items().
+
+        They keep their last seen time and count as part of the last merge,
+        entries already indexed are not replaced. Until merged again they
+        expire after max_age (e.g. that of the cache they come from) rather
+        than the index's own.
+        """
+        with self._lock:
+            for network, seen in items:
+                if network.bssid in self._bss:
+                    continue
+                self._add(network)
+                self._seen[network.bssid] = (seen, self._generation)
+                if max_age is not None:
+                    self._restored[network.bssid] = max_age
+            self.evict(now)
+
+    def evict(self, now: float=None) -> List[Scanned]:
+        "Remove expired entries, returns them."
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            for bssid, (seen, generation) in list(self._seen.items()):
+                max_age = self._restored.get(bssid, self.max_age)
+                if (max_age is not None and now - seen > max_age) \
+                   or (self.max_count is not None and
+                       self._generation - generation >= self.max_count):
+                    expired.append(self._bss[bssid])
+                    self.remove(bssid)
+        return expired
+
+    def remove(self, bssid: str) -> None:
+        "Remove a BSS."
+        with self._lock:
+            network = self._bss.get(bssid)
+            if network is None:
+                return
+            self._remove(network)
+            del self._seen[bssid]
+            self._restored.pop(bssid, None)
+
+    def clear(self) -> None:
+        "Remove all entries."
+        with self._lock:
+            for index in (self._bss, self._seen, self._by_ssid,
+                          self._by_band, self._best, self._restored):
+                index.clear()
+
+    def counts(self) -> Dict[str, int]:
+        "Number of BSSes per band."
+        with self._lock:
+            return {band: len(e) for band, e in self._by_band.items()}
@@ -0,0 +1,280 @@
+"Live signal telemetry from SIGNAL_POLL and PKTCNT_POLL."
+# pylint: disable=too-many-instance-attributes
+
+import time
+import logging
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable
+
+from .exceptions import WpasError
+from .utils import Worker
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+SAMPLE_RATE = 1.0
+HISTORY_SIZE = 600
+
+# Reply keys and the history column they are stored in.
+SIGNAL_KEYS = {
+    b'RSSI': 'rssi',
+    b'LINKSPEED': 'linkspeed',
+    b'NOISE': 'noise',
+    b'FREQUENCY': 'frequency',
+}
+PKTCNT_KEYS = {
+    b'TXGOOD': 'tx_good',
+    b'TXBAD': 'tx_bad',
+    b'RXGOOD': 'rx_good',
+}
+# Metric columns of a SignalHistory.
+COLUMNS = tuple(SIGNAL_KEYS.values()) + tuple(PKTCNT_KEYS.values())
+
+
+class RingBuffer:
+    """
+    Fixed size ring of numbers backed by an array.
+
+    Appending overwrites the oldest value once full and keeps a running sum,
+    so neither appending nor mean() allocate.
+    """
+    __slots__ = ('_data', '_size', '_count', '_next', '_sum')
+
+    def __init__(self, size: int, typecode: str='d'):
+        assert size > 0, 'Size must be positive'
+        self._data = array(typecode, [0]) * size
+        self._size = size
+        self.clear()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i: int):
+        "Value by age, 0 is the oldest and -1 the newest."
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('RingBuffer index out of range')
+        return self._data[(self._next - self._count + i) % self._size]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def clear(self) -> None:
+        "Forget all values."
+        self._count = self._next = 0
+        self._sum = 0
+
+    def append(self, value) -> None:
+        "Add a value, replacing the oldest one if full."
+        if self._count == self._size:
+            self._sum -= self._data[self._next]
+        else:
+            self._count += 1
+        self._data[self._next] = value
+        self._sum += value
+        self._next = (self._next + 1) % self._size
+
+    def mean(self) -> float:
+        "Mean of all values, or None if empty."
+        return self._sum / self._count if self._count else None
+
+    def min(self):
+        "Smallest value, or None if empty."
+        return min(islice(self._data, self._count)) if self._count else None
+
+    def max(self):
+        "Largest value, or None if empty."
+        return max(islice(self._data, self._count)) if self._count else None
+
+
+def _parse(data: bytes, keys: Dict[bytes, str]) -> Dict[str, int]:
+    "Values of a poll reply, by column name."
+    values = {}
+    for line in data.split(b'\n'):
+        key, _, val = line.partition(b'=')
+        name = keys.get(key)
+        if name is not None:
+            values[name] = int(val)
+    return values
+
+
+class SignalHistory:
+    """
+    Recent signal samples of one interface.
+
+    Each metric is a column of its own RingBuffer, rows stay aligned since a
+    sample is only recorded when both polls succeed and parse.
+    """
+    __slots__ = ('time', 'rssi', 'linkspeed', 'noise', 'frequency',
+                 'tx_good', 'tx_bad', 'rx_good')
+
+    def __init__(self, size: int=HISTORY_SIZE):
+        self.time = RingBuffer(size)
+        self.rssi = RingBuffer(size)
+        self.linkspeed = RingBuffer(size)
+        self.noise = RingBuffer(size)
+        self.frequency = RingBuffer(size)
+        self.tx_good = RingBuffer(size)
+        self.tx_bad = RingBuffer(size)
+        self.rx_good = RingBuffer(size)
+
+    def __len__(self):
+        return len(self.time)
+
+    def record(self, now: float, signal: bytes, pktcnt: bytes) -> None:
+        """
+        Parse SIGNAL_POLL and PKTCNT_POLL replies into a sample.
+
+        Both replies are parsed before anything is stored, so a malformed
+        one raises ValueError and leaves the history untouched. Values a
+        driver omits repeat the previous sample.
+        """
+        values = _parse(signal, SIGNAL_KEYS)
+        values.update(_parse(pktcnt, PKTCNT_KEYS))
+        self.time.append(now)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            value = values.get(name)
+            if value is None:
+                value = column[-1] if len(column) else 0
+            column.append(value)
+
+    def _delta(self, column: RingBuffer) -> float:
+        return column[-1] - column[0]
+
+    def tx_error_rate(self) -> float:
+        "Fraction of failed transmissions over the window, or None."
+        if len(self) < 2:
+            return None
+        bad, good = self._delta(self.tx_bad), self._delta(self.tx_good)
+        total = bad + good
+        return bad / total if total > 0 else 0.0
+
+    def tx_rate(self) -> float:
+        "Packets transmitted per second over the window, or None."
+        if len(self) < 2 or self._delta(self.time) <= 0:
+            return None
+        return (self._delta(self.tx_good) + self._delta(self.tx_bad)) / \
+            self._delta(self.time)
+
+    def rx_rate(self) -> float:
+        """
+        Packets received per second over the window, or None.
+
+        PKTCNT_POLL does not report receive errors, only good packets.
+        """
+        if len(self) < 2 or self._delta(self.time) <= 0:
+            return None
+        return self._delta(self.rx_good) / self._delta(self.time)
+
+    def summary(self) -> Dict[str, float]:
+        "Rolling aggregates over the window."
+        return {
+            'samples': len(self),
+            'rssi_mean': self.rssi.mean(),
+            'rssi_min': self.rssi.min(),
+            'rssi_max': self.rssi.max(),
+            'linkspeed_mean': self.linkspeed.mean(),
+            'linkspeed_min': self.linkspeed.min(),
+            'linkspeed_max': self.linkspeed.max(),
+            'tx_error_rate': self.tx_error_rate(),
+            'tx_rate': self.tx_rate(),
+            'rx_rate': self.rx_rate(),
+        }
+
+
+class SignalSampler(Worker):
+    """
+    Poll signal telemetry of several interfaces at a fixed rate.
+
+    Every 1/rate seconds SIGNAL_POLL and PKTCNT_POLL are pipelined to each
+    interface, concurrently, and recorded in a SignalHistory per interface.
+    A poll gets 1/rate seconds to complete, so an interface that hangs does
+    not hold up the others. Interfaces that are not associated (FAIL), don't
+    answer in time or are still busy with the previous round are skipped for
+    that round. Call start() to sample in the background, stop() to stop.
+    Polls run on threads kept between rounds, stop() ends them.
+    """
+    def __init__(self, interfaces: Iterable['Interface'],
+                 rate: float=SAMPLE_RATE, size: int=HISTORY_SIZE):
+        assert rate > 0, 'Rate must be positive'
+        self._interfaces = list(interfaces)
+        self._interval = 1.0 / rate
+        self._histories = {
+            interface.name: SignalHistory(size)
+            for interface in self._interfaces
+        }
+        # Poll of each interface still running, by name.
+        self._polls = {}
+        # At most one poll per interface runs at a time.
+        self._executor = None
+        super().__init__()
+
+    @property
+    def histories(self) -> Dict[str, SignalHistory]:
+        "History of each interface, by name."
+        return self._histories
+
+    def history(self, name: str) -> SignalHistory:
+        "History of given interface."
+        return self._histories[name]
+
+    def _poll(self, interface):
+        "Poll one interface and record the sample."
+        try:
+            signal, pktcnt = interface.signal_poll(self._interval)
+        except (OSError, WpasError) as e:
+            LOGGER.debug('Sampling %s failed: %s', interface.name, e)
+            return
+        if signal.startswith(b'FAIL') or pktcnt.startswith(b'FAIL'):
+            return
+        try:
+            self._histories[interface.name].record(time.time(), signal,
+                                                   pktcnt)
+        except ValueError as e:
+            LOGGER.warning('Malformed poll reply from %s: %s',
+                           interface.name, e)
+
+    def sample(self) -> None:
+        "Poll every interface once."
+        interfaces = [
+            interface for interface in self._interfaces
+            if interface.name not in self._polls
+            or self._polls[interface.name].done()
+        ]
+        if not interfaces:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self._interfaces))
+        for interface in interfaces:
+            self._polls[interface.name] = self._executor.submit(
+                self._poll, interface)
+        # A poll times out on its own, allow for that to happen.
+        wait([self._polls[i.name] for i in interfaces],
+             timeout=2 * self._interval)
+
+    def _run(self):
+        "Sampler thread entry point."
+        deadline = time.monotonic()
+        while not self._stopped.is_set():
+            self.sample()
+            deadline += self._interval
+            # Skip rounds rather than bursting after a slow one.
+            now = time.monotonic()
+            deadline = max(deadline, now)
+            self._stopped.wait(deadline - now)
+
+    def stop(self) -> None:
+        "Stop sampling and the polling threads."
+        super().stop()
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            # Don't wait for stragglers, they time out on their own.
+            executor.shutdown(wait=False)
@@ -1,14 +1,32 @@
 "Utility functions"
 
 import os
+import time
+import socket
 import tempfile
 import stat
+import threading
 import logging
 
+from typing import Iterable, List
 from os.path import join as pathjoin
 
+from .exceptions import TruncatedReplyError
+
 
 SOCKET_PREFIX = 'pywpas'
+RECV_BUFFER_SIZE = 4096
+RECONNECT_DELAY = 0.1
+RECONNECT_DELAY_MAX = 30.0
+BAND_2GHZ, BAND_5GHZ, BAND_6GHZ, BAND_60GHZ = '2.4GHz', '5GHz', '6GHz', '60GHz'
+BANDS = (
+    (BAND_2GHZ, 2400, 2500),
+    (BAND_5GHZ, 4900, 5895),
+    (BAND_6GHZ, 5925, 7125),
+    (BAND_60GHZ, 57240, 71000),
+)
+# Linux reports the full datagram length when peeking with MSG_TRUNC.
+PEEK_FLAGS = socket.MSG_PEEK | getattr(socket, 'MSG_TRUNC', 0)
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.NullHandler())
@@ -30,6 +48,22 @@ def safe_encode(val):
         return val
 
 
+def quote(val: str) -> str:
+    "Quote a string value for wpa_supplicant."
+    return f'"{val}"'
+
+
+def is_hex_psk(val: str) -> bool:
+    "True if val is a raw 256-bit PSK (64 hex digits) rather than a passphrase."
+    if len(val) != 64:
+        return False
+    try:
+        int(val, 16)
+    except ValueError:
+        return False
+    return True
+
+
 def tempnam(dir: str, prefix: str='') -> str:  # pylint: disable=redefined-builtin
     """
     Utility function.
@@ -44,6 +78,81 @@ def tempnam(dir: str, prefix: str='') -> str:  # pylint: disable=redefined-built
     return path
 
 
+def remove_client_socket(path: str) -> None:
+    "Remove a client socket file we bound."
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        LOGGER.warning('Error deleting client socket at: %s', path)
+
+
+def client_prefix() -> str:
+    "Prefix of client socket names, identifies this process."
+    return f'{SOCKET_PREFIX}-{os.getpid()}-'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by someone else.
+        return True
+    return True
+
+
+def _sock_orphaned(path: str) -> bool:
+    "True if nothing is bound to a socket file anymore."
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return False
+
+
+def sweep_sockets(path: str) -> List[str]:
+    """
+    Remove client sockets left behind by processes that are gone.
+
+    Sockets are only removed when nothing is bound to them anymore. Those
+    named by client_prefix() are skipped without a check while their
+    process exists, a process that seems gone may live in another PID
+    namespace (containers sharing the directory). Returns the names
+    removed.
+    """
+    removed = []
+    try:
+        names = os.listdir(path)
+    except OSError as e:
+        LOGGER.debug('Cannot sweep %s: %s', path, e)
+        return removed
+    for name in names:
+        if not name.startswith(SOCKET_PREFIX):
+            continue
+        full = pathjoin(path, name)
+        pid = name[len(SOCKET_PREFIX):].split('-')
+        if len(pid) > 2 and pid[1].isdigit() and _pid_alive(int(pid[1])):
+            continue
+        if not _sock_orphaned(full):
+            continue
+        try:
+            os.remove(full)
+        except OSError as e:
+            LOGGER.debug('Cannot remove %s: %s', full, e)
+            continue
+        removed.append(name)
+    if removed:
+        LOGGER.info('Removed %i stale client sockets from %s', len(removed),
+                    path)
+    return removed
+
+
 def is_sock(path):
     "Checks if given path is a socket"
     LOGGER.debug('Checking if %s is a socket', path)
@@ -58,3 +167,141 @@ def find_sockets(path):
         n for n in os.listdir(path) \
             if is_sock(pathjoin(path, n)) and not n.startswith(SOCKET_PREFIX)
     ]
+
+
+class Backoff:
+    """
+    Exponentially growing delay between reconnection attempts.
+
+    After a failure, attempts are refused until the delay has passed, so
+    many callers hitting a dead socket don't turn into a reconnect storm.
+    """
+    def __init__(self, initial: float=RECONNECT_DELAY,
+                 maximum: float=RECONNECT_DELAY_MAX):
+        self._initial = initial
+        self._maximum = maximum
+        self._delay = 0.0
+        self._retry_at = 0.0
+
+    @property
+    def delay(self) -> float:
+        "Current delay, 0 when the last attempt succeeded."
+        return self._delay
+
+    def remaining(self, now: float=None) -> float:
+        "Seconds until the next attempt is allowed."
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._retry_at - now)
+
+    def failed(self, now: float=None) -> float:
+        "Note a failed attempt, returns the delay until the next."
+        now = time.monotonic() if now is None else now
+        self._delay = min(max(self._delay * 2, self._initial), self._maximum)
+        self._retry_at = now + self._delay
+        return self._delay
+
+    def reset(self) -> None:
+        "Note a successful attempt."
+        self._delay = self._retry_at = 0.0
+
+
+class Worker:
+    """
+    Base of objects doing their work in a background thread.
+
+    Subclasses implement _run(), which returns once _stopped is set.
+    """
+    def __init__(self):
+        self._stopped = threading.Event()
+        self._t = None
+
+    @property
+    def running(self) -> bool:
+        "True while the background thread runs."
+        return self._t is not None
+
+    def _run(self):
+        raise NotImplementedError()
+
+    def start(self) -> None:
+        "Start the background thread."
+        if self._t is not None:
+            return
+        self._stopped.clear()
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+
+    def stop(self) -> None:
+        "Stop the background thread and wait for it to finish."
+        if self._t is None:
+            return
+        self._stopped.set()
+        self._t.join()
+        self._t = None
+
+
+class RecvBuffer:
+    """
+    Reusable receive buffer.
+
+    Grows to fit each datagram so large replies (SCAN_RESULTS, BSS) are
+    never silently truncated. Data is received directly into the buffer.
+    """
+    def __init__(self, size: int=RECV_BUFFER_SIZE):
+        self._peek = bytearray(1)
+        self._resize(size)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _resize(self, size):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+
+    def _pending(self, sock) -> int:
+        "Size of the next datagram, or 0 if the platform can't tell."
+        try:
+            return sock.recv_into(self._peek, 1, PEEK_FLAGS)
+        except OSError:
+            return 0
+
+    def recv(self, sock) -> bytes:
+        "Receive one datagram from sock."
+        size = self._pending(sock)
+        if size > len(self._buffer):
+            LOGGER.debug('Growing receive buffer to %i bytes', size)
+            self._resize(max(size, 2 * len(self._buffer)))
+        nbytes, _, flags, _ = sock.recvmsg_into([self._buffer])
+        if flags & getattr(socket, 'MSG_TRUNC', 0):
+            raise TruncatedReplyError(
+                f'Reply truncated to {nbytes} bytes')
+        return bytes(self._view[:nbytes])
+
+
+def frequency_band(frequency: int) -> str:
+    "Name of the band a frequency (MHz) falls in, or None."
+    for band, low, high in BANDS:
+        if low <= frequency <= high:
+            return band
+    return None
+
+
+def scan_command(freqs: Iterable[int]=None, ssids: Iterable[str]=None,
+                 passive: bool=False, only_new: bool=False) -> str:
+    """
+    SCAN command restricted to given frequencies (MHz) and SSIDs.
+
+    Fewer channels make a shorter scan. SSIDs are probed for directly
+    (which also finds hidden networks), passive scans only listen for
+    beacons. With only_new, results are limited to BSSes seen by this scan.
+    """
+    params = ['SCAN']
+    if freqs:
+        params.append('freq=' + ','.join(str(f) for f in sorted(set(freqs))))
+    for ssid in ssids or ():
+        params.append('ssid ' + safe_encode(ssid).hex())
+    if passive:
+        params.append('passive=1')
+    if only_new:
+        params.append('only_new=1')
+    return ' '.join(params)
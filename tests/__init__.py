@@ -1,3 +1,13 @@
 from .test_wpas import *
 from .test_models import *
 from .test_utils import *
+from .test_aio import *
+from .test_scan import *
+from .test_telemetry import *
+from .test_fake import *
+from .test_metrics import *
+from .test_roaming import *
+from .test_history import *
+from .test_cache import *
+from .test_config import *
+from .test_psk import *
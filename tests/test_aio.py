@@ -0,0 +1,111 @@
+import gc
+import os
+import asyncio
+
+from unittest import TestCase
+
+from pywpas import AsyncControl
+from pywpas.models import Profile
+
+from .test_wpas import MockServer
+
+
+class AsyncInterfaceTestCase(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = MockServer()
+        self.control = AsyncControl(sock_path=self.server.sock_path)
+        self.client = self.control.interface(self.server.name, recv_timeout=1.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.control.close()
+        # Let the transport finish closing.
+        self.run_async(asyncio.sleep(0))
+        self.loop.close()
+        self.server.stop()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_interface_names(self):
+        self.assertEqual([self.server.name], self.control.interface_names())
+
+    def test_status(self):
+        status = self.run_async(self.client.status())
+        self.assertEqual(self.server.last_command, b'STATUS')
+        self.assertEqual(status.wpa_state, 'COMPLETED')
+
+    def test_concurrent(self):
+        async def _test():
+            return await asyncio.gather(
+                self.client.ping(), self.client.status(), self.client.scan())
+        _, status, _ = self.run_async(_test())
+        self.assertEqual(status.wpa_state, 'COMPLETED')
+
+    def test_scan_results(self):
+        networks = self.run_async(self.client.scan_results())
+        self.assertEqual(1, len(networks))
+        self.assertEqual('NachoWIFI', networks[0].ssid)
+
+    def test_connect(self):
+        self.run_async(self.client.connect(
+            Profile(ssid='foobar', key_mgmt='foobar', proto='foobar',
+                    psk='foobar')))
+        self.assertEqual(self.server.last_command, b'SELECT_NETWORK 1')
+
+    def test_list_networks(self):
+        networks = self.run_async(self.client.list_networks(details=True))
+        self.assertEqual(1, len(networks))
+        self.assertEqual('foobar', networks[0].ciphers)
+
+    def test_timeout(self):
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.run_async(self.client.save_config())
+
+    def test_lost_reply(self):
+        # wpa_supplicant dropped this reply, it will never come.
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.run_async(self.client.save_config())
+        # Later replies still reach the right request.
+        self.run_async(self.client.ping())
+        status = self.run_async(self.client.status())
+        self.assertEqual(status.wpa_state, 'COMPLETED')
+
+    def test_late_reply(self):
+        self.client._recv_timeout = 0.05
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.run_async(self.client.save_config())
+        protocol = self.client._protocol
+        # The late reply arrives before the next request.
+        protocol.datagram_received(b'OK', None)
+        self.run_async(self.client.ping())
+        self.assertIs(protocol, self.client._protocol)
+
+    def test_error_received(self):
+        async def _test():
+            await self.client._ensure_connection()
+            protocol = self.client._protocol
+            self.server.replies[b'SAVE_CONFIG'] = None
+            pending = [protocol.request(b'SAVE_CONFIG'),
+                       protocol.request(b'PING')]
+            # Which send failed is unknown, none can be matched anymore.
+            protocol.error_received(OSError('Send failed'))
+            for waiter in pending:
+                with self.assertRaises(OSError):
+                    await waiter
+            await self.client.ping()
+            self.assertIsNot(protocol, self.client._protocol)
+        self.run_async(_test())
+
+    def test_del(self):
+        client = self.control.interface(self.server.name)
+        self.run_async(client.ping())
+        client_path = client._client_path
+        self.assertTrue(os.path.exists(client_path))
+        del client
+        gc.collect()
+        self.assertFalse(os.path.exists(client_path))
@@ -0,0 +1,124 @@
+import time
+
+from unittest import TestCase
+
+from pywpas import Control, Profile
+from pywpas.cache import ReplyCache
+from pywpas.models import Event
+
+from .test_wpas import MockServer
+
+
+class ReplyCacheTestCase(TestCase):
+    def test_ttl(self):
+        cache = ReplyCache({'STATUS': 0.05})
+        cache.record(b'STATUS', b'wpa_state=COMPLETED', cache.generation)
+        cache.record(b'PING', b'PONG', cache.generation)
+        self.assertEqual(b'wpa_state=COMPLETED', cache.get('STATUS'))
+        self.assertIsNone(cache.get(b'PING'))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(b'STATUS'))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_failures(self):
+        cache = ReplyCache()
+        cache.record(b'GET_NETWORK 0 psk', b'FAIL', cache.generation)
+        cache.record(b'STATUS', None, cache.generation)
+        self.assertEqual(0, len(cache))
+
+    def test_commands(self):
+        cache = ReplyCache()
+        for cmd in (b'STATUS', b'LIST_NETWORKS', b'GET_NETWORK 0 ssid'):
+            cache.record(cmd, b'x', cache.generation)
+        cache.record(b'SCAN_RESULTS', b'', cache.generation)
+        self.assertEqual(3, len(cache))
+        cache.record(b'DISCONNECT', b'OK', cache.generation)
+        self.assertIsNone(cache.get(b'STATUS'))
+        self.assertEqual(2, len(cache))
+        cache.record(b'SET_NETWORK 0 ssid "x"', b'OK', cache.generation)
+        self.assertEqual(0, len(cache))
+
+    def test_in_flight(self):
+        cache = ReplyCache()
+        generation = cache.generation
+        cache.on_event(Event.deserialize(b'<3>CTRL-EVENT-DISCONNECTED '))
+        # This reply may predate the disconnection.
+        cache.record(b'STATUS', b'wpa_state=COMPLETED', generation)
+        self.assertIsNone(cache.get(b'STATUS'))
+
+    def test_events(self):
+        cache = ReplyCache()
+        cache.record(b'STATUS', b'x', cache.generation)
+        cache.record(b'LIST_NETWORKS', b'x', cache.generation)
+        cache.on_event(Event.deserialize(b'<3>CTRL-EVENT-SCAN-STARTED '))
+        self.assertEqual(2, len(cache))
+        cache.on_event(Event.deserialize(
+            b'<3>CTRL-EVENT-CONNECTED - Connection to 08:02:8e:9c:9d:15 '
+            b'completed [id=0 id_str=]'))
+        self.assertEqual(1, len(cache))
+        cache.on_event(Event.deserialize(b'<2>CTRL-EVENT-TERMINATING '))
+        self.assertEqual(0, len(cache))
+
+
+class InterfaceCacheTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.control = Control(sock_path=self.server.sock_path)
+        self.client = self.control.interface(self.server.name)
+        self.client.cache = ReplyCache()
+
+    def tearDown(self):
+        self.client.close()
+        self.control.close()
+        self.server.stop()
+
+    def count(self, command):
+        return self.server._commands.count(command)
+
+    def test_read_through(self):
+        for _ in range(3):
+            self.assertEqual('COMPLETED', self.client.status().wpa_state)
+            self.client.list_networks(details=True)
+        self.assertEqual(1, self.count(b'STATUS'))
+        self.assertEqual(1, self.count(b'LIST_NETWORKS'))
+        self.assertEqual(1, self.count(b'GET_NETWORK 1 key_mgmt'))
+
+    def test_mutations(self):
+        self.client.status()
+        self.client.list_networks()
+        self.client.add_network(Profile(ssid='foo', psk='bar12345'))
+        self.client.list_networks()
+        self.assertEqual(2, self.count(b'LIST_NETWORKS'))
+        self.client.disconnect()
+        self.client.status()
+        self.assertEqual(2, self.count(b'STATUS'))
+
+    def test_events(self):
+        self.client.status()
+        self.server.emit(b'<3>CTRL-EVENT-DISCONNECTED bssid=08:02:8e:9c:9d:15 '
+                         b'reason=3 locally_generated=1')
+        for _ in range(20):
+            if self.client.cache.get(b'STATUS') is None:
+                break
+            time.sleep(0.05)
+        self.client.status()
+        self.assertEqual(2, self.count(b'STATUS'))
+
+    def test_disable(self):
+        self.client.cache = None
+        self.client.status()
+        self.client.status()
+        self.assertEqual(2, self.count(b'STATUS'))
+
+    def test_close(self):
+        # Another interface sharing the pool, and so the cache.
+        other = self.control.interface(self.server.name, recv_timeout=1.0)
+        self.assertIs(self.client.cache, other.cache)
+        other.status()
+        self.client.close()
+        # Nothing invalidates the cache anymore, it is no longer used.
+        self.assertIsNone(other.cache)
+        other.status()
+        other.status()
+        self.assertEqual(3, self.count(b'STATUS'))
+        other.close()
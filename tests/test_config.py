@@ -0,0 +1,109 @@
+import io
+import os
+import time
+import tempfile
+
+from unittest import TestCase
+
+from pywpas import Control, Profile, CommandFailedError
+from pywpas.config import iter_config, format_network, write_config
+
+from benchmarks.fake import FakeSupplicant
+
+
+CONFIG = '''ctrl_interface=/var/run/wpa_supplicant
+update_config=1
+
+# Home
+network={
+\tssid="Home # 1"
+\tpsk="correct horse"
+\tkey_mgmt=WPA-PSK
+\tpairwise=CCMP
+\tpriority=5
+}
+
+network={
+    ssid=436166c3a9
+    bssid=02:00:00:00:00:01
+    psk=%s
+    key_mgmt=WPA-EAP
+    eap=PEAP
+    identity="bob"
+}
+''' % ('ab' * 32)
+
+
+class ConfigTestCase(TestCase):
+    def test_parse(self):
+        home, cafe = iter_config(io.StringIO(CONFIG))
+        self.assertEqual('Home # 1', home.ssid)
+        self.assertEqual('correct horse', home.psk)
+        self.assertEqual('CCMP', home.ciphers)
+        self.assertEqual({'priority': '5'}, home.extra)
+        self.assertEqual('Café', cafe.ssid)
+        self.assertEqual('ab' * 32, cafe.psk)
+        self.assertEqual('02:00:00:00:00:01', cafe.bssid)
+        self.assertEqual({'eap': 'PEAP', 'identity': '"bob"'}, cafe.extra)
+
+    def test_round_trip(self):
+        profiles = list(iter_config(io.StringIO(CONFIG)))
+        f = io.StringIO()
+        self.assertEqual(2, write_config(profiles, f))
+        self.assertEqual(profiles, list(iter_config(io.StringIO(f.getvalue()))))
+        self.assertEqual(
+            'network={\n\tssid="Home # 1"\n\tkey_mgmt=WPA-PSK\n'
+            '\tpairwise=CCMP\n\tpsk="correct horse"\n\tpriority=5\n}\n',
+            format_network(profiles[0]))
+
+    def test_invalid(self):
+        for config in ('network={\nssid="x"\n',
+                       'network={\nssid\n}',
+                       'network={\nssid=nothex\n}',
+                       'network={\npsk=short\n}'):
+            with self.assertRaises(ValueError):
+                list(iter_config(io.StringIO(config)))
+
+
+class InterfaceConfigTestCase(TestCase):
+    def setUp(self):
+        self.fake = FakeSupplicant()
+        self.control = Control(sock_path=self.fake.sock_path)
+        self.client = self.control.interface('wlan0')
+
+    def tearDown(self):
+        self.control.close()
+        self.fake.stop()
+
+    def test_import_export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'wpa_supplicant.conf')
+        self.assertEqual(2, self.client.import_networks(io.StringIO(CONFIG)))
+        self.assertIn(b'SAVE_CONFIG', [c for _, c in self.fake.commands])
+        self.assertEqual(2, self.client.export_networks(path))
+        with open(path, encoding='utf-8') as f:
+            exported = list(iter_config(f))
+        self.assertEqual(['Home # 1', 'Café'], [p.ssid for p in exported])
+        self.assertEqual('correct horse', exported[0].psk)
+        self.assertEqual('PEAP', exported[1].extra['eap'])
+        self.assertEqual('"bob"', exported[1].extra['identity'])
+
+    def test_import_bulk(self):
+        config = ''.join(format_network(Profile(
+            ssid=f'Network{i}', key_mgmt='WPA-PSK', psk=f'password{i}',
+            extra={'priority': str(i % 10)})) for i in range(1000))
+        started = time.monotonic()
+        self.assertEqual(
+            1000, self.client.import_networks(io.StringIO(config), save=False))
+        self.assertLess(time.monotonic() - started, 10.0)
+        self.assertEqual(1000, len(self.client.list_networks()))
+
+    def test_import_failure(self):
+        self.fake.replies[b'SET_NETWORK 2 priority 2'] = b'FAIL'
+        config = ''.join(format_network(Profile(
+            ssid=f'Network{i}', extra={'priority': str(i)}))
+            for i in range(4))
+        with self.assertRaises(CommandFailedError):
+            self.client.import_networks(io.StringIO(config), batch=2)
+        # The first batch stays, the failed one is removed.
+        self.assertEqual(['Network0', 'Network1'],
+                         [p.ssid for p in self.client.list_networks()])
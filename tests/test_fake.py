@@ -0,0 +1,77 @@
+import time
+
+from unittest import TestCase
+
+from pywpas import Control
+from pywpas.channel import Channel
+from pywpas.models import Profile
+
+from benchmarks.fake import FakeSupplicant
+
+
+class FakeSupplicantTestCase(TestCase):
+    def setUp(self):
+        self.fake = FakeSupplicant(interfaces=3, bss_count=300, ssid_count=50)
+        self.control = Control(sock_path=self.fake.sock_path)
+
+    def tearDown(self):
+        self.control.close()
+        self.fake.stop()
+
+    def test_interfaces(self):
+        results = self.control.map('ping')
+        self.assertEqual(sorted(self.fake.names), sorted(results))
+        self.assertEqual([None] * 3, list(results.values()))
+
+    def test_scan_results(self):
+        client = self.control.interface('wlan0')
+        client.scan_results()
+        self.assertEqual(300, len(client.scan_index))
+        self.assertEqual(50, len(client.scan_index.ssids()))
+
+    def test_iter_bss(self):
+        client = self.control.interface('wlan1')
+        entries = list(client.iter_bss())
+        self.assertEqual(list(range(300)), [bss.id for bss in entries])
+        # The table doesn't fit one reply.
+        ranges = [cmd for name, cmd in self.fake.commands
+                  if cmd.startswith(b'BSS RANGE=')]
+        self.assertGreater(len(ranges), 1)
+
+    def test_networks(self):
+        client = self.control.interface('wlan2')
+        profile = Profile(ssid='Network1', key_mgmt='WPA-PSK', psk='password')
+        result = client.connect(profile, wait=True, timeout=5.0)
+        self.assertTrue(result.success)
+        status = client.status()
+        self.assertEqual('COMPLETED', status.wpa_state)
+        self.assertEqual('Network1', status.ssid)
+        networks = client.list_networks(details=True)
+        self.assertEqual(['Network1'], [p.ssid for p in networks])
+        self.assertEqual('WPA-PSK', networks[0].key_mgmt)
+
+
+class FakeSupplicantFaultTestCase(TestCase):
+    def test_latency(self):
+        with FakeSupplicant(latency=0.05) as fake:
+            channel = Channel(f'{fake.sock_path}/wlan0', recv_timeout=1.0)
+            try:
+                started = time.monotonic()
+                replies = channel.pipeline([b'PING'] * 5)
+                # Replies are delayed, not serialized.
+                self.assertLess(time.monotonic() - started, 0.2)
+                self.assertEqual([b'PONG'] * 5, replies)
+            finally:
+                channel.close()
+
+    def test_loss(self):
+        with FakeSupplicant(loss=1.0) as fake:
+            channel = Channel(f'{fake.sock_path}/wlan0', recv_timeout=0.1)
+            try:
+                with self.assertRaises(TimeoutError):
+                    channel.request(b'PING')
+                fake.loss = 0.0
+                # The lost reply isn't waited for.
+                self.assertEqual(b'PONG', channel.request(b'PING'))
+            finally:
+                channel.close()
@@ -0,0 +1,127 @@
+import os
+import time
+import tempfile
+
+from unittest import TestCase
+
+from pywpas import Control, Profile
+from pywpas.history import HistoryCache, serialize, deserialize
+from pywpas.models import Scanned
+
+from .test_wpas import MockServer
+
+
+NETWORKS = [
+    (Scanned('02:00:00:00:00:01', 2412, -50, '[ESS]', 'Corp'), 1000.0),
+    (Scanned('02:00:00:00:00:02', 5180, -70, '[WPA2-PSK-CCMP][ESS]', None),
+     900.0),
+]
+PROFILES = [
+    Profile(id=0, ssid='Corp', key_mgmt='WPA-PSK', proto='RSN',
+            ciphers='CCMP', psk='secret', bssid='any', flags='[CURRENT]',
+            extra={'priority': '5', 'password': '"hunter2"'}),
+]
+
+
+class HistoryTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def test_round_trip(self):
+        networks, profiles = deserialize(
+            serialize(NETWORKS, PROFILES, now=1000.0), now=1000.0)
+        self.assertEqual(NETWORKS, networks)
+        self.assertEqual(1, len(profiles))
+        self.assertEqual('Corp', profiles[0].ssid)
+        self.assertEqual('CCMP', profiles[0].ciphers)
+        self.assertEqual({'priority': '5'}, profiles[0].extra)
+        # Secrets are never written.
+        self.assertIsNone(profiles[0].psk)
+
+    def test_bad_rows(self):
+        bad = [(Scanned(bssid, 2412, -50, None, 'x'), 1000.0)
+               for bssid in (None, 'zz:00:00:00:00:01', '02:00:00:00:01')]
+        bad.append((Scanned('02:00:00:00:00:03', None, -50, None, 'x'),
+                    1000.0))
+        networks, _ = deserialize(
+            serialize(bad + NETWORKS, [], now=1000.0), now=1000.0)
+        self.assertEqual(NETWORKS, networks)
+        cache = HistoryCache(os.path.join(self.path, 'wlan0.history'))
+        self.assertFalse(cache.update(NETWORKS, [Profile(ssid='x' * 70000)]))
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_ttl(self):
+        data = serialize(NETWORKS, PROFILES, now=1000.0)
+        networks, profiles = deserialize(data, ttl=50, now=1010.0)
+        self.assertEqual([NETWORKS[0]], networks)
+        self.assertEqual(1, len(profiles))
+        networks, profiles = deserialize(data, ttl=50, now=2000.0)
+        self.assertEqual(([], []), (networks, profiles))
+
+    def test_corrupt(self):
+        data = serialize(NETWORKS, PROFILES)
+        for bad in (data[:-3], b'junk' + data[4:], b''):
+            with self.assertRaises(ValueError):
+                deserialize(bad)
+        cache = HistoryCache(os.path.join(self.path, 'wlan0.history'))
+        self.assertEqual(([], []), cache.load())
+        with open(cache.path, 'wb') as f:
+            f.write(data[:-3])
+        self.assertEqual(([], []), cache.load())
+
+    def test_update(self):
+        cache = HistoryCache(os.path.join(self.path, 'wlan0.history'),
+                             ttl=float('inf'))
+        self.assertTrue(cache.update(NETWORKS, PROFILES))
+        # Too soon, only noted.
+        self.assertFalse(cache.update(NETWORKS[:1], PROFILES))
+        self.assertTrue(cache.dirty)
+        self.assertEqual(2, len(cache.load()[0]))
+        self.assertTrue(cache.flush(NETWORKS[:1], PROFILES))
+        self.assertFalse(cache.dirty)
+        self.assertEqual(1, len(cache.load()[0]))
+        self.assertEqual([], os.listdir(self.path)[1:])
+
+
+class InterfaceHistoryTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.history_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_warm_start(self):
+        control = Control(sock_path=self.server.sock_path,
+                          history_dir=self.history_dir)
+        client = control.interface(self.server.name)
+        client.scan_results()
+        client.list_networks()
+        count = len(client.scan_index)
+        client.close()
+        control.close()
+        self.assertTrue(os.path.exists(client.history.path))
+
+        control = Control(sock_path=self.server.sock_path,
+                          history_dir=self.history_dir)
+        try:
+            client = control.interface(self.server.name)
+            self.server._commands.clear()
+            self.assertEqual(count, len(client.scan_index))
+            self.assertEqual(['foobar'], [p.ssid for p in client.profiles])
+            self.assertEqual([], self.server._commands)
+        finally:
+            control.close()
+
+    def test_warm_start_old(self):
+        # Older than the scan index's max_age, within the cache's ttl.
+        HistoryCache(os.path.join(self.history_dir,
+                                  f'{self.server.name}.history')).save(
+            [(NETWORKS[0][0], time.time() - 600)], [])
+        control = Control(sock_path=self.server.sock_path,
+                          history_dir=self.history_dir)
+        try:
+            client = control.interface(self.server.name)
+            self.assertIn(NETWORKS[0][0].bssid, client.scan_index)
+        finally:
+            control.close()
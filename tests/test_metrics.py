@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from pywpas import Control, Metrics, CommandFailedError
+from pywpas.metrics import (
+    Histogram, CommandStats, OUTCOME_OK, OUTCOME_FAIL, OUTCOME_TIMEOUT,
+)
+
+from .test_wpas import MockServer
+
+
+class HistogramTestCase(TestCase):
+    def test_observe(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual([(0.1, 2), (1.0, 3), (float('inf'), 4)],
+                         histogram.cumulative())
+        self.assertEqual(0.1, histogram.quantile(0.5))
+        self.assertEqual(4, histogram.count)
+
+
+class CommandStatsTestCase(TestCase):
+    def test_observe(self):
+        stats = CommandStats((0.1, 1.0))
+        stats.observe(0.05, 4, 2, OUTCOME_OK)
+        stats.observe(0.5, 4, 4, OUTCOME_FAIL)
+        stats.observe(2.0, 4, 0, OUTCOME_TIMEOUT)
+        self.assertEqual({
+            'count': 3, 'failures': 1, 'timeouts': 1, 'bytes_sent': 12,
+            'bytes_received': 6, 'latency_sum': 2.55, 'latency_p50': 1.0,
+            'latency_p99': float('inf'),
+        }, stats.as_dict())
+
+
+class InterfaceMetricsTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.control = Control(sock_path=self.server.sock_path)
+        self.client = self.control.interface(self.server.name,
+                                             recv_timeout=0.2)
+
+    def tearDown(self):
+        self.control.close()
+        self.server.stop()
+
+    def test_disabled(self):
+        self.assertIsNone(self.client.metrics)
+        self.client.ping()
+
+    def test_metrics(self):
+        observed = []
+        self.client.metrics = Metrics()
+        self.client.metrics.add_hook(
+            lambda *args: observed.append((args[0], args[4])))
+        self.client.ping()
+        self.client.status()
+        self.server.replies[b'DISCONNECT'] = b'FAIL'
+        with self.assertRaises(CommandFailedError):
+            self.client.disconnect()
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.client.save_config()
+        self.assertEqual(
+            [('PING', OUTCOME_OK), ('STATUS', OUTCOME_OK),
+             ('DISCONNECT', OUTCOME_FAIL), ('SAVE_CONFIG', 'timeout')],
+            observed)
+        snapshot = self.client.metrics.snapshot()
+        self.assertEqual(1, snapshot['STATUS']['count'])
+        self.assertEqual(len(b'STATUS'), snapshot['STATUS']['bytes_sent'])
+        self.assertGreater(snapshot['STATUS']['bytes_received'], 100)
+        self.assertEqual(1, snapshot['DISCONNECT']['failures'])
+        self.assertEqual(1, snapshot['SAVE_CONFIG']['timeouts'])
+        self.assertGreaterEqual(snapshot['SAVE_CONFIG']['latency_sum'], 0.2)
+
+    def test_pipeline(self):
+        self.client.metrics = Metrics()
+        self.client._pipeline([b'PING', b'ADD_NETWORK', b'PING'])
+        self.assertEqual(2, self.client.metrics.command('PING').count)
+        self.assertEqual(1, self.client.metrics.command('ADD_NETWORK').count)
@@ -1,11 +1,13 @@
 from unittest import TestCase
 
 from pywpas.models import (
-    InterfaceStatus, Scanned, Profile, deserialize_scanned,
+    InterfaceStatus, WpaState, Scanned, Profile, Event, deserialize_scanned,
+    deserialize_profiles, scan_parser, iter_bss, iter_scanned, bss_mask, BSS,
+    BSS_FIELDS, normalize_field,
 )
 
 
-INTERFACE_STATUS = b'bssibd=08:02:8e:9c:9d:15\n' \
+INTERFACE_STATUS = b'bssid=08:02:8e:9c:9d:15\n' \
                    b'freq=2452\n' \
                    b'ssid=NachoWIFI\n' \
                    b'id=0\n' \
@@ -17,7 +19,9 @@ INTERFACE_STATUS = b'bssibd=08:02:8e:9c:9d:15\n' \
                    b'ip_address=192.168.1.102\n' \
                    b'p2p_device_address=f8:59:71:93:d1:14\n' \
                    b'address=f8:59:71:93:d1:13\n' \
-                   b'uuid=2ef7f1d9-83d9-5b92-9e5b-91b60c83ecf0'
+                   b'uuid=2ef7f1d9-83d9-5b92-9e5b-91b60c83ecf0\n' \
+                   b'ieee80211ac=1\n' \
+                   b'wifi_generation=5'
 SCAN_RESULTS = b'bssid / frequency / signal level / flags / ssid\n' \
                b'08:02:8e:9c:9d:15\t2452\t-36\t[WPA2-PSK-CCMP][ESS]\tNachoWIFI\n' \
                b'f8:2c:18:66:4b:ba\t5805\t-79\t[WPA2-PSK-CCMP][WPS][ESS]\tATT6YFg7Nq\n' \
@@ -31,6 +35,29 @@ SCAN_RESULTS = b'bssid / frequency / signal level / flags / ssid\n' \
                b'62:45:b1:79:51:75\t5745\t-68\t[WEP][ESS]\t\n' \
                b'62:45:b1:be:d1:b5\t5220\t-79\t[WEP][ESS]'
 
+LIST_NETWORKS = b'network id / ssid / bssid / flags\n' \
+                b'1\tfoobar\tany\t[CURRENT]'
+
+BSS_RANGE = b'id=3\n' \
+            b'bssid=08:02:8e:9c:9d:15\n' \
+            b'freq=2452\n' \
+            b'beacon_int=100\n' \
+            b'noise=-92\n' \
+            b'level=-36\n' \
+            b'snr=56\n' \
+            b'age=2\n' \
+            b'ie=0009\n' \
+            b'flags=[WPA2-PSK-CCMP][ESS]\n' \
+            b'ssid=NachoWIFI\n' \
+            b'est_throughput=65000\n' \
+            b'====\n' \
+            b'id=7\n' \
+            b'bssid=f8:2c:18:66:4b:ba\n' \
+            b'freq=5805\n' \
+            b'level=-79\n' \
+            b'ssid=\n' \
+            b'####'
+
 
 class NetworkTestCase(TestCase):
     def test_deserialize_scanned(self):
@@ -46,7 +73,134 @@ class NetworkTestCase(TestCase):
             'psk=Super secret!',
             str(profile))
 
+    def test_deserialize_scanned_bytes(self):
+        networks = deserialize_scanned(SCAN_RESULTS)
+        self.assertEqual(11, len(networks))
+        self.assertEqual(-36, networks[0].signal_level)
+        self.assertIsNone(networks[-1].ssid)
+        self.assertEqual(networks, deserialize_scanned(SCAN_RESULTS.split(b'\n')))
+        self.assertIs(scan_parser(SCAN_RESULTS.split(b'\n')[0]),
+                      scan_parser(SCAN_RESULTS.split(b'\n')[0]))
+
+    def test_deserialize_scanned_truncated(self):
+        # A half line at the end of a cut short reply is skipped.
+        networks = deserialize_scanned(SCAN_RESULTS + b'\n00:11:22:33:44:55\t24')
+        self.assertEqual(11, len(networks))
+
+    def test_deserialize_scanned_columns(self):
+        networks = deserialize_scanned(
+            b'ssid / bssid / frequency / signal level\nfoo\t00:11:22:33:44:55\t2412\t-40')
+        self.assertEqual('foo', networks[0].ssid)
+        self.assertEqual(2412, networks[0].frequency)
+        self.assertIsNone(networks[0].flags)
+
+    def test_deserialize_scanned_empty(self):
+        header = SCAN_RESULTS.split(b'\n')[0]
+        for reply in (b'', b'FAIL', header, header + b'\n'):
+            self.assertEqual([], deserialize_scanned(reply))
+            self.assertEqual([], list(iter_scanned(reply)))
+        self.assertEqual([], deserialize_scanned(b'FAIL\nfoo\tbar'))
+        self.assertEqual([], list(iter_scanned(b'FAIL\nfoo\tbar')))
+
+    def test_iter_scanned(self):
+        self.assertEqual(deserialize_scanned(SCAN_RESULTS),
+                         list(iter_scanned(SCAN_RESULTS)))
+        networks = list(iter_scanned(SCAN_RESULTS, min_signal=-70))
+        self.assertEqual([-36, -70, -68],
+                         [n.signal_level for n in networks])
+        networks = list(iter_scanned(SCAN_RESULTS, bands=['5GHz'],
+                                     ssids=['ATT6YFg7Nq', None]))
+        self.assertEqual(['ATT6YFg7Nq', None, None, None],
+                         [n.ssid for n in networks])
+        self.assertEqual([], list(iter_scanned(b'')))
+
+    def test_iter_bss(self):
+        entries = list(iter_bss(BSS_RANGE))
+        self.assertEqual(2, len(entries))
+        self.assertEqual(3, entries[0].id)
+        self.assertEqual(-92, entries[0].noise)
+        self.assertEqual(b'\x00\x09', entries[0].ie)
+        self.assertEqual(65000, entries[0].est_throughput)
+        self.assertIsNone(entries[1].ssid)
+        self.assertIsNone(entries[1].snr)
+        self.assertEqual(0x87, bss_mask(['id', 'bssid', 'freq', 'level']))
+
+    def test_bss_fields(self):
+        # Every field can be set, and is None unless given.
+        bss = BSS(**{name: name for name in BSS_FIELDS})
+        self.assertEqual(list(BSS_FIELDS),
+                         [getattr(bss, name) for name in BSS_FIELDS])
+        self.assertEqual([None] * len(BSS_FIELDS),
+                         [getattr(BSS(), name) for name in BSS_FIELDS])
+
+    def test_deserialize_profiles(self):
+        profiles = deserialize_profiles(
+            (LIST_NETWORKS + b'\n2\tNachoWIFI\t08:02:8e:9c:9d:15\t').split(b'\n'))
+        self.assertEqual(2, len(profiles))
+        self.assertEqual('[CURRENT]', profiles[0].flags)
+        self.assertEqual(2, profiles[1].id)
+        self.assertEqual('08:02:8e:9c:9d:15', profiles[1].bssid)
+
+    def test_serialize_profile(self):
+        profile = Profile(ssid='foo bar', key_mgmt='WPA-PSK', psk='password')
+        self.assertEqual({
+            'ssid': '"foo bar"',
+            'key_mgmt': 'WPA-PSK',
+            'psk': '"password"',
+        }, profile.serialize())
+        # A 64 hex digit psk is a raw key, not a passphrase.
+        profile.psk = 'a' * 64
+        self.assertEqual('a' * 64, profile.serialize()['psk'])
+
+    def test_normalize_field(self):
+        self.assertEqual(normalize_field('proto', 'RSN WPA'),
+                         normalize_field('proto', 'WPA WPA2'))
+        self.assertEqual('CCMP TKIP', normalize_field('pairwise', 'TKIP CCMP'))
+        self.assertEqual('08:02:8e:9c:9d:15',
+                         normalize_field('bssid', '08:02:8E:9C:9D:15'))
+        self.assertEqual('"Foo"', normalize_field('id_str', '"Foo"'))
+        self.assertIsNone(normalize_field('proto', None))
+
     def test_deserialize_interfacestatus(self):
         status = InterfaceStatus.deserialize(INTERFACE_STATUS.split(b'\n'))
         self.assertEqual('station', status.mode)
         self.assertEqual('wpa_state=COMPLETED', str(status))
+        self.assertEqual('08:02:8e:9c:9d:15', status.bssid)
+        self.assertEqual(2452, status.frequency)
+        self.assertEqual(0, status.id)
+        self.assertIs(WpaState.COMPLETED, status.wpa_state)
+        self.assertEqual('COMPLETED', status.wpa_state)
+        self.assertEqual(5, status.wifi_generation)
+        self.assertEqual(status, InterfaceStatus.deserialize(INTERFACE_STATUS))
+
+    def test_interfacestatus_lenient(self):
+        status = InterfaceStatus.deserialize(
+            b'ssid=a=b\nwpa_state=SOMETHING_NEW\nvendor_thing=x\ngarbage')
+        self.assertEqual('a=b', status.ssid)
+        self.assertEqual('SOMETHING_NEW', status.wpa_state)
+        self.assertEqual('x', status.vendor_thing)
+        self.assertEqual('x', status.get('vendor_thing'))
+        self.assertIsNone(status.ip_address)
+        self.assertIsNone(status.frequency)
+        with self.assertRaises(AttributeError):
+            status.foobar
+        self.assertEqual(['ssid', 'wpa_state', 'vendor_thing'], status.keys())
+        self.assertEqual(b'a=b', status.raw[b'ssid'])
+
+
+class EventTestCase(TestCase):
+    def test_deserialize_event(self):
+        event = Event.deserialize(
+            b'<3>CTRL-EVENT-DISCONNECTED bssid=08:02:8e:9c:9d:15 reason=3 '
+            b'locally_generated=1')
+        self.assertEqual(3, event.level)
+        self.assertEqual('CTRL-EVENT-DISCONNECTED', event.name)
+        self.assertEqual('08:02:8e:9c:9d:15', event.bssid)
+        self.assertEqual('3', event.params['reason'])
+
+    def test_deserialize_event_quoted(self):
+        event = Event.deserialize(
+            b'<3>CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="Nacho WIFI" '
+            b'auth_failures=1 duration=10 reason=WRONG_KEY')
+        self.assertEqual('Nacho WIFI', event.params['ssid'])
+        self.assertIsNone(event.bssid)
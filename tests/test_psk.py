@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+from pywpas import Control, Profile
+from pywpas.psk import derive_psk, derive_psks, shutdown_pool
+
+from benchmarks.fake import FakeSupplicant
+
+
+# Test vectors of IEEE 802.11i, annex H.4.
+VECTORS = [
+    ('IEEE', 'password',
+     'f42c6fc52df0ebef9ebb4b90b38a5f902e83fe1b135a70e23aed762e9710a12e'),
+    ('ThisIsASSID', 'ThisIsAPassword',
+     '0dc0d6eb90555ed6419756b9a15ec3e3209b63df707dd508d14581f8982721af'),
+]
+
+
+class PskTestCase(TestCase):
+    def test_derive(self):
+        for ssid, passphrase, psk in VECTORS:
+            self.assertEqual(psk, derive_psk(ssid, passphrase))
+            # Cached this time.
+            self.assertEqual(psk, derive_psk(ssid, passphrase))
+        self.assertEqual('ab' * 32, derive_psk('IEEE', 'ab' * 32))
+
+    def test_invalid(self):
+        for ssid, passphrase in (('IEEE', 'short'), ('IEEE', 'x' * 64),
+                                 ('', 'password'), ('x' * 33, 'password')):
+            with self.assertRaises(ValueError):
+                derive_psk(ssid, passphrase)
+
+    def test_pool(self):
+        pairs = [(f'Network{i}', f'password{i}') for i in range(8)]
+        pairs += [VECTORS[0][:2]] * 2
+        try:
+            psks = derive_psks(pairs, workers=2)
+        finally:
+            shutdown_pool()
+        self.assertEqual(
+            [derive_psk(ssid, passphrase) for ssid, passphrase in pairs],
+            psks)
+        self.assertEqual(VECTORS[0][2], psks[-1])
+
+
+class InterfacePskTestCase(TestCase):
+    def setUp(self):
+        self.fake = FakeSupplicant()
+        self.control = Control(sock_path=self.fake.sock_path)
+
+    def tearDown(self):
+        self.control.close()
+        self.fake.stop()
+
+    def sent_psks(self):
+        return [cmd.rsplit(b' ', 1)[1] for _, cmd in self.fake.commands
+                if cmd.startswith(b'SET_NETWORK') and b' psk ' in cmd]
+
+    def test_add_network(self):
+        client = self.control.interface('wlan0', derive_psk=True)
+        ssid, passphrase, psk = VECTORS[0]
+        client.add_network(Profile(ssid=ssid, psk=passphrase))
+        self.assertEqual([psk.encode()], self.sent_psks())
+        # Passphrase kept, so syncing the same profile changes nothing.
+        result = client.sync_profiles([Profile(ssid=ssid, psk=passphrase)])
+        self.assertFalse(result)
+
+    def test_invalid_passphrase(self):
+        client = self.control.interface('wlan0', derive_psk=True)
+        profile = Profile(ssid='home', psk='short')
+        with self.assertRaises(ValueError):
+            client.add_network(profile)
+        self.assertIsNone(profile.id)
+        self.assertEqual({}, self.fake.interfaces['wlan0'].networks)
+        with self.assertRaises(ValueError):
+            client.sync_profiles([Profile(ssid='new', psk='password'),
+                                  profile])
+        self.assertEqual({}, self.fake.interfaces['wlan0'].networks)
+        self.assertFalse([cmd for _, cmd in self.fake.commands
+                          if cmd.startswith(b'ADD_NETWORK')])
+
+    def test_disabled(self):
+        client = self.control.interface('wlan0')
+        client.add_network(Profile(ssid='IEEE', psk='password'))
+        self.assertEqual([b'"password"'], self.sent_psks())
@@ -0,0 +1,105 @@
+import time
+import threading
+
+from unittest import TestCase
+
+from pywpas import Control
+from pywpas.roaming import Roamer, RoamPolicy
+from pywpas.telemetry import SignalHistory
+
+from .test_wpas import MockServer
+
+
+STATUS = b'bssid=02:00:00:00:00:01\nfreq=2412\nssid=Corp\nid=0\n' \
+         b'wpa_state=COMPLETED'
+SCAN_RESULTS = b'bssid / frequency / signal level / flags / ssid\n' \
+               b'02:00:00:00:00:01\t2412\t-75\t[ESS]\tCorp\n' \
+               b'02:00:00:00:00:02\t5180\t%i\t[ESS]\tCorp\n' \
+               b'02:00:00:00:00:03\t2437\t-40\t[ESS]\tOther\n' \
+               b'02:00:00:00:00:04\t2462\t-85\t[ESS]\tCorp'
+CONNECTED = b'<3>CTRL-EVENT-CONNECTED - Connection to 02:00:00:00:00:02 ' \
+            b'completed [id=0 id_str=]'
+
+
+class RoamerTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.server.replies[b'STATUS'] = STATUS
+        self.control = Control(sock_path=self.server.sock_path)
+        self.client = self.control.interface(self.server.name)
+
+    def tearDown(self):
+        self.control.close()
+        self.server.stop()
+
+    def wait_for(self, command):
+        for _ in range(20):
+            if command in self.server._commands:
+                return
+            time.sleep(0.05)
+        self.fail(f'{command} not received')
+
+    def roamer(self, level, **kwargs):
+        self.server.replies[b'SCAN_RESULTS'] = SCAN_RESULTS % level
+        roamer = Roamer(self.client, **kwargs)
+        roamer.refresh()
+        return roamer
+
+    def test_roam(self):
+        roamer = self.roamer(-60)
+        network = roamer.check(now=1000.0)
+        self.assertEqual('02:00:00:00:00:02', network.bssid)
+        self.assertIn(b'ROAM 02:00:00:00:00:02', self.server._commands)
+        self.assertEqual('02:00:00:00:00:02', roamer.current)
+        # Not again so soon, nor back.
+        self.assertIsNone(roamer.check(now=1001.0))
+
+    def test_hysteresis(self):
+        # 5GHz bonus of 3dB isn't enough to beat 8dB of hysteresis.
+        roamer = self.roamer(-72)
+        self.assertIsNone(roamer.check())
+        roamer.policy = RoamPolicy(hysteresis=2)
+        self.assertIsNotNone(roamer.decide())
+
+    def test_trigger(self):
+        history = SignalHistory(10)
+        history.record(0.0, b'RSSI=-50', b'TXGOOD=1\nTXBAD=0\nRXGOOD=1')
+        roamer = self.roamer(-40, history=history)
+        # Telemetry says the current signal is fine.
+        self.assertIsNone(roamer.check())
+
+    def test_roam_fallback(self):
+        self.server.replies[b'ROAM 02:00:00:00:00:02'] = b'FAIL'
+        roamer = self.roamer(-60)
+        roamer.check()
+        self.assertIn(b'BSSID 0 02:00:00:00:00:02', self.server._commands)
+        self.assertIn(b'REASSOCIATE', self.server._commands)
+        # The pin is lifted once connected.
+        roamer.start()
+        self.addCleanup(roamer.stop)
+        self.server.emit(CONNECTED)
+        self.wait_for(b'BSSID 0 00:00:00:00:00:00')
+        roamer.stop()
+        self.assertEqual(1, self.server._commands.count(
+            b'BSSID 0 00:00:00:00:00:00'))
+
+    def test_stop_unpins(self):
+        self.server.replies[b'ROAM 02:00:00:00:00:02'] = b'FAIL'
+        roamer = self.roamer(-60)
+        roamer.start()
+        roamer.check()
+        roamer.stop()
+        self.assertIn(b'BSSID 0 00:00:00:00:00:00', self.server._commands)
+
+    def test_events_off_monitor_thread(self):
+        roamer = self.roamer(-60)
+        threads = []
+        roamer.check = lambda: threads.append(threading.current_thread())
+        roamer.start()
+        self.addCleanup(roamer.stop)
+        self.server.emit(b'<3>CTRL-EVENT-SCAN-RESULTS ')
+        for _ in range(20):
+            if threads:
+                break
+            time.sleep(0.05)
+        self.assertEqual([roamer._t], threads)
@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from pywpas.scan import ScanIndex
+from pywpas.models import Scanned, deserialize_scanned
+from pywpas.utils import BAND_2GHZ, BAND_5GHZ
+
+from .test_models import SCAN_RESULTS
+
+
+def bss(bssid, ssid, signal_level=-50, frequency=2412):
+    return Scanned(bssid=bssid, frequency=frequency,
+                   signal_level=signal_level, flags='[ESS]', ssid=ssid)
+
+
+class ScanIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = ScanIndex()
+
+    def test_merge(self):
+        networks = deserialize_scanned(SCAN_RESULTS.split(b'\n'))
+        changed = self.index.merge(networks)
+        # One BSSID appears twice, the later row wins.
+        self.assertEqual(10, len(self.index))
+        self.assertEqual(11, len(changed))
+        self.assertEqual(1, len(self.index.by_ssid('ATT6YFg7Nq')))
+        self.assertEqual(4, len(self.index.by_ssid(None)))
+        self.assertEqual(6, len(self.index.by_band(BAND_2GHZ)))
+        self.assertEqual(4, len(self.index.by_band(BAND_5GHZ)))
+        # Nothing changed, nothing reported.
+        self.assertEqual([], self.index.merge(networks[2:]))
+        self.assertEqual(10, len(self.index))
+
+    def test_best(self):
+        self.index.merge([bss('00:00:00:00:00:01', 'foo', -70),
+                          bss('00:00:00:00:00:02', 'foo', -40)])
+        self.assertEqual('00:00:00:00:00:02', self.index.best('foo').bssid)
+        # Best weakens, the other takes over.
+        self.index.merge([bss('00:00:00:00:00:01', 'foo', -70),
+                          bss('00:00:00:00:00:02', 'foo', -80)])
+        self.assertEqual('00:00:00:00:00:01', self.index.best('foo').bssid)
+        self.assertIsNone(self.index.best('bar'))
+
+    def test_evict_count(self):
+        self.index.merge([bss('00:00:00:00:00:01', 'foo')])
+        self.index.merge([bss('00:00:00:00:00:02', 'bar')])
+        self.assertIn('00:00:00:00:00:01', self.index)
+        self.index.merge([bss('00:00:00:00:00:02', 'bar')])
+        self.assertNotIn('00:00:00:00:00:01', self.index)
+        self.assertEqual([], self.index.by_ssid('foo'))
+        self.assertIsNone(self.index.best('foo'))
+
+    def test_evict_age(self):
+        self.index.max_count = None
+        self.index.merge([bss('00:00:00:00:00:01', 'foo')], now=0.0)
+        self.index.merge([bss('00:00:00:00:00:02', 'bar')], now=100.0)
+        self.assertEqual(2, len(self.index))
+        expired = self.index.evict(now=200.0)
+        self.assertEqual(['00:00:00:00:00:01'], [n.bssid for n in expired])
+        self.assertEqual(100.0, self.index.last_seen('00:00:00:00:00:02'))
+
+    def test_restore(self):
+        self.index.max_count = None
+        self.index.restore([(bss('00:00:00:00:00:01', 'foo'), 0.0),
+                            (bss('00:00:00:00:00:02', 'bar'), 0.0)],
+                           now=600.0, max_age=3600.0)
+        # Kept past the index's own max_age, until merged again.
+        self.assertEqual(2, len(self.index))
+        self.index.merge([bss('00:00:00:00:00:02', 'bar')], now=700.0)
+        expired = self.index.evict(now=1000.0)
+        self.assertEqual(['00:00:00:00:00:02'], [n.bssid for n in expired])
+        expired = self.index.evict(now=3601.0)
+        self.assertEqual(['00:00:00:00:00:01'], [n.bssid for n in expired])
@@ -0,0 +1,106 @@
+import time
+
+from unittest import TestCase
+
+from pywpas import Control
+from pywpas.telemetry import RingBuffer, SignalHistory, SignalSampler
+
+from .test_wpas import MockServer
+
+
+SIGNAL_POLL = b'RSSI=-45\nLINKSPEED=300\nNOISE=9999\nFREQUENCY=5180\n' \
+              b'WIDTH=80 MHz\nCENTER_FRQ1=5210'
+PKTCNT_POLL = b'TXGOOD=%i\nTXBAD=%i\nRXGOOD=%i'
+
+
+class RingBufferTestCase(TestCase):
+    def test_append(self):
+        ring = RingBuffer(3)
+        self.assertIsNone(ring.mean())
+        for value in (1, 2, 3, 4):
+            ring.append(value)
+        self.assertEqual([2, 3, 4], list(ring))
+        self.assertEqual(3, ring.mean())
+        self.assertEqual(2, ring.min())
+        self.assertEqual(4, ring.max())
+        self.assertEqual(4, ring[-1])
+        with self.assertRaises(IndexError):
+            ring[3]
+
+
+class SignalHistoryTestCase(TestCase):
+    def test_record(self):
+        history = SignalHistory(10)
+        history.record(0.0, SIGNAL_POLL, PKTCNT_POLL % (100, 0, 50))
+        history.record(1.0, SIGNAL_POLL.replace(b'-45', b'-55'),
+                       PKTCNT_POLL % (190, 10, 150))
+        summary = history.summary()
+        self.assertEqual(2, summary['samples'])
+        self.assertEqual(-50, summary['rssi_mean'])
+        self.assertEqual(-55, summary['rssi_min'])
+        self.assertEqual(0.1, summary['tx_error_rate'])
+        self.assertEqual(100, summary['rx_rate'])
+
+    def test_record_missing(self):
+        history = SignalHistory(10)
+        history.record(0.0, b'RSSI=-45', PKTCNT_POLL % (1, 0, 1))
+        self.assertEqual(1, len(history.linkspeed))
+
+    def test_record_malformed(self):
+        history = SignalHistory(10)
+        history.record(0.0, SIGNAL_POLL, PKTCNT_POLL % (1, 0, 1))
+        with self.assertRaises(ValueError):
+            history.record(1.0, SIGNAL_POLL, b'TXGOOD=2\nTXBAD=x')
+        # Nothing of the malformed sample was kept.
+        self.assertEqual(
+            {1}, {len(getattr(history, n)) for n in history.__slots__})
+
+
+class SignalSamplerTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.server.replies[b'SIGNAL_POLL'] = SIGNAL_POLL
+        self.server.replies[b'PKTCNT_POLL'] = PKTCNT_POLL % (1, 0, 1)
+        self.control = Control(sock_path=self.server.sock_path)
+
+    def tearDown(self):
+        self.control.close()
+        self.server.stop()
+
+    def test_sampler(self):
+        sampler = SignalSampler(self.control.interfaces, rate=50.0)
+        sampler.start()
+        time.sleep(0.3)
+        # Polling threads are reused from round to round.
+        self.assertEqual(1, len(sampler._executor._threads))
+        sampler.stop()
+        self.assertIsNone(sampler._executor)
+        history = sampler.history(self.server.name)
+        self.assertGreater(len(history), 2)
+        self.assertEqual(-45, history.rssi.mean())
+
+    def test_sampler_fail(self):
+        self.server.replies[b'SIGNAL_POLL'] = b'FAIL'
+        sampler = SignalSampler(self.control.interfaces)
+        sampler.sample()
+        self.assertEqual(0, len(sampler.history(self.server.name)))
+
+    def test_sampler_malformed(self):
+        self.server.replies[b'PKTCNT_POLL'] = b'TXGOOD=1\nTXBAD=x'
+        sampler = SignalSampler(self.control.interfaces)
+        sampler.sample()
+        self.assertEqual(0, len(sampler.history(self.server.name)))
+
+    def test_sampler_hung(self):
+        # An interface that never answers does not hold up the others.
+        hung = MockServer(sock_path=self.server.sock_path)
+        self.addCleanup(hung.stop)
+        hung.replies[b'SIGNAL_POLL'] = None
+        hung.replies[b'PKTCNT_POLL'] = None
+        sampler = SignalSampler(self.control.interfaces, rate=10.0)
+        started = time.monotonic()
+        sampler.sample()
+        sampler.sample()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(2, len(sampler.history(self.server.name)))
+        self.assertEqual(0, len(sampler.history(hung.name)))
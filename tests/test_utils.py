@@ -1,6 +1,15 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
 from unittest import TestCase
 
-from pywpas.utils import safe_decode
+from pywpas.utils import (
+    safe_decode, scan_command, sweep_sockets, client_prefix, Backoff,
+    RecvBuffer,
+)
 
 
 class DecodeTestCase(TestCase):
@@ -9,3 +18,74 @@ class DecodeTestCase(TestCase):
 
     def test_decode_bytes(self):
         self.assertEqual('foobar', safe_decode(b'foobar'))
+
+
+class ScanCommandTestCase(TestCase):
+    def test_scan_command(self):
+        self.assertEqual('SCAN', scan_command())
+        self.assertEqual(
+            'SCAN freq=2412,5180 ssid 666f6f passive=1 only_new=1',
+            scan_command([5180, 2412, 5180], ['foo'], passive=True,
+                         only_new=True))
+
+
+class SweepTestCase(TestCase):
+    def bind(self, path, name, keep=False):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(os.path.join(path, name))
+        if keep:
+            self.addCleanup(sock.close)
+        else:
+            sock.close()
+
+    def test_sweep(self):
+        path = tempfile.mkdtemp()
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        self.bind(path, f'pywpas-{dead.pid}-abc')
+        self.bind(path, client_prefix() + 'abc')
+        self.bind(path, 'pywpasorphan')
+        self.bind(path, 'pywpaslive', keep=True)
+        self.bind(path, 'wlan0')
+        # A process of another PID namespace looks dead, its socket is bound.
+        self.bind(path, f'pywpas-{dead.pid}-def', keep=True)
+        self.assertEqual(sorted([f'pywpas-{dead.pid}-abc', 'pywpasorphan']),
+                         sorted(sweep_sockets(path)))
+        self.assertEqual(
+            sorted([client_prefix() + 'abc', 'pywpaslive', 'wlan0',
+                    f'pywpas-{dead.pid}-def']),
+            sorted(os.listdir(path)))
+
+
+class BackoffTestCase(TestCase):
+    def test_backoff(self):
+        backoff = Backoff(1.0, 4.0)
+        self.assertEqual(0, backoff.remaining(0.0))
+        self.assertEqual([1.0, 2.0, 4.0, 4.0],
+                         [backoff.failed(0.0) for _ in range(4)])
+        self.assertEqual(3.0, backoff.remaining(1.0))
+        backoff.reset()
+        self.assertEqual(0, backoff.remaining(1.0))
+
+
+class RecvBufferTestCase(TestCase):
+    def setUp(self):
+        self.left, self.right = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.left.close()
+        self.right.close()
+
+    def test_recv(self):
+        buffer = RecvBuffer(16)
+        self.left.send(b'OK')
+        self.assertEqual(b'OK', buffer.recv(self.right))
+        self.assertEqual(16, len(buffer))
+
+    def test_recv_large(self):
+        buffer = RecvBuffer(16)
+        self.left.send(b'x' * 10000)
+        self.left.send(b'OK')
+        self.assertEqual(b'x' * 10000, buffer.recv(self.right))
+        self.assertEqual(b'OK', buffer.recv(self.right))
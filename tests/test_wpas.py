@@ -8,11 +8,15 @@ import time
 from os.path import basename
 from unittest import TestCase, mock
 
-from pywpas import Control
+from pywpas import Control, CommandFailedError
+from pywpas.channel import Channel
+from pywpas.discovery import SocketWatcher
 from pywpas.utils import tempnam
 from pywpas.models import Profile
 
-from .test_models import INTERFACE_STATUS, SCAN_RESULTS
+from .test_models import (
+    INTERFACE_STATUS, SCAN_RESULTS, LIST_NETWORKS, BSS_RANGE,
+)
 
 
 def network_iter():
@@ -23,14 +27,18 @@ def network_iter():
 
 
 class MockServer(object):
-    def __init__(self):
-        self.sock_path = tempfile.mkdtemp()
-        sock_file = tempnam(self.sock_path)
+    def __init__(self, sock_path=None, name=None):
+        self.sock_path = sock_path or tempfile.mkdtemp()
+        sock_file = os.path.join(self.sock_path, name) if name \
+            else tempnam(self.sock_path)
         self.name = basename(sock_file)
         self._running = True
         self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         self._sock.bind(sock_file)
         self._commands = []
+        self._monitors = set()
+        self.replies = {}
+        self.events = {}
         self.command_received = threading.Event()
         self.start()
 
@@ -41,20 +49,50 @@ class MockServer(object):
                 cmd, address = self._sock.recvfrom(1024)
                 self._commands.append(cmd)
                 self.command_received.set()
-                if cmd == b'PING':
-                    self._sock.sendto(b'PONG', address)
-                elif cmd == b'STATUS':
-                    self._sock.sendto(INTERFACE_STATUS, address)
-                elif cmd == b'SCAN_RESULTS':
-                    self._sock.sendto(next(networks), address)
-                elif cmd == b'ADD_NETWORK':
-                    self._sock.sendto(b'1', address)
-                elif cmd == b'LIST_NETWORKS':
-                    self._sock.sendto(b'1', address)
-                elif cmd == b'SELECT_NETWORK 1':
-                    self._sock.sendto(b'foobar', address)
-                elif cmd.startswith(b'GET_NETWORK 1'):
-                    self._sock.sendto(b'foobar', address)
+                try:
+                    self._reply(cmd, address, networks)
+                except OSError:
+                    # Client went away before reading the reply.
+                    pass
+                for event in self.events.get(cmd, []):
+                    self.emit(event)
+
+    def _reply(self, cmd, address, networks):
+        if cmd in self.replies:
+            # None simulates a command that is never answered.
+            if self.replies[cmd] is not None:
+                self._sock.sendto(self.replies[cmd], address)
+        elif cmd == b'PING':
+            self._sock.sendto(b'PONG', address)
+        elif cmd == b'ATTACH':
+            self._monitors.add(address)
+            self._sock.sendto(b'OK', address)
+        elif cmd == b'DETACH':
+            self._monitors.discard(address)
+            self._sock.sendto(b'OK', address)
+        elif cmd == b'SCAN':
+            self._sock.sendto(b'OK', address)
+            self.emit(b'<3>CTRL-EVENT-SCAN-STARTED ')
+            self.emit(b'<3>CTRL-EVENT-SCAN-RESULTS ')
+        elif cmd == b'STATUS':
+            self._sock.sendto(INTERFACE_STATUS, address)
+        elif cmd == b'SCAN_RESULTS':
+            self._sock.sendto(next(networks), address)
+        elif cmd == b'ADD_NETWORK':
+            self._sock.sendto(b'1', address)
+        elif cmd == b'LIST_NETWORKS':
+            self._sock.sendto(LIST_NETWORKS, address)
+        elif cmd.startswith(b'GET_NETWORK 1'):
+            self._sock.sendto(b'foobar', address)
+        else:
+            self._sock.sendto(b'OK', address)
+
+    def emit(self, event):
+        for address in list(self._monitors):
+            try:
+                self._sock.sendto(event, address)
+            except OSError:
+                self._monitors.discard(address)
 
     @property
     def last_command(self):
@@ -91,6 +129,129 @@ class ControlTestCase(TestCase):
         with self.assertRaises(FileNotFoundError):
             self.control.interface('foobar')
 
+    def test_map(self):
+        slow = MockServer(sock_path=self.server.sock_path)
+        try:
+            slow.replies[b'SAVE_CONFIG'] = None
+            self.server.replies[b'SAVE_CONFIG'] = b'FAIL'
+            started = time.time()
+            results = self.control.map('save_config', timeout=0.5)
+            self.assertLess(time.time() - started, 1.0)
+            self.assertIsInstance(results[slow.name], TimeoutError)
+            self.assertIsInstance(results[self.server.name],
+                                  CommandFailedError)
+            statuses = self.control.status_all()
+            self.assertEqual(2, len(statuses))
+            for status in statuses.values():
+                self.assertEqual('COMPLETED', status.wpa_state)
+        finally:
+            self.control.close()
+            slow.stop()
+
+    def test_watch(self):
+        added, removed = [], []
+        self.control.watch(added.append, removed.append, interval=0.1)
+        self.assertEqual([], added)
+        hotplug = MockServer(sock_path=self.server.sock_path)
+        hotplug.stop()
+        for _ in range(50):
+            if added:
+                break
+            time.sleep(0.05)
+        self.assertEqual([hotplug.name], [i.name for i in added])
+        self.assertIs(added[0], self.control.interface(hotplug.name))
+        self.assertEqual(2, len(self.control.interfaces))
+        os.remove(os.path.join(hotplug.sock_path, hotplug.name))
+        for _ in range(50):
+            if removed:
+                break
+            time.sleep(0.05)
+        self.assertEqual([hotplug.name], [i.name for i in removed])
+        self.assertEqual([self.server.name], self.control.interface_names())
+
+    def test_added(self):
+        interface, = self.control.interfaces
+        with mock.patch.object(self.control, '_create') as create:
+            # Already known, nothing is created.
+            self.control._added(self.server.name)
+        create.assert_not_called()
+        self.assertIs(interface, self.control.interface(self.server.name))
+        with self.assertRaises(FileNotFoundError):
+            self.control._added('foobar')
+        self.assertEqual([self.server.name], self.control.interface_names())
+
+
+class SocketWatcherTestCase(TestCase):
+    def test_poll(self):
+        server = MockServer()
+        names = set()
+        watcher = SocketWatcher(server.sock_path, names.add, names.discard,
+                                interval=0.05, use_inotify=False)
+        watcher.start()
+        try:
+            self.assertFalse(watcher.inotify)
+            self.assertEqual({server.name}, names)
+            # Client sockets are not interfaces.
+            Channel(os.path.join(server.sock_path, server.name)).open()
+            os.remove(os.path.join(server.sock_path, server.name))
+            time.sleep(0.2)
+            self.assertEqual(set(), names)
+        finally:
+            watcher.stop()
+            server.stop()
+
+    def test_add_failed(self):
+        server = MockServer()
+        names = []
+
+        def _add(name):
+            names.append(name)
+            if len(names) == 1:
+                raise OSError('Not ready')
+
+        watcher = SocketWatcher(server.sock_path, _add, names.remove,
+                                interval=0.05, use_inotify=False)
+        watcher.start()
+        try:
+            # Reported again until added.
+            for _ in range(20):
+                if server.name in watcher.names:
+                    break
+                time.sleep(0.05)
+            self.assertEqual([server.name] * 2, names)
+            self.assertEqual({server.name}, watcher.names)
+        finally:
+            watcher.stop()
+            server.stop()
+
+
+    def test_inotify_directory_removed(self):
+        path = tempfile.mkdtemp()
+        names = set()
+        watcher = SocketWatcher(path, names.add, names.discard,
+                                interval=0.05)
+        watcher.start()
+        try:
+            if not watcher.inotify:
+                self.skipTest('inotify not available')
+            os.rmdir(path)
+            time.sleep(0.2)
+            self.assertFalse(watcher.inotify)
+            # Recreated, as when wpa_supplicant starts again.
+            os.mkdir(path)
+            server = MockServer(sock_path=path)
+            try:
+                time.sleep(0.2)
+                self.assertTrue(watcher.inotify)
+                self.assertEqual({server.name}, names)
+                os.remove(os.path.join(path, server.name))
+                time.sleep(0.2)
+                self.assertEqual(set(), names)
+            finally:
+                server.stop()
+        finally:
+            watcher.stop()
+
 
 class InterfaceTestCase(TestCase):
     def setUp(self):
@@ -131,31 +292,293 @@ class InterfaceTestCase(TestCase):
         self.assertEqual(self.server.last_command, b'STATUS')
         self.assertEqual(status.wpa_state, 'COMPLETED')
 
+    def test_monitor(self):
+        events = []
+        self.client.monitor.subscribe(events.append, 'CTRL-EVENT-CONNECTED')
+        self.assertCommand(b'ATTACH')
+        self.server.emit(b'<3>CTRL-EVENT-SCAN-STARTED ')
+        self.server.emit(b'<3>CTRL-EVENT-CONNECTED - Connection to '
+                         b'08:02:8e:9c:9d:15 completed [id=0 id_str=]')
+        for _ in range(10):
+            if events:
+                break
+            time.sleep(0.1)
+        self.assertEqual(1, len(events))
+        self.assertEqual('08:02:8e:9c:9d:15', events[0].bssid)
+        self.client.close()
+        self.assertCommand(b'DETACH')
+
     def test_scan(self):
         networks = []
         scan = self.client.background_scan(lambda x: networks.append(x))
-        time.sleep(0.2)
         self.assertCommand(b'SCAN')
-        time.sleep(4.1)
-        self.assertCommand(b'SCAN_RESULTS')
+        # Each results event triggers a single fetch.
+        for _ in range(3):
+            self.assertCommand(b'SCAN_RESULTS')
+            self.server.emit(b'<3>CTRL-EVENT-SCAN-RESULTS ')
+        for _ in range(10):
+            if len(networks) == 4:
+                break
+            time.sleep(0.1)
         self.assertEqual(4, len(networks))
         scan.stop()
         self.assertFalse(scan._running)
         # Should be fine to call it again.
         scan.stop()
 
+    def test_scan_busy(self):
+        networks = []
+        self.server.replies[b'SCAN'] = b'FAIL-BUSY'
+        scan = self.client.background_scan(networks.append)
+        self.assertCommand(b'SCAN')
+        self.server.emit(b'<3>CTRL-EVENT-SCAN-RESULTS ')
+        for _ in range(10):
+            if networks:
+                break
+            time.sleep(0.1)
+        self.assertEqual(1, len(networks))
+        self.assertTrue(scan._t.is_alive())
+        scan.stop()
+
+    def test_threads(self):
+        errors = []
+
+        def _worker():
+            try:
+                for _ in range(20):
+                    self.client.ping()
+                    self.assertEqual('COMPLETED', self.client.status().wpa_state)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+
+    def test_scan_known(self):
+        self.server.replies[b'SCAN_RESULTS'] = SCAN_RESULTS
+        self.client.scan_results()
+        self.assertEqual([2452, 5560], self.client.scan_frequencies(
+            ['NachoWIFI', 'MotoVAP_M91336SA0R45']))
+        self.client.scan_known(['NachoWIFI', 'Hidden'])
+        self.assertCommand(b'SCAN freq=2452 ssid 4e6163686f57494649 '
+                           b'ssid 48696464656e')
+
+    def test_iter_scan_results(self):
+        self.server.replies[b'SCAN_RESULTS'] = SCAN_RESULTS
+        networks = self.client.iter_scan_results(ssids=['NachoWIFI'])
+        self.assertEqual(['08:02:8e:9c:9d:15'], [n.bssid for n in networks])
+        self.assertEqual(0, len(self.client.scan_index))
+
+    def test_scan_results_large(self):
+        rows = [
+            b'00:00:00:00:%02x:%02x\t2412\t-50\t[ESS]\tNetwork%i' % (
+                i // 256, i % 256, i)
+            for i in range(200)
+        ]
+        self.server.replies[b'SCAN_RESULTS'] = \
+            SCAN_RESULTS.split(b'\n')[0] + b'\n' + b'\n'.join(rows)
+        self.assertGreater(len(self.server.replies[b'SCAN_RESULTS']), 4096)
+        networks = self.client.scan_results()
+        self.assertEqual(200, len(networks))
+        self.assertEqual('Network199', networks[-1].ssid)
+
+    def test_iter_bss(self):
+        first, second = BSS_RANGE.split(b'====\n')
+        self.server.replies[b'BSS RANGE=0- MASK=0x20087'] = first + b'===='
+        self.server.replies[b'BSS RANGE=4- MASK=0x20087'] = second
+        entries = list(self.client.iter_bss(['bssid', 'freq', 'level']))
+        self.assertEqual([3, 7], [bss.id for bss in entries])
+        self.assertEqual(-79, entries[1].level)
+
+    def test_bss(self):
+        self.server.replies[b'BSS 08:02:8e:9c:9d:15 MASK=0x181acf'] = \
+            BSS_RANGE.split(b'====\n')[0]
+        self.server.replies[b'BSS 00:00:00:00:00:00 MASK=0x181acf'] = b'FAIL'
+        self.assertEqual(56, self.client.bss('08:02:8e:9c:9d:15').snr)
+        self.assertIsNone(self.client.bss('00:00:00:00:00:00'))
+
     def test_add_network(self):
         self.client.add_network(Profile(psk='foobar'))
-        self.assertCommand(b'SET_NETWORK 1 psk foobar')
+        self.assertCommand(b'SET_NETWORK 1 psk "foobar"')
+        # Unset fields are not sent.
+        self.assertNotIn(b'SET_NETWORK 1 proto None', self.server._commands)
+
+    def test_add_network_fail(self):
+        self.server.replies[b'SET_NETWORK 1 psk "foobar"'] = b'FAIL'
+        profile = Profile(ssid='foobar', psk='foobar')
+        with self.assertRaises(CommandFailedError):
+            self.client.add_network(profile)
+        self.assertCommand(b'REMOVE_NETWORK 1')
+        self.assertIsNone(profile.id)
+        # Channel is still in sync.
+        self.client.ping()
 
     def test_connect(self):
         self.client.connect(Profile(psk='foobar'))
         self.assertCommand(b'SELECT_NETWORK 1')
 
+    def test_connect_wait(self):
+        self.server.events[b'SELECT_NETWORK 1'] = [
+            b'<3>CTRL-EVENT-SCAN-RESULTS ',
+            b"<3>SME: Trying to authenticate with 08:02:8e:9c:9d:15 "
+            b"(SSID='foobar' freq=2452 MHz)",
+            b"<3>Trying to associate with 08:02:8e:9c:9d:15 "
+            b"(SSID='foobar' freq=2452 MHz)",
+            b'<3>Associated with 08:02:8e:9c:9d:15',
+            b'<3>WPA: Key negotiation completed with 08:02:8e:9c:9d:15 '
+            b'[PTK=CCMP GTK=CCMP]',
+            b'<3>CTRL-EVENT-CONNECTED - Connection to 08:02:8e:9c:9d:15 '
+            b'completed [id=1 id_str=]',
+        ]
+        result = self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                     timeout=2.0)
+        self.assertTrue(result.success)
+        self.assertEqual('08:02:8e:9c:9d:15', result.bssid)
+        for phase in ('scan', 'auth', 'assoc', 'handshake'):
+            self.assertGreaterEqual(getattr(result, phase), 0)
+        self.assertGreaterEqual(result.total, result.handshake)
+
+    def test_connect_wait_fail(self):
+        self.server.events[b'SELECT_NETWORK 1'] = [
+            b"<3>Trying to associate with 08:02:8e:9c:9d:15 "
+            b"(SSID='foobar' freq=2452 MHz)",
+            b'<3>CTRL-EVENT-SSID-TEMP-DISABLED id=1 ssid="foobar" '
+            b'auth_failures=1 duration=10 reason=WRONG_KEY',
+        ]
+        result = self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                     timeout=2.0)
+        self.assertFalse(result.success)
+        self.assertEqual('CTRL-EVENT-SSID-TEMP-DISABLED: WRONG_KEY',
+                         result.reason)
+        self.assertIsNone(result.auth)
+        self.assertIsNone(result.handshake)
+
+    def test_connect_wait_other_network(self):
+        self.server.events[b'SELECT_NETWORK 1'] = [
+            b'<3>CTRL-EVENT-CONNECTED - Connection to 08:02:8e:9c:9d:16 '
+            b'completed [id=0 id_str=]',
+            b'<3>CTRL-EVENT-SSID-TEMP-DISABLED id=0 ssid="other" '
+            b'auth_failures=1 duration=10 reason=WRONG_KEY',
+            b'<3>CTRL-EVENT-CONNECTED - Connection to 08:02:8e:9c:9d:15 '
+            b'completed [id=1 id_str=]',
+        ]
+        result = self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                     timeout=2.0)
+        self.assertTrue(result.success)
+        self.assertEqual('08:02:8e:9c:9d:15', result.bssid)
+
+    def test_connect_wait_unacknowledged(self):
+        # Events before SELECT_NETWORK is answered are not its outcome.
+        self.server.replies[b'SELECT_NETWORK 1'] = None
+        self.server.events[b'SELECT_NETWORK 1'] = [
+            b'<3>CTRL-EVENT-CONNECTED - Connection to 08:02:8e:9c:9d:15 '
+            b'completed [id=1 id_str=]',
+        ]
+        result = self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                     timeout=0.3)
+        self.assertFalse(result.success)
+        self.assertEqual('TIMEOUT', result.reason)
+
+    def test_connect_wait_rejected(self):
+        self.server.replies[b'SELECT_NETWORK 1'] = b'FAIL'
+        with self.assertRaises(CommandFailedError):
+            self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                timeout=2.0)
+
+    def test_connect_wait_timeout(self):
+        result = self.client.connect(Profile(id=1, ssid='foobar'), wait=True,
+                                     timeout=0.2)
+        self.assertFalse(result.success)
+        self.assertEqual('TIMEOUT', result.reason)
+
     def test_list_networks(self):
         networks = self.client.list_networks()
-        self.assertCommand(b'GET_NETWORK 1 pairwise')
+        self.assertEqual(self.server.last_command, b'LIST_NETWORKS')
         self.assertEqual(1, len(networks))
+        self.assertEqual(1, networks[0].id)
+        self.assertEqual('foobar', networks[0].ssid)
+        self.assertIsNone(networks[0].ciphers)
+
+    def test_list_networks_details(self):
+        networks = self.client.list_networks(details=True)
+        self.assertCommand(b'GET_NETWORK 1 pairwise')
+        self.assertEqual('foobar', networks[0].ciphers)
+
+    def test_list_networks_paged(self):
+        rows = [b'%i\tNetwork%i\tany\t' % (i, i) for i in range(400)]
+        self.server.replies[b'LIST_NETWORKS'] = \
+            LIST_NETWORKS.split(b'\n')[0] + b'\n' + b'\n'.join(rows[:300])
+        self.server.replies[b'LIST_NETWORKS LAST_ID=299'] = \
+            LIST_NETWORKS.split(b'\n')[0] + b'\n' + b'\n'.join(rows[300:])
+        networks = list(self.client.iter_networks())
+        self.assertEqual(400, len(networks))
+        self.assertEqual(399, networks[-1].id)
+
+    def test_sync_profiles(self):
+        self.server.replies[b'ADD_NETWORK'] = b'2'
+        existing = Profile(ssid='foobar', key_mgmt='foobar', proto='foobar',
+                           ciphers='foobar')
+        result = self.client.sync_profiles(
+            [existing, Profile(ssid='new', psk='password')])
+        self.assertEqual(['new'], [p.ssid for p in result.added])
+        self.assertEqual(2, result.added[0].id)
+        self.assertEqual([], result.updated)
+        self.assertEqual([], result.removed)
+        self.assertEqual(1, existing.id)
+        self.assertCommand(b'SET_NETWORK 2 ssid "new"')
+        self.assertEqual(1, self.server._commands.count(b'SAVE_CONFIG'))
+        self.assertNotIn(b'SET_NETWORK 1 key_mgmt foobar',
+                         self.server._commands)
+
+    def test_sync_profiles_unchanged(self):
+        profile = Profile(ssid='foobar', key_mgmt='WPA-PSK', psk='password')
+        self.client.sync_profiles([profile])
+        self.assertCommand(b'SET_NETWORK 1 key_mgmt WPA-PSK')
+        del self.server._commands[:]
+        self.server.replies[b'GET_NETWORK 1 key_mgmt'] = b'WPA-PSK'
+        result = self.client.sync_profiles([profile], save=False)
+        self.assertFalse(result)
+        self.assertFalse([cmd for cmd in self.server._commands
+                          if cmd.startswith(b'SET_NETWORK')])
+
+    def test_sync_profiles_normalized(self):
+        self.server.replies[b'GET_NETWORK 1 key_mgmt'] = b'WPA-PSK WPA-EAP'
+        self.server.replies[b'GET_NETWORK 1 proto'] = b'RSN'
+        self.server.replies[b'GET_NETWORK 1 pairwise'] = b'CCMP TKIP'
+        self.server.replies[b'GET_NETWORK 1 priority'] = b'5'
+        profile = Profile(ssid='foobar', key_mgmt='WPA-EAP WPA-PSK',
+                          proto='WPA2', ciphers='TKIP CCMP',
+                          extra={'priority': '5'})
+        result = self.client.sync_profiles([profile], save=False)
+        self.assertFalse(result)
+        self.assertFalse([cmd for cmd in self.server._commands
+                          if cmd.startswith(b'SET_NETWORK')])
+
+    def test_sync_profiles_bssid_extra(self):
+        self.server.replies[b'GET_NETWORK 1 priority'] = b'5'
+        profile = Profile(ssid='foobar', bssid='08:02:8e:9c:9d:15',
+                          extra={'priority': '7'})
+        result = self.client.sync_profiles([profile], save=False)
+        self.assertEqual([profile], result.updated)
+        self.assertCommand(b'SET_NETWORK 1 bssid 08:02:8e:9c:9d:15')
+        self.assertCommand(b'SET_NETWORK 1 priority 7')
+
+    def test_sync_profiles_rollback(self):
+        self.server.replies[b'ADD_NETWORK'] = b'2'
+        self.server.replies[b'SET_NETWORK 2 ssid "new"'] = b'FAIL'
+        with self.assertRaises(CommandFailedError):
+            self.client.sync_profiles([Profile(ssid='new')])
+        self.assertCommand(b'REMOVE_NETWORK 2')
+        self.assertNotIn(b'REMOVE_NETWORK 1', self.server._commands)
+
+    def test_sync_profiles_remove(self):
+        result = self.client.sync_profiles([])
+        self.assertEqual([1], [p.id for p in result.removed])
+        self.assertCommand(b'REMOVE_NETWORK 1')
 
     def test_remove_network(self):
         self.client.remove_network(Profile(id=1))
@@ -173,26 +596,153 @@ class InterfaceTestCase(TestCase):
         self.client.save_config()
         self.assertCommand(b'SAVE_CONFIG')
 
+    def restart_server(self):
+        "Simulate wpa_supplicant restarting."
+        self.server.stop()
+        os.remove(os.path.join(self.server.sock_path, self.server.name))
+        self.server = MockServer(self.server.sock_path, self.server.name)
+
+    def test_reconnect(self):
+        self.client.ping()
+        self.restart_server()
+        self.client.ping()
+        self.assertEqual([b'PING'], self.server._commands)
+
+    def test_reconnect_backoff(self):
+        self.client.ping()
+        self.server.stop()
+        with self.assertRaises(ConnectionRefusedError):
+            self.client.ping()
+        os.remove(os.path.join(self.server.sock_path, self.server.name))
+        self.server = MockServer(self.server.sock_path, self.server.name)
+        # Too soon to try again.
+        with self.assertRaises(ConnectionRefusedError):
+            self.client.ping()
+        self.assertEqual([], self.server._commands)
+        time.sleep(0.15)
+        self.client.ping()
+
+    def test_monitor_reattach(self):
+        events = []
+        self.client.monitor.subscribe(events.append, 'CTRL-EVENT-CONNECTED')
+        self.server.emit(b'<2>CTRL-EVENT-TERMINATING ')
+        self.restart_server()
+        for _ in range(50):
+            if b'ATTACH' in self.server._commands:
+                break
+            time.sleep(0.05)
+        self.server.emit(b'<3>CTRL-EVENT-CONNECTED - Connection to '
+                         b'08:02:8e:9c:9d:15 completed [id=1 id_str=]')
+        for _ in range(20):
+            if events:
+                break
+            time.sleep(0.05)
+        self.assertEqual(1, len(events))
+
+    def test_monitor_keepalive(self):
+        client = self.client.control.interface(self.server.name,
+                                               recv_timeout=0.2)
+        self.server.replies[b'PING'] = None
+        with mock.patch('pywpas.interface.KEEPALIVE_INTERVAL', 0.2):
+            client.monitor
+            for _ in range(40):
+                if self.server._commands.count(b'ATTACH') > 1:
+                    break
+                time.sleep(0.05)
+            # The unanswered PING was given up on, and its callback with it.
+            self.assertLessEqual(len(client._monitor._replies), 1)
+            client.close()
+        self.assertGreater(self.server._commands.count(b'ATTACH'), 1)
+
+    def test_monitor_post_detached(self):
+        events = []
+        monitor = self.client.monitor
+        monitor.subscribe(events.append, 'CTRL-EVENT-CONNECTED')
+        self.server.emit(b'<2>CTRL-EVENT-TERMINATING ')
+        for _ in range(20):
+            if not monitor._channel.connected:
+                break
+            time.sleep(0.05)
+        # Doesn't open a connection that was never attached.
+        with self.assertRaises(ConnectionError):
+            monitor.post(b'PING')
+        self.restart_server()
+        for _ in range(50):
+            if b'ATTACH' in self.server._commands:
+                break
+            time.sleep(0.05)
+        self.server.emit(b'<3>CTRL-EVENT-CONNECTED - Connection to '
+                         b'08:02:8e:9c:9d:15 completed [id=1 id_str=]')
+        for _ in range(20):
+            if events:
+                break
+            time.sleep(0.05)
+        self.assertEqual(1, len(events))
+
     def test_stop_ap(self):
         self.client.stop_ap()
         self.assertCommand(b'STOP_AP')
 
 
+class ChannelTestCase(TestCase):
+    def setUp(self):
+        self.server = MockServer()
+        self.channel = Channel(
+            os.path.join(self.server.sock_path, self.server.name),
+            recv_timeout=0.5)
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop()
+
+    def test_pipeline(self):
+        replies = self.channel.pipeline([b'PING', b'ADD_NETWORK', b'SCAN'])
+        self.assertEqual([b'PONG', b'1', b'OK'], replies)
+        self.assertEqual(0, self.channel.outstanding)
+
+    def test_stale_reply(self):
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.channel.command(b'SAVE_CONFIG')
+        # A late reply to the abandoned command is discarded.
+        self.server._sock.sendto(b'OK', self.channel._client_path)
+        self.assertEqual(b'PONG', self.channel.request(b'PING'))
+
+    def test_command_fail(self):
+        self.server.replies[b'DISCONNECT'] = b'FAIL'
+        with self.assertRaises(CommandFailedError):
+            self.channel.command(b'DISCONNECT')
+
+    def test_lost_reply(self):
+        # wpa_supplicant dropped this reply, it will never come.
+        self.server.replies[b'SAVE_CONFIG'] = None
+        with self.assertRaises(TimeoutError):
+            self.channel.command(b'SAVE_CONFIG')
+        client_path = self.channel._client_path
+        self.assertEqual(b'PONG', self.channel.request(b'PING'))
+        self.assertEqual(b'PONG', self.channel.request(b'PING'))
+        # The socket was replaced rather than waiting on the lost reply.
+        self.assertNotEqual(client_path, self.channel._client_path)
+
+
 class TimeoutTestCase(TestCase):
     def setUp(self):
         self.server = MockServer()
-        self.client = Control(sock_path=self.server.sock_path).interface(self.server.name, send_timeout=1.0, recv_timeout=1.0)
-        self.client._ensure_connection()
+        self.channel = Channel(
+            os.path.join(self.server.sock_path, self.server.name),
+            recv_timeout=1.0)
+        self.channel.open()
         # Server is stopped, so timeouts will occur.
         self.server.stop()
 
     def tearDown(self):
-        self.client.close()
+        self.channel.close()
 
     def test_send_timeout(self):
         with self.assertRaises(ConnectionRefusedError):
-            self.client._send('PING')
+            self.channel.send('PING')
 
     def test_recv_timeout(self):
+        self.channel._outstanding = 1
         with self.assertRaises(TimeoutError):
-            self.client._recv()
+            self.channel.recv()